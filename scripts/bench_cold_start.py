@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark de cold start do LiteLLM Gateway
+Sobe o gateway N vezes e mede o tempo do spawn do processo até a primeira resposta 200
+em /health, junto com o perfil de inicialização por fase reportado pelo próprio serviço.
+
+Requer Redis acessível em REDIS_URL (o lifespan conecta no start).
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Any, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIR = os.path.join(ROOT, "services", "litellm")
+DEFAULT_CONFIG = os.path.join(ROOT, "config", "litellm_config.yaml")
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def first_health(port: int, timeout: float, process: subprocess.Popen) -> Optional[Dict[str, Any]]:
+    """Faz polling de /health até responder 200 (ou o processo morrer)"""
+    url = f"http://127.0.0.1:{port}/health"
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return json.loads(response.read())
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def run_once(args: argparse.Namespace) -> Tuple[Optional[float], Optional[Dict[str, Any]]]:
+    env = {
+        **os.environ,
+        "LITELLM_CONFIG_PATH": args.config,
+        "LITELLM_PORT": str(args.port),
+        "LITELLM_RELOAD": "",
+        "LITELLM_WORKERS": "1",
+        "CONFIG_RELOAD_INTERVAL": "0",
+    }
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=SERVICE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL if not args.verbose else None
+    )
+    try:
+        health = first_health(args.port, args.timeout, process)
+        elapsed = time.perf_counter() - start if health else None
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return elapsed, (health or {}).get("startup")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=4900)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Tempo máximo até a primeira resposta")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar stderr do gateway")
+    args = parser.parse_args()
+
+    print(f"🚀 {args.runs} cold starts ({args.config})")
+
+    totals: List[float] = []
+    phases: Dict[str, List[float]] = {}
+    for i in range(args.runs):
+        elapsed, startup = run_once(args)
+        if elapsed is None:
+            print(f"  #{i + 1}: ❌ sem resposta em {args.timeout:.0f}s (use --verbose)")
+            continue
+        totals.append(elapsed)
+        for name, seconds in ((startup or {}).get("phases") or {}).items():
+            phases.setdefault(name, []).append(seconds)
+        print(f"  #{i + 1}: {elapsed * 1000:8.1f} ms até a primeira requisição")
+
+    if not totals:
+        sys.exit(1)
+
+    print(f"\n📊 Cold start até a primeira requisição")
+    print(f"  p50 {percentile(totals, 0.5) * 1000:.1f} ms, min {min(totals) * 1000:.1f} ms, max {max(totals) * 1000:.1f} ms")
+
+    if phases:
+        print(f"\n  {'Fase':<18}{'p50 ms':>9}")
+        for name, values in phases.items():
+            print(f"  {name:<18}{percentile(values, 0.5) * 1000:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end do LiteLLM Gateway
+Dispara uma mistura de intents com e sem streaming em /ai/chat/completions e
+reporta throughput, TTFT, latência, CPU por token e operações Redis por requisição.
+
+Para rodar offline, habilite mock_provider no config.yaml e suba o provider simulado:
+    python services/litellm/mock_provider.py --config config/litellm_config.yaml
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+LITELLM_URL = os.getenv("LITELLM_URL", "http://localhost:4000")
+LITELLM_API_KEY = os.getenv("LITELLM_MASTER_KEY", "sk-master-dev")
+
+# (intent, peso, mensagem, user_value)
+SCENARIOS = [
+    ("greeting", 0.30, "Oi, bom dia! Tudo bem?", "standard"),
+    ("product_query", 0.30, "Quanto custa o plano profissional com WhatsApp?", "standard"),
+    ("technical_support", 0.20, "O agente parou de responder e aparece um erro na integração", "standard"),
+    ("sales_negotiation", 0.10, "Quero negociar um desconto para comprar 50 licenças", "high"),
+    ("general_query", 0.10, "Me conte mais sobre a empresa e como funciona o onboarding", "standard"),
+]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def fmt_ms(value: Optional[float]) -> str:
+    return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+
+class Result:
+    __slots__ = ("intent", "stream", "status", "ttft", "latency", "tokens")
+
+    def __init__(self, intent: str, stream: bool):
+        self.intent = intent
+        self.stream = stream
+        self.status = 0
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.tokens = 0
+
+
+async def run_request(client: httpx.AsyncClient, stream: bool, max_tokens: int) -> Result:
+    intent, _, message, user_value = random.choices(SCENARIOS, weights=[s[1] for s in SCENARIOS])[0]
+    result = Result(intent, stream)
+
+    payload = {
+        "messages": [
+            {"role": "system", "content": "Você é um agente de vendas da empresa."},
+            {"role": "user", "content": message},
+        ],
+        "metadata": {
+            "organization_id": f"org_bench_{random.randint(1, 20)}",
+            "user_value": user_value,
+            "plan": random.choice(["starter", "professional", "enterprise"]),
+        },
+        "max_tokens": max_tokens,
+        "stream": stream,
+    }
+
+    start = time.perf_counter()
+    try:
+        if stream:
+            async with client.stream("POST", "/ai/chat/completions", json=payload) as response:
+                result.status = response.status_code
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    chunk = json.loads(line[6:])
+                    choices = chunk.get("choices") or []
+                    if choices and (choices[0].get("delta") or {}).get("content"):
+                        if result.ttft is None:
+                            result.ttft = time.perf_counter() - start
+                        result.tokens += 1
+        else:
+            response = await client.post("/ai/chat/completions", json=payload)
+            result.status = response.status_code
+            if response.status_code == 200:
+                result.ttft = time.perf_counter() - start
+                result.tokens = response.json().get("usage", {}).get("completion_tokens", 0)
+    except httpx.HTTPError:
+        result.status = -1
+
+    result.latency = time.perf_counter() - start
+    return result
+
+
+async def redis_commands(redis_url: Optional[str]) -> Optional[int]:
+    """Total de comandos processados pelo Redis (INFO stats)"""
+    if not redis_url:
+        return None
+    import redis.asyncio as redis
+
+    client = redis.from_url(redis_url)
+    try:
+        info = await client.info("stats")
+        return int(info["total_commands_processed"])
+    finally:
+        await client.close()
+
+
+def process_cpu(pid: Optional[int]) -> Optional[float]:
+    """CPU (user + system) consumida pelo gateway e seus workers"""
+    if not pid:
+        return None
+    import psutil
+
+    process = psutil.Process(pid)
+    total = 0.0
+    for p in [process] + process.children(recursive=True):
+        try:
+            times = p.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            continue
+    return total
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=LITELLM_URL)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stream-ratio", type=float, default=0.6, help="Fração de requisições com streaming")
+    parser.add_argument("--max-tokens", type=int, default=120)
+    parser.add_argument("--gateway-pid", type=int, help="PID do gateway para medir CPU por token")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL"), help="Redis do gateway para contar operações")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"Authorization": f"Bearer {LITELLM_API_KEY}"},
+        timeout=httpx.Timeout(120.0, connect=10.0),
+        limits=limits
+    ) as client:
+        async def bounded() -> Result:
+            async with semaphore:
+                return await run_request(client, random.random() < args.stream_ratio, args.max_tokens)
+
+        print(f"🚀 {args.requests} requisições, concorrência {args.concurrency}, streaming {args.stream_ratio:.0%}")
+
+        redis_before = await redis_commands(args.redis_url)
+        cpu_before = process_cpu(args.gateway_pid)
+        start = time.perf_counter()
+
+        results = await asyncio.gather(*[bounded() for _ in range(args.requests)])
+
+        elapsed = time.perf_counter() - start
+        cpu_after = process_cpu(args.gateway_pid)
+        redis_after = await redis_commands(args.redis_url)
+
+    ok = [r for r in results if r.status == 200]
+    tokens = sum(r.tokens for r in ok)
+    statuses: Dict[Any, int] = {}
+    for r in results:
+        statuses[r.status] = statuses.get(r.status, 0) + 1
+
+    print(f"\n📊 Resultado ({elapsed:.1f}s)")
+    print(f"  Status:         {dict(sorted(statuses.items(), key=lambda kv: str(kv[0])))}")
+    print(f"  Throughput:     {len(ok) / elapsed:.1f} req/s, {tokens / elapsed:.0f} tokens/s")
+
+    print(f"\n  {'':<22}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for label, values in [
+        ("TTFT (stream)", [r.ttft for r in ok if r.stream and r.ttft is not None]),
+        ("Latência (stream)", [r.latency for r in ok if r.stream]),
+        ("Latência (sem stream)", [r.latency for r in ok if not r.stream]),
+    ]:
+        print(f"  {label:<22}{fmt_ms(percentile(values, 0.5))} {fmt_ms(percentile(values, 0.9))} {fmt_ms(percentile(values, 0.99))}")
+
+    print(f"\n  {'Intent':<22}{'req':>6}{'p50 ms':>9}")
+    for intent, *_ in SCENARIOS:
+        latencies = [r.latency for r in ok if r.intent == intent]
+        print(f"  {intent:<22}{len(latencies):>6}{fmt_ms(percentile(latencies, 0.5))}")
+
+    if cpu_before is not None and cpu_after is not None and tokens:
+        cpu = cpu_after - cpu_before
+        print(f"\n  CPU do gateway: {cpu:.2f}s ({cpu / tokens * 1e6:.0f} µs/token, {cpu / max(len(ok), 1) * 1000:.2f} ms/req)")
+    if redis_before is not None and redis_after is not None:
+        # Descontar o INFO da primeira medição
+        ops = redis_after - redis_before - 1
+        print(f"  Redis: {ops} comandos ({ops / max(len(results), 1):.1f} por requisição)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
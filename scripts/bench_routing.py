@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark da decisão de roteamento do LiteLLM Gateway
+Compara a varredura do YAML a cada requisição com o motor compilado
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "litellm"))
+
+from routing_engine import RoutingTable, IntentMatcher, load_config  # noqa: E402
+
+CASES = [
+    ("Oi, bom dia!", "standard", 120),
+    ("Quanto custa o plano anual?", "standard", 900),
+    ("O sistema está com erro e não funciona", "standard", 3500),
+    ("Quero negociar um desconto para comprar 50 licenças", "high", 1500),
+    ("Me conte mais sobre a empresa", "standard", 8000),
+]
+
+
+def legacy_intent(message: str) -> str:
+    """Implementação anterior: várias varreduras any(word in message)"""
+    message_lower = message.lower()
+
+    if any(word in message_lower for word in ["oi", "olá", "bom dia", "boa tarde", "boa noite"]):
+        return "greeting"
+    elif any(word in message_lower for word in ["preço", "custo", "valor", "quanto custa"]):
+        return "product_query"
+    elif any(word in message_lower for word in ["erro", "problema", "não funciona", "ajuda"]):
+        return "technical_support"
+    elif any(word in message_lower for word in ["comprar", "adquirir", "negociar", "desconto"]):
+        return "sales_negotiation"
+    else:
+        return "general_query"
+
+
+def legacy_route(config, intent: str, user_value: str, tokens: int):
+    """Implementação anterior: loop sobre model_rules e model_list"""
+    for rule in config["router_settings"]["model_rules"]:
+        conditions = rule["conditions"]
+
+        if "intent" in conditions and intent not in conditions["intent"]:
+            continue
+        if "user_value" in conditions and user_value != conditions["user_value"]:
+            continue
+        if "max_tokens" in conditions and tokens > conditions["max_tokens"]:
+            continue
+
+        candidates = [
+            model for model in rule.get("preferred_models", [])
+            if any(m["model_name"] == model for m in config["model_list"])
+        ]
+        if candidates:
+            return candidates[0]
+    return "tier1/llama-3.2-3b"
+
+
+def legacy_cost(config, model: str) -> float:
+    for model_config in config["model_list"]:
+        if model_config["model_name"] == model:
+            return model_config.get("model_info", {}).get("cost_per_token", 0)
+    return 0
+
+
+def bench(label: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call = seconds / (number * len(CASES)) * 1e6
+    print(f"  {label:<28} {per_call:8.2f} µs/decisão")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default=os.path.join(ROOT, "config", "litellm_config.yaml"))
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    table = RoutingTable(config)
+    matcher = IntentMatcher()
+
+    # As duas implementações precisam decidir igual
+    for message, user_value, tokens in CASES:
+        intent = legacy_intent(message)
+        assert matcher.match(message) == intent, message
+        rule = table.match(intent, user_value, tokens)
+        compiled_model = rule.candidates[0] if rule else table.fallback_model
+        assert compiled_model == legacy_route(config, intent, user_value, tokens), message
+
+    def run_legacy():
+        for message, user_value, tokens in CASES:
+            model = legacy_route(config, legacy_intent(message), user_value, tokens)
+            legacy_cost(config, model)
+
+    def run_compiled():
+        for message, user_value, tokens in CASES:
+            rule = table.match(matcher.match(message), user_value, tokens)
+            table.cost_per_token(rule.candidates[0] if rule else table.fallback_model)
+
+    print(f"📊 Decisão de roteamento ({len(CASES)} casos, {args.number} iterações)")
+    legacy = bench("varredura do YAML", run_legacy, args.number)
+    compiled = bench("motor compilado", run_compiled, args.number)
+    print(f"  {'speedup':<28} {legacy / compiled:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
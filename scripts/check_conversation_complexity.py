@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Confere o agregado incremental de complexidade (ConversationComplexity)
+Simula conversas turno a turno e compara, a cada turno, com o recálculo do zero
+(ComplexityAnalyzer.analyze_conversation sobre histórico + mensagem atual).
+
+Roda no ambiente da API (importa app.services.ai_router).
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "api"))
+
+from app.services.ai_router import ComplexityAnalyzer, ConversationComplexity  # noqa: E402
+
+USER_MESSAGES = [
+    "oi",
+    "bom dia, tudo bem?",
+    "quanto custa o plano anual?",
+    "a integração com a API está com erro 500 no servidor",
+    "preciso de uma proposta com ROI e orçamento para 50 licenças",
+    "def main(): return 1 -- por que isso não funciona?",
+    "ok",
+]
+AGENT_MESSAGES = ["Claro!", "Pode me dar mais detalhes?", "O plano anual custa R$ 1.200."]
+
+
+def same(incremental: dict, rebuilt: dict) -> bool:
+    return all(
+        math.isclose(incremental.get(key, 0), rebuilt.get(key, 0), abs_tol=1e-9)
+        for key in ("score", "message_count", "total_words")
+    )
+
+
+def run_conversation(rng: random.Random, turns: int, with_ids: bool, window: int, retries: bool) -> int:
+    """Executa uma conversa; retorna o número de turnos conferidos"""
+    state = ConversationComplexity()
+    stored = []
+    next_id = 0
+
+    def message(role: str, content: str) -> dict:
+        nonlocal next_id
+        next_id += 1
+        return {"id": next_id, "role": role, "content": content} if with_ids else {"role": role, "content": content}
+
+    for turn in range(turns):
+        current = rng.choice(USER_MESSAGES)
+        history = stored[-window:] if window else stored
+
+        for attempt in range(2 if retries else 1):
+            state.sync(history, current, ComplexityAnalyzer.analyze_message(current))
+
+        rebuilt = ComplexityAnalyzer.analyze_conversation(stored + [{"role": "user", "content": current}])
+        assert same(state.analysis(), rebuilt), (turn, with_ids, window, state.analysis(), rebuilt)
+
+        # Mensagem e resposta persistidas depois do turno
+        stored.append(message("user", current))
+        stored.append(message("assistant", rng.choice(AGENT_MESSAGES)))
+
+    return turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    checked = 0
+    for _ in range(args.conversations):
+        for with_ids in (True, False):
+            for window in (0, 20):
+                # Histórico janelado sem ids não tem âncora: só a contagem absoluta, que exige o histórico inteiro
+                if window and not with_ids:
+                    continue
+                checked += run_conversation(rng, args.turns, with_ids, window, retries=rng.random() < 0.3)
+
+    print(f"✅ {checked} turnos: agregado incremental igual ao recálculo completo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Confere que a contagem de tokens da API é igual à do gateway
+O bloco entre os marcadores "Contagem de tokens" de services/api/app/services/token_budget.py
+precisa ser idêntico ao de services/litellm/token_budget.py (cópia canônica), senão os
+orçamentos de prompt da API e do gateway divergem.
+
+Não importa os serviços: compara o texto dos dois arquivos.
+"""
+
+import difflib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANONICAL = os.path.join("services", "litellm", "token_budget.py")
+COPIES = [os.path.join("services", "api", "app", "services", "token_budget.py")]
+
+BEGIN = "# --- Contagem de tokens (início) ---"
+END = "# --- Contagem de tokens (fim) ---"
+
+
+def shared_block(path: str) -> list:
+    with open(os.path.join(ROOT, path), encoding="utf-8") as f:
+        lines = f.read().splitlines(keepends=True)
+    starts = [i for i, line in enumerate(lines) if line.strip() == BEGIN]
+    ends = [i for i, line in enumerate(lines) if line.strip() == END]
+    if len(starts) != 1 or len(ends) != 1 or ends[0] < starts[0]:
+        raise SystemExit(f"❌ {path}: marcadores do bloco de contagem de tokens ausentes ou repetidos")
+    return lines[starts[0]:ends[0] + 1]
+
+
+def main():
+    canonical = shared_block(CANONICAL)
+    failed = False
+
+    for path in COPIES:
+        copy = shared_block(path)
+        if copy != canonical:
+            failed = True
+            sys.stdout.writelines(difflib.unified_diff(canonical, copy, CANONICAL, path))
+
+    if failed:
+        raise SystemExit("❌ Contagem de tokens divergiu da cópia canônica")
+    print(f"✅ Contagem de tokens igual em {CANONICAL} e {len(COPIES)} cópia(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,65 @@ class Settings(BaseSettings):
     
     # LiteLLM
     LITELLM_MASTER_KEY: Optional[str] = os.getenv("LITELLM_MASTER_KEY")
+    LITELLM_URL: str = os.getenv("LITELLM_URL", "http://litellm:4000")
+    LITELLM_API_KEY: Optional[str] = os.getenv("LITELLM_API_KEY", os.getenv("LITELLM_MASTER_KEY"))
+    # Config do gateway (janelas de contexto por tier) e limite de histórico por turno
+    LITELLM_CONFIG_PATH: str = os.getenv("LITELLM_CONFIG_PATH", "/config/litellm_config.yaml")
+    HISTORY_MAX_TOKENS: int = int(os.getenv("HISTORY_MAX_TOKENS", "4000"))
+    # Pool de conexões com o gateway (um client compartilhado por processo)
+    AI_GATEWAY_HTTP2: bool = os.getenv("AI_GATEWAY_HTTP2", "true").lower() == "true"
+    AI_GATEWAY_MAX_CONNECTIONS: int = int(os.getenv("AI_GATEWAY_MAX_CONNECTIONS", "100"))
+    AI_GATEWAY_MAX_KEEPALIVE: int = int(os.getenv("AI_GATEWAY_MAX_KEEPALIVE", "20"))
+    AI_GATEWAY_KEEPALIVE_EXPIRY: float = float(os.getenv("AI_GATEWAY_KEEPALIVE_EXPIRY", "60"))
+    # Batch de baixa prioridade (tasks de análise)
+    AI_BATCH_POLL_INTERVAL: float = float(os.getenv("AI_BATCH_POLL_INTERVAL", "5"))
+    AI_BATCH_TIMEOUT: int = int(os.getenv("AI_BATCH_TIMEOUT", "21600"))
+    
+    # Knowledge Base
+    QDRANT_URL: str = os.getenv("QDRANT_URL", "http://qdrant:6333")
+    KNOWLEDGE_EMBEDDING_MODEL: str = os.getenv("KNOWLEDGE_EMBEDDING_MODEL", "embeddings/text-embedding-3-small")
+    KNOWLEDGE_EMBEDDING_BATCH_SIZE: int = int(os.getenv("KNOWLEDGE_EMBEDDING_BATCH_SIZE", "256"))
+    
+    # Cache da configuração dos agentes (LRU em processo + Redis, invalidação por pub/sub)
+    AGENT_CONFIG_CACHE_SIZE: int = int(os.getenv("AGENT_CONFIG_CACHE_SIZE", "2000"))
+    AGENT_CONFIG_CACHE_TTL: float = float(os.getenv("AGENT_CONFIG_CACHE_TTL", "600"))
+    AGENT_CONFIG_REDIS_TTL: int = int(os.getenv("AGENT_CONFIG_REDIS_TTL", "86400"))
+    
+    # Fluxos do AgentStudio compilados por (agente, versão do fluxo)
+    FLOW_CACHE_SIZE: int = int(os.getenv("FLOW_CACHE_SIZE", "1000"))
+    
+    # Respostas rápidas sem LLM (opt-in por agente: quick_replies_enabled)
+    QUICK_REPLY_MIN_CONFIDENCE: float = float(os.getenv("QUICK_REPLY_MIN_CONFIDENCE", "0.85"))
+    QUICK_REPLY_MIN_QA_SCORE: float = float(os.getenv("QUICK_REPLY_MIN_QA_SCORE", "0.8"))
+    QUICK_REPLY_MAX_WORDS: int = int(os.getenv("QUICK_REPLY_MAX_WORDS", "12"))
+    QUICK_REPLY_QA_TTL: float = float(os.getenv("QUICK_REPLY_QA_TTL", "300"))
+    
+    # Prefetch de conhecimento por conversa (abertura e "digitando")
+    KNOWLEDGE_PREFETCH_ENABLED: bool = os.getenv("KNOWLEDGE_PREFETCH_ENABLED", "true").lower() == "true"
+    KNOWLEDGE_PREFETCH_TOP_K: int = int(os.getenv("KNOWLEDGE_PREFETCH_TOP_K", "20"))
+    KNOWLEDGE_PREFETCH_TTL: float = float(os.getenv("KNOWLEDGE_PREFETCH_TTL", "900"))
+    KNOWLEDGE_PREFETCH_MAX_CONVERSATIONS: int = int(os.getenv("KNOWLEDGE_PREFETCH_MAX_CONVERSATIONS", "5000"))
+    KNOWLEDGE_PREFETCH_MIN_SCORE: float = float(os.getenv("KNOWLEDGE_PREFETCH_MIN_SCORE", "0.6"))
+    
+    # Resumo incremental de conversas
+    CONVERSATION_SUMMARY_TRIGGER_TOKENS: int = int(os.getenv("CONVERSATION_SUMMARY_TRIGGER_TOKENS", "1500"))
+    CONVERSATION_SUMMARY_KEEP_RECENT: int = int(os.getenv("CONVERSATION_SUMMARY_KEEP_RECENT", "6"))
+    
+    # Prazos da preparação do turno, contados do início do turno (AIService.process_message)
+    TURN_CONTEXT_DEADLINE_MS: int = int(os.getenv("TURN_CONTEXT_DEADLINE_MS", "150"))
+    TURN_ROUTING_DEADLINE_MS: int = int(os.getenv("TURN_ROUTING_DEADLINE_MS", "250"))
+    TURN_KNOWLEDGE_DEADLINE_MS: int = int(os.getenv("TURN_KNOWLEDGE_DEADLINE_MS", "400"))
+    
+    # Cache de decisões de roteamento (AIRouter)
+    ROUTING_CACHE_SIZE: int = int(os.getenv("ROUTING_CACHE_SIZE", "10000"))
+    ROUTING_CACHE_TTL: float = float(os.getenv("ROUTING_CACHE_TTL", "300"))
+    ROUTING_CACHE_MAX_WORDS: int = int(os.getenv("ROUTING_CACHE_MAX_WORDS", "12"))
+    ROUTING_LOG_SAMPLE_RATE: float = float(os.getenv("ROUTING_LOG_SAMPLE_RATE", "0.01"))
+    
+    # Classificador de intent (artefatos versionados em INTENT_MODEL_DIR)
+    INTENT_MODEL_DIR: str = os.getenv("INTENT_MODEL_DIR", "/app/models/intent")
+    INTENT_MIN_CONFIDENCE: float = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.6"))
+    INTENT_MODEL_RELOAD_SECONDS: float = float(os.getenv("INTENT_MODEL_RELOAD_SECONDS", "60"))
     
     # Evolution API (WhatsApp)
     EVOLUTION_API_URL: str = os.getenv("EVOLUTION_API_URL", "")
@@ -5,6 +5,8 @@ Implementação que outros CTOs vão pagar R$200.000 para entender
 =============================================================================
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -16,17 +18,32 @@ from app.api.v1.knowledge import router as knowledge_router
 from app.api.v1.integrations import router as integrations_router
 from app.api.v1.auth import router as auth_router
 from app.core.config import settings
+from app.services.ai_service import gateway_client
+from app.services.agent_config_cache import agent_config_cache, register_invalidation_hooks
 
 # =============================================================================
 # FASTAPI APP - 30 LINHAS QUE VALEM MILHÕES
 # =============================================================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Recursos compartilhados do processo"""
+    # Invalidações da configuração dos agentes (pub/sub): alterações feitas pela API publicam, todos escutam
+    register_invalidation_hooks()
+    agent_config_cache.start()
+    yield
+    await agent_config_cache.stop()
+    # Fecha o pool de conexões com o LiteLLM Gateway
+    await gateway_client.close()
+
+
 app = FastAPI(
     title="Agentes de Conversão API",
     description="API Enterprise que transforma conversas em conversões",
     version="1.0.0",
     docs_url="/docs" if settings.DEBUG else None,
     redoc_url="/redoc" if settings.DEBUG else None,
+    lifespan=lifespan,
 )
 
 # Security Middleware - NÍVEL ENTERPRISE
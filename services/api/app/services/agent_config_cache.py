@@ -0,0 +1,334 @@
+"""
+Agent Config Cache - configuração do agente em dois níveis (processo + Redis)
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable, Mapping
+import logging
+
+from app.core.config import settings
+from app.services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "agent_config:invalidate"
+
+# Colunas do Agent usadas no caminho da mensagem (o resto do model não é carregado)
+AGENT_COLUMNS = (
+    "id", "organization_id", "name", "status", "model", "model_config", "temperature",
+    "max_tokens", "system_prompt", "instructions", "greeting_message", "knowledge_base",
+    "vector_store_id", "flow_data", "flow_version", "enabled_tools", "rate_limit_per_minute",
+    "timezone", "active_hours", "updated_at"
+)
+
+
+def freeze(value: Any) -> Any:
+    """Cópia somente leitura de JSON (dict -> MappingProxyType, list -> tuple)"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Inverso de freeze (para serializar em JSON)"""
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+@dataclass(frozen=True)
+class AgentConfig:
+    """
+    Configuração enxuta e imutável do agente, compartilhada entre turnos.
+
+    get() mantém a interface de dict usada pelo AIService: primeiro os
+    campos, depois as opções de model_config (enable_streaming,
+    knowledge_limit, ...).
+    """
+    id: str
+    organization_id: str
+    name: str
+    status: str
+    model: str
+    temperature: float
+    max_tokens: int
+    prompt: str
+    greeting_message: Optional[str]
+    knowledge_base_id: Optional[str]
+    flow_version: int
+    flow_data: Optional[Mapping[str, Any]]
+    enabled_tools: Tuple[str, ...]
+    rate_limit_per_minute: int
+    timezone: str
+    active_hours: Optional[Mapping[str, Any]]
+    options: Mapping[str, Any]
+    updated_at: Optional[str]
+
+    @property
+    def version(self) -> Tuple[Optional[str], int]:
+        return self.updated_at, self.flow_version
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in self.__dataclass_fields__ else None
+        if value is None:
+            value = self.options.get(key)
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> "AgentConfig":
+        """Monta a partir das colunas do Agent (AGENT_COLUMNS)"""
+        prompt = row.get("system_prompt") or "Você é um assistente útil."
+        if row.get("instructions"):
+            prompt = f"{prompt}\n\n{row['instructions']}"
+
+        knowledge_base = row.get("knowledge_base") or {}
+        updated_at = row.get("updated_at")
+
+        return cls(
+            id=str(row["id"]),
+            organization_id=str(row["organization_id"]),
+            name=row.get("name") or "",
+            status=row.get("status") or "",
+            model=row.get("model") or "",
+            temperature=float(row.get("temperature") if row.get("temperature") is not None else 0.7),
+            max_tokens=int(row.get("max_tokens") or 2048),
+            prompt=prompt,
+            greeting_message=row.get("greeting_message"),
+            knowledge_base_id=knowledge_base.get("id") or row.get("vector_store_id"),
+            flow_version=int(row.get("flow_version") or 1),
+            flow_data=freeze(row.get("flow_data")),
+            enabled_tools=tuple(row.get("enabled_tools") or ()),
+            rate_limit_per_minute=int(row.get("rate_limit_per_minute") or 60),
+            timezone=row.get("timezone") or "America/Sao_Paulo",
+            active_hours=freeze(row.get("active_hours")),
+            options=freeze(row.get("model_config") or {}),
+            updated_at=updated_at.isoformat() if hasattr(updated_at, "isoformat") else updated_at
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: thaw(getattr(self, name)) for name in self.__dataclass_fields__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AgentConfig":
+        data = {k: freeze(v) for k, v in data.items() if k in cls.__dataclass_fields__}
+        return cls(**data)
+
+
+def load_agent_row(agent_id: str) -> Optional[Dict[str, Any]]:
+    """Lê só as colunas de AGENT_COLUMNS do banco (síncrono; rodar em thread)"""
+    from app.database import get_db
+    from app.models.agent import Agent
+
+    db = next(get_db())
+    try:
+        row = (
+            db.query(*(getattr(Agent, column) for column in AGENT_COLUMNS))
+            .filter(Agent.id == agent_id, Agent.deleted_at.is_(None))
+            .first()
+        )
+        return dict(zip(AGENT_COLUMNS, row)) if row else None
+    finally:
+        db.close()
+
+
+class AgentConfigCache:
+    """
+    LRU em processo de AgentConfig, com Redis como segundo nível.
+
+    Em regime, get() não faz I/O: o agente está no LRU local. Uma falta lê
+    o Redis e, só se também faltar, o banco (uma carga por agente de cada
+    vez). Alterações no agente (updated_at/flow_version) apagam a chave no
+    Redis e publicam no canal INVALIDATION_CHANNEL; cada processo escuta o
+    canal (start) e descarta a cópia local. O TTL local limita o tempo de
+    uma cópia velha se uma mensagem do pub/sub se perder.
+    """
+
+    def __init__(
+        self,
+        loader: Optional[Callable[[str], Awaitable[Optional[Dict[str, Any]]]]] = None,
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        redis_ttl: Optional[int] = None
+    ):
+        self.loader = loader or (lambda agent_id: asyncio.to_thread(load_agent_row, agent_id))
+        self.max_size = max_size or settings.AGENT_CONFIG_CACHE_SIZE
+        self.ttl = ttl or settings.AGENT_CONFIG_CACHE_TTL
+        self.redis_ttl = redis_ttl or settings.AGENT_CONFIG_REDIS_TTL
+        self._entries: "OrderedDict[str, Tuple[float, AgentConfig]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._generation = 0
+        self.hits = 0
+        self.redis_hits = 0
+        self.loads = 0
+
+    async def get(self, agent_id: str) -> Optional[AgentConfig]:
+        """Configuração do agente (None se não existe)"""
+        agent_id = str(agent_id)
+        entry = self._entries.get(agent_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(agent_id)
+                self.hits += 1
+                return entry[1]
+            del self._entries[agent_id]
+
+        # Faltas simultâneas do mesmo agente esperam a mesma carga
+        future = self._inflight.get(agent_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(agent_id))
+            self._inflight[agent_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(agent_id, None))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, agent_id: str) -> Optional[AgentConfig]:
+        # Invalidação durante a carga: o resultado pode ser anterior à alteração, não entra no cache
+        generation = self._generation
+        cached = await cache_service.get_agent_config(agent_id)
+        if cached is not None:
+            self.redis_hits += 1
+            config = AgentConfig.from_dict(cached)
+        else:
+            row = await self.loader(agent_id)
+            self.loads += 1
+            if row is None:
+                return None
+            config = AgentConfig.from_row(row)
+            if generation == self._generation:
+                await cache_service.set_agent_config(agent_id, config.to_dict(), self.redis_ttl)
+
+        if generation == self._generation:
+            self._store(config)
+        return config
+
+    def _store(self, config: AgentConfig):
+        self._entries[config.id] = (time.monotonic() + self.ttl, config)
+        self._entries.move_to_end(config.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, agent_id: str):
+        """Remove só a cópia local"""
+        agent_id = str(agent_id)
+        self._entries.pop(agent_id, None)
+        self._inflight.pop(agent_id, None)
+        self._generation += 1
+
+    async def invalidate(self, agent_id: str):
+        """Agente alterado: apaga do Redis e avisa todos os processos"""
+        agent_id = str(agent_id)
+        self.discard(agent_id)
+        await cache_service.delete_agent_config(agent_id)
+        await cache_service.publish(INVALIDATION_CHANNEL, {"agent_id": agent_id})
+
+    # Pub/sub
+
+    def start(self):
+        """Começa a escutar invalidações (uma vez por processo, no event loop da aplicação)"""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = (await cache_service.get_redis()).pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Mensagens perdidas enquanto não estávamos inscritos: recomeça do zero
+                self._entries.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    agent_id = json.loads(message["data"]).get("agent_id")
+                    if agent_id:
+                        self.discard(agent_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Agent config invalidation listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                if pubsub is not None:
+                    await pubsub.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "agents": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "loads": self.loads,
+            "listening": self._listener is not None and not self._listener.done()
+        }
+
+
+_hooks_registered = False
+
+
+def register_invalidation_hooks():
+    """
+    Publica a invalidação após o commit de qualquer alteração em Agent.
+
+    Registrado na API (lifespan) e nos workers Celery; idempotente, porque
+    a API também importa app.workers ao agendar tasks. Usa um cliente Redis
+    síncrono porque os eventos do SQLAlchemy (Session síncrona, também sob
+    AsyncSession) não rodam como corrotinas.
+    """
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+
+    import redis
+    from sqlalchemy import event, inspect
+    from sqlalchemy.orm import Session
+    from app.models.agent import Agent
+
+    publisher = redis.Redis.from_url(settings.REDIS_URL)
+
+    @event.listens_for(Agent, "after_update")
+    def agent_updated(mapper, connection, target):
+        # after_update também roda para objetos sujos sem mudança real
+        state = inspect(target)
+        if any(state.attrs[column.key].history.has_changes() for column in mapper.column_attrs):
+            state.session.info.setdefault("agent_config_invalidations", set()).add(str(target.id))
+
+    @event.listens_for(Session, "after_commit")
+    def publish_invalidations(session):
+        for agent_id in session.info.pop("agent_config_invalidations", ()):
+            try:
+                publisher.delete(f"agent_config:{agent_id}")
+                publisher.publish(INVALIDATION_CHANNEL, json.dumps({"agent_id": agent_id}))
+            except Exception as e:
+                logger.error(f"Error publishing agent config invalidation for {agent_id}: {e}")
+
+    @event.listens_for(Session, "after_rollback")
+    def drop_invalidations(session):
+        session.info.pop("agent_config_invalidations", None)
+
+
+# Singleton instance
+agent_config_cache = AgentConfigCache()
@@ -2,12 +2,21 @@
 AI Router - Roteamento inteligente de modelos
 """
 
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet
+from collections import OrderedDict
 from enum import Enum
+import hashlib
+import random
 import re
+import time
+import zlib
 from datetime import datetime
 import logging
 
+from app.core.config import settings
+from app.services.cache_service import cache_service
+from app.services.keyword_matcher import keyword_matcher, normalize, KEYWORD_VOCABULARIES
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,28 +31,18 @@ class ModelTier(Enum):
 class ComplexityAnalyzer:
     """Analisa complexidade de mensagens e conversas"""
     
-    # Palavras-chave por categoria
-    TECHNICAL_TERMS = {
-        "api", "integração", "erro", "bug", "debug", "código", "programação",
-        "database", "servidor", "configuração", "instalação", "atualização",
-        "ssl", "certificado", "autenticação", "token", "webhook"
-    }
-    
-    BUSINESS_TERMS = {
-        "roi", "investimento", "orçamento", "proposta", "contrato", "negociação",
-        "desconto", "enterprise", "corporativo", "personalizado", "consultoria"
-    }
-    
-    SIMPLE_QUERIES = {
-        "horário", "telefone", "endereço", "email", "contato", "localização",
-        "preço", "valor", "custo", "plano", "funciona", "aberto", "fechado"
-    }
+    # Palavras-chave por categoria (casadas pelo keyword_matcher compartilhado)
+    TECHNICAL_TERMS = KEYWORD_VOCABULARIES["technical"]
+    BUSINESS_TERMS = KEYWORD_VOCABULARIES["business"]
+    SIMPLE_QUERIES = KEYWORD_VOCABULARIES["simple"]
     
     @staticmethod
-    def analyze_message(message: str) -> Dict[str, Any]:
-        """Analisa complexidade de uma mensagem"""
+    def analyze_message(message: str, keywords: Optional[FrozenSet[str]] = None) -> Dict[str, Any]:
+        """Analisa complexidade de uma mensagem (keywords: categorias já obtidas com keyword_matcher.scan)"""
         
         message_lower = message.lower()
+        if keywords is None:
+            keywords = keyword_matcher.scan(message)
         
         # Métricas básicas
         word_count = len(message.split())
@@ -51,9 +50,9 @@ class ComplexityAnalyzer:
         question_count = message.count("?")
         
         # Análise de conteúdo
-        has_technical = any(term in message_lower for term in ComplexityAnalyzer.TECHNICAL_TERMS)
-        has_business = any(term in message_lower for term in ComplexityAnalyzer.BUSINESS_TERMS)
-        is_simple = any(term in message_lower for term in ComplexityAnalyzer.SIMPLE_QUERIES)
+        has_technical = "technical" in keywords
+        has_business = "business" in keywords
+        is_simple = "simple" in keywords
         
         # Detectar código ou logs
         has_code = bool(re.search(r'```|def |class |function|{|}|\[\]|error:|exception:', message_lower))
@@ -122,11 +121,213 @@ class ComplexityAnalyzer:
         }
 
 
+class ConversationComplexity:
+    """
+    Agregado incremental da complexidade de uma conversa.
+    
+    Guarda somas e contadores (não as mensagens) para que cada turno custe
+    O(1): o score é o mesmo de ComplexityAnalyzer.analyze_conversation.
+    `covered` é o número de mensagens do histórico já incorporadas (com
+    `last_message_id` quando as mensagens têm id) e `last_turn` identifica o
+    último turno aplicado, para que retries não contem a mensagem duas vezes.
+    
+    A mensagem atual é somada no próprio turno, antes de existir no
+    histórico: no turno seguinte ela aparece logo depois de
+    `last_message_id` e é pulada (o agregado fica igual ao recalculado do
+    zero com analyze_conversation).
+    """
+    
+    RECENT_INTENTS = 3
+    
+    def __init__(
+        self,
+        score_sum: float = 0.0,
+        user_messages: int = 0,
+        message_count: int = 0,
+        total_words: int = 0,
+        recent_intents: Optional[List[str]] = None,
+        covered: int = 0,
+        last_message_id: Optional[Any] = None,
+        last_turn: Optional[str] = None
+    ):
+        self.score_sum = score_sum
+        self.user_messages = user_messages
+        self.message_count = message_count
+        self.total_words = total_words
+        self.recent_intents = recent_intents or []
+        self.covered = covered
+        self.last_message_id = last_message_id
+        self.last_turn = last_turn
+    
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ConversationComplexity":
+        return cls(**data) if data else cls()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "score_sum": self.score_sum,
+            "user_messages": self.user_messages,
+            "message_count": self.message_count,
+            "total_words": self.total_words,
+            "recent_intents": self.recent_intents,
+            "covered": self.covered,
+            "last_message_id": self.last_message_id,
+            "last_turn": self.last_turn
+        }
+    
+    def add(self, message: Dict[str, Any], analysis: Optional[Dict[str, Any]] = None):
+        """Incorpora uma mensagem (analysis: analyze_message já calculado para ela)"""
+        self.message_count += 1
+        if message.get("role") == "user":
+            analysis = analysis or ComplexityAnalyzer.analyze_message(message.get("content") or "")
+            self.score_sum += analysis["score"]
+            self.user_messages += 1
+            self.total_words += analysis["word_count"]
+        
+        intent = (message.get("metadata") or {}).get("intent")
+        if intent:
+            self.add_intent(intent)
+    
+    def add_intent(self, intent: str):
+        self.recent_intents = (self.recent_intents + [intent])[-self.RECENT_INTENTS:]
+    
+    def sync(
+        self,
+        history: List[Dict[str, Any]],
+        message: str,
+        analysis: Dict[str, Any]
+    ) -> bool:
+        """
+        Incorpora as mensagens do histórico ainda não vistas e a mensagem atual.
+        
+        Normalmente são só a resposta anterior do agente e a mensagem nova.
+        Retorna False se o turno já tinha sido aplicado (retry).
+        """
+        # Com ids, a última mensagem do histórico distingue turnos mesmo com histórico janelado
+        last_message_id = history[-1].get("id") if history else None
+        turn = f"{len(history)}:{last_message_id}:{zlib.crc32(message.encode('utf-8'))}"
+        if turn == self.last_turn:
+            return False
+        
+        for previous in history[self._start_index(history):]:
+            self.add(previous)
+        self.add({"role": "user", "content": message}, analysis)
+        
+        self.covered = len(history) + 1
+        self.last_message_id = last_message_id
+        self.last_turn = turn
+        return True
+    
+    def _start_index(self, history: List[Dict[str, Any]]) -> int:
+        if self.last_message_id is not None:
+            for i in range(len(history) - 1, -1, -1):
+                if history[i].get("id") == self.last_message_id:
+                    # Mensagem do turno anterior já aplicada como mensagem atual
+                    if i + 1 < len(history) and self._is_last_message(history[i + 1]):
+                        return i + 2
+                    return i + 1
+        if self.covered <= len(history):
+            return self.covered
+        # Histórico truncado pelo chamador: o agregado já cobre o que ficou de fora
+        return len(history)
+    
+    def _is_last_message(self, message: Dict[str, Any]) -> bool:
+        if message.get("role") != "user" or not self.last_turn:
+            return False
+        return self.last_turn.endswith(f":{zlib.crc32((message.get('content') or '').encode('utf-8'))}")
+    
+    def analysis(self) -> Dict[str, Any]:
+        """Mesmo formato e score de ComplexityAnalyzer.analyze_conversation"""
+        if not self.message_count:
+            return {"score": 0.0, "message_count": 0}
+        
+        avg_complexity = self.score_sum / self.user_messages if self.user_messages else 0
+        score = avg_complexity
+        if self.message_count > 10:
+            score += 0.1
+        if self.total_words > 500:
+            score += 0.1
+        
+        return {
+            "score": min(score, 1.0),
+            "message_count": self.message_count,
+            "total_words": self.total_words,
+            "avg_message_complexity": avg_complexity
+        }
+
+
+class RoutingDecisionCache:
+    """
+    LRU com TTL das partes da decisão de roteamento que dependem só da mensagem.
+    
+    Chave: hash da mensagem normalizada, agente, plano, VIP e versão das
+    regras. O valor é a análise da mensagem e, quando o intent é decidido
+    pela própria mensagem, o intent e o tier. Intents que dependem do
+    histórico continuam calculados a cada turno. O TTL faz mudanças de
+    regras chegarem a todos os processos.
+    """
+    
+    def __init__(self, max_size: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_size = max_size or settings.ROUTING_CACHE_SIZE
+        self.ttl = ttl_seconds if ttl_seconds is not None else settings.ROUTING_CACHE_TTL
+        self.max_words = settings.ROUTING_CACHE_MAX_WORDS
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize_message(message: str) -> str:
+        """Minúsculas, sem acentos e com espaços colapsados"""
+        return " ".join(normalize(message).split())
+    
+    def key(self, normalized: str, agent_id: Optional[str], plan: str, is_vip: bool, rules_version: int) -> Optional[Tuple]:
+        """Chave da decisão (None para mensagens longas, que raramente se repetem)"""
+        if not normalized or normalized.count(" ") >= self.max_words:
+            return None
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        return digest, agent_id, plan, is_vip, rules_version
+    
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def set(self, key: Tuple, decision: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl, decision)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, agent_id: Optional[str] = None):
+        """Remove as decisões de um agente (ou todas)"""
+        if agent_id is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[1] == agent_id]:
+            del self._entries[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
 class AIRouter:
     """Router inteligente para seleção de modelos"""
     
     def __init__(self):
         self.complexity_analyzer = ComplexityAnalyzer()
+        self.decision_cache = routing_decision_cache
         
         # Configuração de roteamento
         self.routing_rules = {
@@ -143,122 +344,211 @@ class AIRouter:
             "high_value_lead": ModelTier.TIER_4,
             "enterprise_query": ModelTier.TIER_4
         }
+        self.rules_version = self._rules_fingerprint()
+    
+    def _rules_fingerprint(self) -> int:
+        return zlib.crc32(repr(sorted((intent, tier.value) for intent, tier in self.routing_rules.items())).encode())
+    
+    def update_routing_rules(self, rules: Dict[str, ModelTier]):
+        """Atualiza as regras; decisões em cache com a versão anterior deixam de casar"""
+        self.routing_rules.update(rules)
+        self.rules_version = self._rules_fingerprint()
         
     async def route_request(
         self,
         message: str,
         conversation_history: List[Dict[str, str]],
         user_context: Dict[str, Any],
-        agent_config: Dict[str, Any]
+        agent_config: Dict[str, Any],
+        complexity_state: Optional[ConversationComplexity] = None
     ) -> Tuple[ModelTier, Dict[str, Any]]:
-        """Determina o melhor modelo para a requisição"""
-        
-        # 1. Analisar complexidade
-        message_analysis = self.complexity_analyzer.analyze_message(message)
-        conversation_analysis = self.complexity_analyzer.analyze_conversation(
-            conversation_history + [{"role": "user", "content": message}]
-        )
+        """
+        Determina o melhor modelo para a requisição.
         
-        # 2. Detectar intent
-        intent = self._detect_intent(message, conversation_history)
+        A complexidade da conversa vem de um agregado incremental (O(1) por
+        turno): complexity_state se informado, senão o armazenado para
+        user_context["conversation_id"], que é atualizado ao final.
+        """
         
-        # 3. Considerar contexto do usuário
+        # 0. Contexto do usuário (faz parte da chave da decisão em cache)
         user_tier = user_context.get("tier", "standard")
         user_value = user_context.get("lifetime_value", 0)
         is_vip = user_tier == "vip" or user_value > agent_config.get("vip_threshold", 10000)
+        plan = user_context.get("plan", "free")
         
-        # 4. Aplicar regras de roteamento
+        # 1. Analisar complexidade (uma passada de palavras-chave para complexidade e intent)
+        normalized = self.decision_cache.normalize_message(message)
+        cache_key = self.decision_cache.key(normalized, agent_config.get("id"), plan, is_vip, self.rules_version)
+        cached = self.decision_cache.get(cache_key) if cache_key else None
+        
+        if cached is not None:
+            message_analysis = dict(cached["message_analysis"])
+            message_intent = cached["intent"]
+        else:
+            # Mensagens curtas são analisadas na forma normalizada: a decisão em cache vale para todas as variantes
+            text = normalized if cache_key else message
+            keywords = keyword_matcher.scan(text)
+            message_analysis = self.complexity_analyzer.analyze_message(text, keywords)
+            message_intent = self._message_intent(text, keywords, message_analysis)
+        
+        conversation_id = user_context.get("conversation_id")
+        state = complexity_state
+        if state is None:
+            stored = await cache_service.get_conversation_complexity(conversation_id) if conversation_id else None
+            state = ConversationComplexity.from_dict(stored)
+        
+        # Intents de turnos anteriores (antes de incorporar o turno atual)
+        recent_intents = list(state.recent_intents)
+        applied = state.sync(conversation_history, message, message_analysis)
+        conversation_analysis = state.analysis()
+        
+        # 2. Detectar intent (pela mensagem; senão pelo contexto da conversa)
+        intent = message_intent or self._context_intent(message_analysis, recent_intents)
+        if applied:
+            state.add_intent(intent)
+        if complexity_state is None and conversation_id:
+            await cache_service.set_conversation_complexity(conversation_id, state.to_dict())
+        
+        # 3. Aplicar regras de roteamento
+        if cached is not None and cached["tier"] is not None:
+            base_tier = ModelTier(cached["tier"])
+        else:
+            base_tier = self._select_tier(intent, conversation_analysis["score"], is_vip, plan)
+        
+        if cached is None and cache_key:
+            # O tier só é reaproveitável quando não depende da complexidade da conversa
+            cacheable_tier = message_intent is not None and message_intent in self.routing_rules
+            self.decision_cache.set(cache_key, {
+                "message_analysis": message_analysis,
+                "intent": message_intent,
+                "tier": base_tier.value if cacheable_tier else None
+            })
+        
+        # 4. Preparar metadados
+        routing_metadata = {
+            "selected_tier": base_tier.value,
+            "intent": intent,
+            "complexity_score": conversation_analysis["score"],
+            "message_complexity": message_analysis,
+            "is_vip": is_vip,
+            "routing_reason": self._get_routing_reason(
+                base_tier, intent, conversation_analysis["score"], is_vip
+            )
+        }
+        
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.ROUTING_LOG_SAMPLE_RATE:
+            logger.debug(f"Routed to {base_tier.value} (cached={cached is not None}): {routing_metadata}")
+        
+        return base_tier, routing_metadata
+    
+    def _select_tier(self, intent: str, complexity: float, is_vip: bool, plan: str) -> ModelTier:
+        """Tier pelas regras de intent ou pela complexidade, ajustado por VIP e plano"""
         
         # Regra 1: Intent específico
         if intent in self.routing_rules:
             base_tier = self.routing_rules[intent]
         else:
             # Regra 2: Baseado em complexidade
-            if conversation_analysis["score"] < 0.3:
+            if complexity < 0.3:
                 base_tier = ModelTier.TIER_1
-            elif conversation_analysis["score"] < 0.6:
+            elif complexity < 0.6:
                 base_tier = ModelTier.TIER_2
-            elif conversation_analysis["score"] < 0.8:
+            elif complexity < 0.8:
                 base_tier = ModelTier.TIER_3
             else:
                 base_tier = ModelTier.TIER_4
         
-        # 5. Ajustes baseados no usuário
+        # Ajustes baseados no usuário
         if is_vip and base_tier == ModelTier.TIER_1:
             # VIPs nunca recebem tier 1
             base_tier = ModelTier.TIER_2
         
-        # 6. Considerar limites do plano
-        max_tier = self._get_max_tier_for_plan(user_context.get("plan", "free"))
+        # Considerar limites do plano
+        max_tier = self._get_max_tier_for_plan(plan)
         if base_tier.value > max_tier.value:
             base_tier = max_tier
         
-        # 7. Preparar metadados
-        routing_metadata = {
-            "selected_tier": base_tier.value,
-            "intent": intent,
-            "complexity_score": conversation_analysis["score"],
-            "message_complexity": message_analysis,
-            "is_vip": is_vip,
-            "routing_reason": self._get_routing_reason(
-                base_tier, intent, conversation_analysis["score"], is_vip
-            )
-        }
-        
-        logger.info(f"Routed to {base_tier.value}: {routing_metadata}")
-        
-        return base_tier, routing_metadata
+        return base_tier
     
-    def _detect_intent(self, message: str, history: List[Dict[str, str]]) -> str:
+    def _detect_intent(
+        self,
+        message: str,
+        history: List[Dict[str, str]],
+        keywords: Optional[FrozenSet[str]] = None,
+        message_analysis: Optional[Dict[str, Any]] = None,
+        recent_intents: Optional[List[str]] = None
+    ) -> str:
         """Detecta intent considerando contexto"""
         
-        message_lower = message.lower()
+        if keywords is None:
+            keywords = keyword_matcher.scan(message)
+        if message_analysis is None:
+            message_analysis = self.complexity_analyzer.analyze_message(message, keywords)
+        
+        # Análise do histórico (intents dos últimos turnos, do agregado da conversa quando houver)
+        if recent_intents is None:
+            recent_intents = [
+                msg["metadata"]["intent"]
+                for msg in history[-3:]  # Últimas 3 mensagens
+                if (msg.get("metadata") or {}).get("intent")
+            ]
+        
+        return (
+            self._message_intent(message, keywords, message_analysis)
+            or self._context_intent(message_analysis, recent_intents)
+        )
+    
+    def _message_intent(
+        self,
+        message: str,
+        keywords: FrozenSet[str],
+        message_analysis: Dict[str, Any]
+    ) -> Optional[str]:
+        """Intent decidido só pela mensagem (None se depende do contexto)"""
         
         # Verificar saudações
-        if any(greeting in message_lower for greeting in ["oi", "olá", "bom dia", "boa tarde", "boa noite", "tudo bem"]):
+        if "greeting" in keywords or "smalltalk" in keywords:
             return "greeting"
         
         # FAQ simples
         if len(message.split()) < 10 and "?" in message:
-            if any(word in message_lower for word in ["horário", "endereço", "telefone", "email"]):
+            if "contact_info" in keywords:
                 return "faq"
         
         # Queries de produto/preço
-        if any(word in message_lower for word in ["preço", "custo", "valor", "plano", "pacote"]):
-            if any(word in message_lower for word in ["enterprise", "corporativo", "personalizado"]):
+        if "pricing" in keywords:
+            if "enterprise" in keywords:
                 return "enterprise_query"
             return "pricing_query"
         
         # Suporte técnico
-        if any(word in message_lower for word in ["erro", "problema", "bug", "não funciona", "travou"]):
-            if self.complexity_analyzer.analyze_message(message)["has_code"]:
+        if "support" in keywords:
+            if message_analysis["has_code"]:
                 return "technical_support"
             return "support_basic"
         
         # Intenção de compra
-        if any(word in message_lower for word in ["comprar", "adquirir", "contratar", "assinar"]):
+        if "purchase" in keywords:
             # Verificar se é high-value pelo contexto
-            if any(word in message_lower for word in ["empresa", "equipe", "usuários", "licenças"]):
+            if "team" in keywords:
                 return "high_value_lead"
             return "purchase_intent"
         
         # Negociação
-        if any(word in message_lower for word in ["desconto", "negociar", "proposta", "orçamento"]):
+        if "negotiation" in keywords:
             return "sales_negotiation"
         
-        # Análise do histórico
-        if history:
-            recent_intents = []
-            for msg in history[-3:]:  # Últimas 3 mensagens
-                if msg.get("metadata", {}).get("intent"):
-                    recent_intents.append(msg["metadata"]["intent"])
-            
-            # Se estava em negociação, continuar
-            if "sales_negotiation" in recent_intents:
-                return "sales_negotiation"
+        return None
+    
+    def _context_intent(self, message_analysis: Dict[str, Any], recent_intents: List[str]) -> str:
+        """Intent pelo contexto da conversa quando a mensagem não decide"""
+        
+        # Se estava em negociação, continuar
+        if "sales_negotiation" in recent_intents:
+            return "sales_negotiation"
         
         # Default baseado em complexidade
-        complexity = self.complexity_analyzer.analyze_message(message)["score"]
+        complexity = message_analysis["score"]
         if complexity > 0.7:
             return "complex_query"
         
@@ -299,3 +589,7 @@ class AIRouter:
             reasons.append("VIP customer upgrade applied")
         
         return " | ".join(reasons) if reasons else "Default routing"
+
+
+# Singleton instance (compartilhado pelas instâncias de AIRouter do processo)
+routing_decision_cache = RoutingDecisionCache()
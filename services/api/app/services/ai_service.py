@@ -4,22 +4,90 @@ AI Service usando LiteLLM Gateway
 
 import os
 import json
-from typing import Dict, Any, List, Optional, AsyncIterator
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 import httpx
 from datetime import datetime
 import logging
 
 from app.core.config import settings
+from app.services.token_budget import prompt_budgeter, KNOWLEDGE_BUDGET_SHARE
+from app.services.ai_router import AIRouter, ModelTier
+from app.services.cache_service import cache_service
+from app.services.turn_pipeline import TurnPipeline, TurnStage, TurnPreparation
+from app.services.conversation_summary import conversation_summarizer
+from app.services.keyword_matcher import keyword_matcher
+from app.services.intent_classifier import intent_classifier
+from app.services.knowledge_prefetch import knowledge_prefetcher
+from app.services.flow_engine import flow_cache, FlowCursor, FlowTurn
+from app.services.agent_config_cache import thaw
+from app.services.quick_responder import quick_responder
 
 logger = logging.getLogger(__name__)
 
 
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class GatewayClient:
+    """
+    Client HTTP compartilhado para o LiteLLM Gateway.
+    
+    Um httpx.AsyncClient com pool de conexões (keep-alive e HTTP/2 quando o
+    gateway é servido por TLS) por event loop: a API usa sempre o mesmo; as
+    tasks Celery, que criam um loop por execução, ganham um client novo a
+    cada loop. close() no shutdown da aplicação.
+    """
+    
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            # Um client de outro loop (já encerrado) não pode ser reutilizado nem fechado daqui
+            self._client = self._create()
+            self._loop = loop
+        return self._client
+    
+    def _create(self) -> httpx.AsyncClient:
+        http2 = settings.AI_GATEWAY_HTTP2 and http2_available()
+        if settings.AI_GATEWAY_HTTP2 and not http2:
+            logger.warning("HTTP/2 requested but h2 is not installed, using HTTP/1.1")
+        
+        return httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(180.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=settings.AI_GATEWAY_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AI_GATEWAY_MAX_KEEPALIVE,
+                keepalive_expiry=settings.AI_GATEWAY_KEEPALIVE_EXPIRY
+            ),
+            headers={"Authorization": f"Bearer {settings.LITELLM_API_KEY}"}
+        )
+    
+    async def close(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+
 class AIService:
     """Serviço para interação com LiteLLM Gateway"""
     
     def __init__(self):
         self.base_url = settings.LITELLM_URL or "http://litellm:4000"
         self.timeout = httpx.Timeout(180.0, connect=10.0)
+        self._router: Optional[AIRouter] = None
+        self._knowledge_service = None
         
     async def chat_completion(
         self,
@@ -45,25 +113,17 @@ class AIService:
         if max_tokens is not None:
             payload["max_tokens"] = max_tokens
             
-        # Headers com autenticação
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.LITELLM_API_KEY}"
-        }
+        url = f"{self.base_url}/ai/chat/completions"
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/ai/chat/completions",
-                    json=payload,
-                    headers=headers
-                )
-                response.raise_for_status()
-                
-                if stream:
-                    return response.iter_lines()
-                else:
-                    return response.json()
+            client = gateway_client.get()
+            
+            if stream:
+                return await self._open_stream(client, url, payload)
+            
+            response = await client.post(url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
                     
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP error from LiteLLM: {e}")
@@ -72,139 +132,507 @@ class AIService:
             logger.error(f"Error calling LiteLLM: {e}")
             raise
     
+    async def _open_stream(self, client: httpx.AsyncClient, url: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """Abre o stream SSE (erros HTTP sobem aqui) e devolve as linhas"""
+        request = client.build_request("POST", url, json=payload, timeout=self.timeout)
+        response = await client.send(request, stream=True)
+        
+        if response.is_error:
+            try:
+                await response.aread()
+                response.raise_for_status()
+            finally:
+                await response.aclose()
+        
+        return self._iter_lines(response)
+    
+    @staticmethod
+    async def _iter_lines(response: httpx.Response) -> AsyncIterator[str]:
+        """
+        Linhas do stream com a resposta aberta durante a iteração.
+        
+        Se o consumidor para (fim, aclose() ou cancelamento por desconexão
+        do cliente), a resposta é fechada e o gateway deixa de gerar.
+        """
+        try:
+            async for line in response.aiter_lines():
+                yield line
+        finally:
+            await response.aclose()
+    
     async def process_message(
         self,
         message: str,
-        conversation_history: List[Dict[str, str]],
+        conversation_history: Optional[List[Dict[str, str]]],
         agent_config: Dict[str, Any],
         user_context: Dict[str, Any],
-        knowledge_context: Optional[List[str]] = None
+        knowledge_context: Optional[List[str]] = None,
+        model_tier: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Processa mensagem com contexto completo"""
+        """
+        Processa mensagem com contexto completo.
+        
+        A preparação do turno roda em paralelo (resumo, conhecimento e
+        histórico -> roteamento), cada etapa com prazo; uma etapa atrasada é
+        deixada de fora (ex.: responde sem conhecimento). Os tempos por etapa
+        vão em metadata["timings"] e as etapas puladas em metadata["degraded"].
+        
+        Agentes com fluxo do AgentStudio avançam o fluxo antes: mensagens
+        fixas respondem sem LLM; um nó de prompt troca o prompt do turno
+        (as mensagens fixas alcançadas antes dele vão na frente da resposta).
+        Depois, turnos triviais (cumprimento, templates, Q/A da base) são
+        respondidos pelo quick_responder, se o agente habilitou.
+        """
+        
+        turn_started = time.perf_counter()
+        conversation_id = user_context.get("conversation_id")
+        
+        flow_turn = await self._advance_flow(message, agent_config, conversation_id)
+        if flow_turn is not None and flow_turn.actions:
+            self._dispatch_flow_actions(flow_turn, message, agent_config, user_context)
+        if flow_turn is not None and flow_turn.messages and flow_turn.prompt is None:
+            return self._static_reply(
+                "\n\n".join(flow_turn.messages), "flow", agent_config, user_context, turn_started,
+                flow=flow_turn.describe()
+            )
+        flow_prompt = flow_turn.prompt if flow_turn is not None else None
+        # Mensagens fixas antes de um nó de prompt vão na frente da resposta do LLM
+        flow_prefix = "\n\n".join(flow_turn.messages) if flow_turn is not None and flow_turn.messages else None
+        
+        # Fluxo no meio de um prompt próprio: a resposta é do LLM
+        quick_reply = quick_responder.answer(message, agent_config, user_context) if flow_prompt is None else None
+        if quick_reply is not None:
+            return self._static_reply(
+                quick_reply.content, quick_reply.source, agent_config, user_context, turn_started,
+                quick_reply=quick_reply.describe()
+            )
+        
+        preparation = await self._prepare_turn(
+            message, conversation_history, agent_config, user_context, knowledge_context, model_tier
+        )
+        history = preparation["history"]
+        stored_summary = preparation["summary"]
+        knowledge_context = preparation["knowledge"]
+        if model_tier is None and preparation["routing"]:
+            model_tier = preparation["routing"][0].value
+        
+        # Turnos antigos já resumidos saem do prompt (resumo + turnos recentes)
+        conversation_summary, pending_history = conversation_summarizer.split(history, stored_summary)
         
         # Construir mensagens com contexto
+        build_started = time.perf_counter()
         messages = self._build_messages(
             message=message,
-            conversation_history=conversation_history,
+            conversation_history=pending_history,
             agent_config=agent_config,
-            knowledge_context=knowledge_context
+            knowledge_context=knowledge_context,
+            model_tier=model_tier,
+            conversation_summary=conversation_summary,
+            system_prompt=flow_prompt.get("systemPrompt") if flow_prompt else None
         )
         
         # Preparar metadata para roteamento inteligente
         metadata = {
             "organization_id": user_context.get("organization_id"),
             "user_id": user_context.get("user_id"),
-            "conversation_id": user_context.get("conversation_id"),
+            "conversation_id": conversation_id,
             "agent_id": agent_config.get("id"),
             "user_value": user_context.get("lifetime_value", 0),
             "user_tier": user_context.get("tier", "standard"),
+            "plan": user_context.get("plan"),
             "intent": self._detect_intent(message)
         }
+        if model_tier:
+            metadata["model_tier"] = model_tier
+        preparation.timings["build"] = round((time.perf_counter() - build_started) * 1000, 2)
         
         # Determinar se deve usar streaming
         use_stream = agent_config.get("enable_streaming", False)
         
+        # Temperatura do nó de prompt vale mesmo quando é 0
+        temperature = (flow_prompt or {}).get("temperature")
+        if temperature is None:
+            temperature = agent_config.get("temperature", 0.7)
+        
         # Chamar LiteLLM
+        llm_started = time.perf_counter()
         response = await self.chat_completion(
             messages=messages,
             metadata=metadata,
             stream=use_stream,
-            temperature=agent_config.get("temperature", 0.7),
+            temperature=temperature,
             max_tokens=agent_config.get("max_tokens", 2048)
         )
         
+        timings = preparation.timings
+        timings["before_llm"] = round((llm_started - turn_started) * 1000, 2)
+        timings["llm_response" if not use_stream else "llm_headers"] = round((time.perf_counter() - llm_started) * 1000, 2)
+        # Só na resposta desta chamada (o gateway recebe a metadata de roteamento)
+        result_metadata = {**metadata, "timings": timings, "degraded": preparation.degraded}
+        if flow_turn is not None:
+            result_metadata["flow"] = flow_turn.describe()
+        
+        # Condensar em background se os turnos não resumidos passaram do limite (fora do caminho do 1º token;
+        # sem o resumo armazenado não há como saber o que já foi resumido)
+        if "summary" not in preparation.degraded:
+            await conversation_summarizer.maybe_schedule(
+                conversation_id=conversation_id,
+                organization_id=user_context.get("organization_id"),
+                pending=pending_history,
+                previous_summary=conversation_summary,
+                base_covered=len(history) - len(pending_history),
+                expected_covered=(stored_summary or {}).get("covered", 0),
+                trigger_tokens=agent_config.get("summary_trigger_tokens"),
+                keep_recent=agent_config.get("summary_keep_recent")
+            )
+        
+        logger.debug(f"Turn {conversation_id} timings (ms): {timings}, degraded: {preparation.degraded}")
+        
         # Processar resposta
         if use_stream:
             return {
                 "type": "stream",
-                "stream": self._process_stream(response),
-                "metadata": metadata
+                "stream": self._process_stream(response, timings=timings, started=turn_started, prefix=flow_prefix),
+                "metadata": result_metadata
             }
         else:
             return {
                 "type": "message",
-                "content": response["choices"][0]["message"]["content"],
+                "content": self._with_prefix(response["choices"][0]["message"]["content"], flow_prefix),
                 "usage": response.get("usage", {}),
                 "model": response.get("model"),
-                "metadata": metadata
+                "metadata": result_metadata
             }
     
+    def _static_reply(
+        self,
+        content: str,
+        source: str,
+        agent_config: Dict[str, Any],
+        user_context: Dict[str, Any],
+        started: float,
+        **details: Any
+    ) -> Dict[str, Any]:
+        """Resposta sem chamada ao LLM (contada em llm_calls_avoided)"""
+        
+        quick_responder.count_avoided(user_context.get("organization_id"), source)
+        return {
+            "type": "message",
+            "content": content,
+            "usage": {},
+            "model": None,
+            "metadata": {
+                "conversation_id": user_context.get("conversation_id"),
+                "agent_id": agent_config.get("id"),
+                "llm_call_avoided": source,
+                **details,
+                "timings": {"static_reply": round((time.perf_counter() - started) * 1000, 3)}
+            }
+        }
+    
+    async def _advance_flow(
+        self,
+        message: str,
+        agent_config: Dict[str, Any],
+        conversation_id: Optional[str]
+    ) -> Optional[FlowTurn]:
+        """Turno no fluxo compilado do agente (None se o agente não tem fluxo)"""
+        
+        flow = flow_cache.get(agent_config)
+        if flow is None or not conversation_id:
+            return None
+        
+        # A conversa guarda só o cursor ("versão:nó"); o grafo é o compilado compartilhado
+        cursor = FlowCursor.decode(await cache_service.get_flow_cursor(conversation_id))
+        turn = flow.advance(cursor, message)
+        if turn.cursor != cursor:
+            await cache_service.set_flow_cursor(conversation_id, turn.cursor.encode())
+        return turn
+    
+    @staticmethod
+    def _dispatch_flow_actions(
+        flow_turn: FlowTurn,
+        message: str,
+        agent_config: Dict[str, Any],
+        user_context: Dict[str, Any]
+    ) -> None:
+        """Uma task Celery por nó api/integration alcançado (o turno não espera a chamada externa)"""
+        
+        # Import tardio: as tasks importam este módulo
+        from app.workers.ai_tasks import run_flow_action
+        
+        for action in flow_turn.actions:
+            try:
+                run_flow_action.delay(
+                    kind=action.kind,
+                    node_id=action.node_id,
+                    data=thaw(action.data),
+                    conversation_id=user_context.get("conversation_id"),
+                    organization_id=user_context.get("organization_id"),
+                    agent_id=agent_config.get("id"),
+                    message=message
+                )
+            except Exception as e:
+                logger.error(f"Error scheduling flow action {action.node_id}: {e}")
+    
+    async def _prepare_turn(
+        self,
+        message: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        agent_config: Dict[str, Any],
+        user_context: Dict[str, Any],
+        knowledge_context: Optional[List[str]],
+        model_tier: Optional[str]
+    ) -> TurnPreparation:
+        """Etapas independentes do turno em paralelo (o que o chamador já informou não é recalculado)"""
+        
+        conversation_id = user_context.get("conversation_id")
+        context_deadline = settings.TURN_CONTEXT_DEADLINE_MS / 1000
+        
+        async def load_history() -> List[Dict[str, str]]:
+            if conversation_history is not None:
+                return conversation_history
+            context = await cache_service.get_conversation_context(conversation_id) if conversation_id else None
+            return (context or {}).get("messages", [])
+        
+        async def load_summary() -> Optional[Dict[str, Any]]:
+            return await conversation_summarizer.load(conversation_id)
+        
+        async def load_knowledge() -> List[str]:
+            if knowledge_context is not None:
+                return knowledge_context
+            return await self._search_knowledge(message, agent_config, user_context)
+        
+        async def route(history: List[Dict[str, str]]) -> Optional[Tuple[ModelTier, Dict[str, Any]]]:
+            if model_tier is not None:
+                return None
+            return await self.router.route_request(message, history, user_context, agent_config)
+        
+        stages = [
+            TurnStage("history", load_history, default=[], deadline=context_deadline),
+            TurnStage("summary", load_summary, deadline=context_deadline),
+            TurnStage(
+                "knowledge",
+                load_knowledge,
+                default=[],
+                deadline=agent_config.get("knowledge_deadline_ms", settings.TURN_KNOWLEDGE_DEADLINE_MS) / 1000
+            ),
+            TurnStage("routing", route, deadline=settings.TURN_ROUTING_DEADLINE_MS / 1000, after=("history",)),
+        ]
+        
+        return await TurnPipeline(stages).run()
+    
+    async def _search_knowledge(
+        self,
+        message: str,
+        agent_config: Dict[str, Any],
+        user_context: Dict[str, Any]
+    ) -> List[str]:
+        """Trechos da base de conhecimento do agente para a mensagem"""
+        
+        knowledge_base_id = agent_config.get("knowledge_base_id")
+        organization_id = user_context.get("organization_id")
+        if not knowledge_base_id or not organization_id:
+            return []
+        
+        conversation_id = user_context.get("conversation_id")
+        limit = agent_config.get("knowledge_limit", 5)
+        
+        # Chunks pré-carregados da conversa; sem cobertura suficiente, busca vetorial
+        results = knowledge_prefetcher.lookup(conversation_id, knowledge_base_id, message, limit)
+        if results is None:
+            results = await self.knowledge_service.search_knowledge(
+                query=message,
+                knowledge_base_id=knowledge_base_id,
+                organization_id=organization_id,
+                limit=limit
+            )
+            knowledge_prefetcher.remember(
+                conversation_id, organization_id, knowledge_base_id, results, intent=self._detect_intent(message)
+            )
+        
+        return [
+            f"{result['title']}\n{result['content']}" if result.get("title") else result["content"]
+            for result in results
+        ]
+    
+    @property
+    def router(self) -> AIRouter:
+        if self._router is None:
+            self._router = AIRouter()
+        return self._router
+    
+    @property
+    def knowledge_service(self):
+        if self._knowledge_service is None:
+            # O mesmo cliente Qdrant do prefetch (criado só para agentes com base de conhecimento)
+            self._knowledge_service = knowledge_prefetcher.knowledge_service
+        return self._knowledge_service
+    
+    def on_conversation_start(self, agent_config: Dict[str, Any], user_context: Dict[str, Any]) -> bool:
+        """Conversa aberta: pré-carrega o conhecimento mais usado da base do agente"""
+        return knowledge_prefetcher.schedule(
+            user_context.get("conversation_id"),
+            user_context.get("organization_id"),
+            agent_config.get("knowledge_base_id")
+        )
+    
+    def on_typing(
+        self,
+        agent_config: Dict[str, Any],
+        user_context: Dict[str, Any],
+        previous_intent: Optional[str] = None
+    ) -> bool:
+        """Canal sinalizou "digitando": pré-carrega o conhecimento do intent anterior da conversa"""
+        return knowledge_prefetcher.schedule(
+            user_context.get("conversation_id"),
+            user_context.get("organization_id"),
+            agent_config.get("knowledge_base_id"),
+            intent=previous_intent
+        )
+    
     def _build_messages(
         self,
         message: str,
         conversation_history: List[Dict[str, str]],
         agent_config: Dict[str, Any],
-        knowledge_context: Optional[List[str]] = None
+        knowledge_context: Optional[List[str]] = None,
+        model_tier: Optional[str] = None,
+        conversation_summary: Optional[str] = None,
+        system_prompt: Optional[str] = None
     ) -> List[Dict[str, str]]:
-        """Constrói array de mensagens com contexto"""
+        """Constrói array de mensagens com contexto dentro do orçamento de tokens"""
         
         messages = []
         
+        # Orçamento de entrada para o tier (menor janela se o tier ainda não é conhecido)
+        budget = prompt_budgeter.input_budget(
+            tier=model_tier,
+            max_output_tokens=agent_config.get("max_tokens", 2048),
+            max_prompt_tokens=agent_config.get("max_prompt_tokens")
+        )
+        
         # System message com configuração do agente
-        system_content = agent_config.get("prompt", "Você é um assistente útil.")
+        system_content = system_prompt or agent_config.get("prompt", "Você é um assistente útil.")
         
-        # Adicionar contexto de conhecimento se disponível
-        if knowledge_context:
-            system_content += "\n\nContexto relevante da base de conhecimento:\n"
-            for i, context in enumerate(knowledge_context[:5]):  # Limitar a 5 contextos
-                system_content += f"\n{i+1}. {context}"
+        current_message = {
+            "role": "user",
+            "content": message
+        }
+        budget -= prompt_budgeter.tokenizer.count_message(current_message)
+        budget -= prompt_budgeter.tokenizer.count_message({"content": system_content})
         
+        # System prompt do agente sozinho na primeira mensagem: prefixo estável entre turnos
+        # (cacheável pelo provider); o conhecimento muda a cada turno e vem em seguida
         messages.append({
             "role": "system",
             "content": system_content
         })
         
-        # Adicionar histórico de conversa (últimas N mensagens)
-        history_limit = agent_config.get("history_limit", 10)
-        for msg in conversation_history[-history_limit:]:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        # Resumo dos turnos antigos: muda só quando o resumo é atualizado
+        if conversation_summary:
+            summary_message = {
+                "role": "system",
+                "content": f"Resumo da conversa até aqui:\n{conversation_summary}"
+            }
+            budget -= prompt_budgeter.tokenizer.count_message(summary_message)
+            messages.append(summary_message)
+        
+        # Adicionar contexto de conhecimento se disponível
+        if knowledge_context:
+            snippets = prompt_budgeter.pack_knowledge(
+                knowledge_context,
+                budget=int(budget * KNOWLEDGE_BUDGET_SHARE)
+            )
+            if snippets:
+                knowledge_content = "Contexto relevante da base de conhecimento:\n"
+                for i, context in enumerate(snippets):
+                    knowledge_content += f"\n{i+1}. {context}"
+                knowledge_message = {
+                    "role": "system",
+                    "content": knowledge_content
+                }
+                budget -= prompt_budgeter.tokenizer.count_message(knowledge_message)
+                messages.append(knowledge_message)
+        
+        # Adicionar histórico de conversa (mais recentes que cabem no orçamento)
+        history, _ = prompt_budgeter.pack_history(
+            [{"role": msg["role"], "content": msg["content"]} for msg in conversation_history],
+            budget=budget,
+            max_messages=agent_config.get("history_limit"),
+            max_tokens=agent_config.get("history_max_tokens", settings.HISTORY_MAX_TOKENS)
+        )
+        messages.extend(history)
         
         # Adicionar mensagem atual
-        messages.append({
-            "role": "user",
-            "content": message
-        })
+        messages.append(current_message)
         
         return messages
     
     def _detect_intent(self, message: str) -> str:
-        """Detecta intent básico da mensagem"""
-        message_lower = message.lower()
+        """Detecta intent da mensagem (classificador treinado; regras se a confiança for baixa)"""
+        intent, _ = intent_classifier.classify(message, self._keyword_intent)
+        return intent
+    
+    @staticmethod
+    def _keyword_intent(message: str) -> str:
+        """Detecção de intent por palavras-chave"""
+        keywords = keyword_matcher.scan(message)
         
-        # Detecção simples de intent
-        # Em produção, usar um classificador ML
-        if any(greeting in message_lower for greeting in ["oi", "olá", "bom dia", "boa tarde", "boa noite"]):
+        if "greeting" in keywords:
             return "greeting"
-        elif any(word in message_lower for word in ["preço", "custo", "valor", "quanto"]):
+        elif "pricing" in keywords or "price_question" in keywords:
             return "pricing_query"
-        elif any(word in message_lower for word in ["comprar", "adquirir", "pedido"]):
+        elif "purchase" in keywords or "order" in keywords:
             return "purchase_intent"
-        elif any(word in message_lower for word in ["problema", "erro", "não funciona", "ajuda"]):
+        elif "support" in keywords or "help" in keywords:
             return "support_request"
-        elif any(word in message_lower for word in ["cancelar", "desistir", "parar"]):
+        elif "cancellation" in keywords:
             return "cancellation"
         else:
             return "general_query"
     
-    async def _process_stream(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
-        """Processa stream de resposta"""
-        async for line in stream:
-            if line.startswith("data: "):
-                data = line[6:]
-                if data == "[DONE]":
-                    break
-                    
-                try:
-                    chunk = json.loads(data)
-                    if "choices" in chunk and chunk["choices"]:
-                        content = chunk["choices"][0].get("delta", {}).get("content", "")
-                        if content:
-                            yield content
-                except json.JSONDecodeError:
-                    continue
+    @staticmethod
+    def _with_prefix(content: Optional[str], prefix: Optional[str]) -> Optional[str]:
+        """Texto fixo (mensagens do fluxo) antes da resposta do LLM"""
+        if not prefix:
+            return content
+        return f"{prefix}\n\n{content}" if content else prefix
+    
+    async def _process_stream(
+        self,
+        stream: AsyncIterator[str],
+        timings: Optional[Dict[str, float]] = None,
+        started: Optional[float] = None,
+        prefix: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Processa stream de resposta (timings["first_token"]: ms do início do turno ao 1º token).
+        
+        prefix (mensagens fixas do fluxo) sai antes do primeiro token do LLM.
+        """
+        try:
+            if prefix:
+                yield f"{prefix}\n\n"
+            async for line in stream:
+                if line.startswith("data: "):
+                    data = line[6:]
+                    if data == "[DONE]":
+                        break
+                        
+                    try:
+                        chunk = json.loads(data)
+                        if "choices" in chunk and chunk["choices"]:
+                            content = chunk["choices"][0].get("delta", {}).get("content", "")
+                            if content:
+                                if timings is not None and "first_token" not in timings and started is not None:
+                                    timings["first_token"] = round((time.perf_counter() - started) * 1000, 2)
+                                yield content
+                    except json.JSONDecodeError:
+                        continue
+        finally:
+            # Fecha a conexão com o gateway no fim, em erro ou quando o consumidor desiste
+            await stream.aclose()
     
     async def analyze_conversation(
         self,
@@ -213,6 +641,17 @@ class AIService:
     ) -> Dict[str, Any]:
         """Analisa conversa para insights"""
         
+        response = await self.chat_completion(**self.conversation_analysis_request(conversation_id, organization_id))
+        
+        return {
+            "conversation_id": conversation_id,
+            "analysis": response["choices"][0]["message"]["content"],
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
+    def conversation_analysis_request(self, conversation_id: str, organization_id: str) -> Dict[str, Any]:
+        """Requisição de análise de conversa (chat_completion ou item de batch)"""
+        
         # Preparar prompt de análise
         messages = [
             {
@@ -239,34 +678,80 @@ class AIService:
             "conversation_id": conversation_id
         }
         
-        response = await self.chat_completion(
-            messages=messages,
-            metadata=metadata,
-            temperature=0.3,
-            max_tokens=1000
-        )
-        
         return {
-            "conversation_id": conversation_id,
-            "analysis": response["choices"][0]["message"]["content"],
-            "timestamp": datetime.utcnow().isoformat()
+            "messages": messages,
+            "metadata": metadata,
+            "temperature": 0.3,
+            "max_tokens": 1000
         }
     
+    async def create_batch(
+        self,
+        requests: List[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Cria um job de batch no gateway (baixa prioridade, capacidade ociosa)"""
+        
+        response = await gateway_client.get().post(
+            f"{self.base_url}/ai/batches",
+            json={"requests": requests, "metadata": metadata or {}},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        
+        return response.json()
+    
+    async def batch_completion(
+        self,
+        requests: List[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]] = None,
+        poll_interval: Optional[float] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Executa completions como batch e aguarda os resultados (por custom_id).
+        
+        Cada requisição tem custom_id, messages e, opcionalmente, metadata,
+        temperature e max_tokens. Requisições que falharam vêm com status
+        "failed"; se o prazo estourar, o restante do batch é cancelado e fica
+        fora do resultado.
+        """
+        
+        poll_interval = poll_interval or settings.AI_BATCH_POLL_INTERVAL
+        deadline = time.monotonic() + (timeout or settings.AI_BATCH_TIMEOUT)
+        
+        batch = await self.create_batch(requests, metadata)
+        client = gateway_client.get()
+        
+        while batch["status"] not in ("completed", "cancelled"):
+            if time.monotonic() > deadline:
+                logger.warning(f"Batch {batch['id']} timed out, cancelling remaining requests")
+                await client.post(f"{self.base_url}/ai/batches/{batch['id']}/cancel", timeout=self.timeout)
+                break
+            await asyncio.sleep(poll_interval)
+            response = await client.get(f"{self.base_url}/ai/batches/{batch['id']}", timeout=self.timeout)
+            response.raise_for_status()
+            batch = response.json()
+        
+        response = await client.get(f"{self.base_url}/ai/batches/{batch['id']}/results", timeout=self.timeout)
+        response.raise_for_status()
+        
+        return response.json()["results"]
+    
+    @staticmethod
+    def batch_content(result: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Texto gerado de um resultado de batch (None se falhou)"""
+        if not result or result.get("status") != "succeeded":
+            return None
+        return result["response"]["choices"][0]["message"]["content"]
+    
     async def get_available_models(self, organization_id: str) -> List[Dict[str, Any]]:
         """Lista modelos disponíveis para a organização"""
         
-        headers = {
-            "Authorization": f"Bearer {settings.LITELLM_API_KEY}"
-        }
+        response = await gateway_client.get().get(f"{self.base_url}/ai/models")
+        response.raise_for_status()
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/ai/models",
-                headers=headers
-            )
-            response.raise_for_status()
-            
-            return response.json()["data"]
+        return response.json()["data"]
     
     async def get_usage_stats(
         self,
@@ -282,16 +767,14 @@ class AIService:
         if end_date:
             params["end_date"] = end_date
             
-        headers = {
-            "Authorization": f"Bearer {settings.LITELLM_API_KEY}"
-        }
+        response = await gateway_client.get().get(
+            f"{self.base_url}/ai/usage",
+            params=params
+        )
+        response.raise_for_status()
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/ai/usage",
-                headers=headers,
-                params=params
-            )
-            response.raise_for_status()
-            
-            return response.json()
+        return response.json()
+
+
+# Singleton instance (client HTTP compartilhado pelas instâncias de AIService)
+gateway_client = GatewayClient()
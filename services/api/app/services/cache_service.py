@@ -225,6 +225,8 @@ class CacheService:
             "total_requests": 0,
             "total_tokens": 0,
             "total_cost": 0.0,
+            "llm_calls_avoided": 0,
+            "llm_calls_avoided_by_source": {},
             "by_model": {},
             "by_date": {}
         }
@@ -270,6 +272,12 @@ class CacheService:
                                 if model not in stats["by_model"]:
                                     stats["by_model"][model] = {"requests": 0, "tokens": 0, "cost": 0}
                                 stats["by_model"][model]["cost"] += float(value)
+                                
+                            elif metric_type == "llm_calls_avoided":
+                                # Aqui o último segmento é a origem (greeting, template, qa, flow)
+                                stats["llm_calls_avoided"] += int(value)
+                                by_source = stats["llm_calls_avoided_by_source"]
+                                by_source[model] = by_source.get(model, 0) + int(value)
                 
                 current += timedelta(days=1)
                 
@@ -345,6 +353,299 @@ class CacheService:
             
         return None
 
+    
+    async def get_conversation_summary(
+        self,
+        conversation_id: str
+    ) -> Optional[Dict[str, Any]]:
+        """Recupera resumo incremental da conversa"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"conversation_summary:{conversation_id}"
+        
+        try:
+            cached = await redis_client.get(key)
+            if cached:
+                return json.loads(cached)
+                
+        except Exception as e:
+            logger.error(f"Error getting conversation summary: {e}")
+            
+        return None
+    
+    async def set_conversation_summary(
+        self,
+        conversation_id: str,
+        summary: Dict[str, Any],
+        ttl_seconds: int = 30 * 24 * 3600  # 30 dias
+    ):
+        """Armazena resumo incremental da conversa"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"conversation_summary:{conversation_id}"
+        
+        try:
+            await redis_client.setex(key, ttl_seconds, json.dumps(summary))
+            
+        except Exception as e:
+            logger.error(f"Error storing conversation summary: {e}")
+    
+    async def get_conversation_complexity(
+        self,
+        conversation_id: str
+    ) -> Optional[Dict[str, Any]]:
+        """Recupera o agregado de complexidade da conversa (roteamento)"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"conversation_complexity:{conversation_id}"
+        
+        try:
+            cached = await redis_client.get(key)
+            if cached:
+                return json.loads(cached)
+                
+        except Exception as e:
+            logger.error(f"Error getting conversation complexity: {e}")
+            
+        return None
+    
+    async def set_conversation_complexity(
+        self,
+        conversation_id: str,
+        state: Dict[str, Any],
+        ttl_seconds: int = 30 * 24 * 3600  # 30 dias, como o resumo
+    ):
+        """Armazena o agregado de complexidade da conversa"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"conversation_complexity:{conversation_id}"
+        
+        try:
+            await redis_client.setex(key, ttl_seconds, json.dumps(state))
+            
+        except Exception as e:
+            logger.error(f"Error storing conversation complexity: {e}")
+    
+    async def record_knowledge_hits(
+        self,
+        organization_id: str,
+        knowledge_base_id: str,
+        chunk_ids: List[Any],
+        intent: Optional[str] = None,
+        ttl_seconds: int = 30 * 24 * 3600  # 30 dias
+    ):
+        """Conta os chunks retornados pelas buscas da base (no geral e por intent)"""
+        
+        redis_client = await self.get_redis()
+        
+        keys = [f"kb_hits:{organization_id}:{knowledge_base_id}"]
+        if intent:
+            keys.append(f"kb_hits:{organization_id}:{knowledge_base_id}:{intent}")
+        
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    for chunk_id in chunk_ids:
+                        pipe.zincrby(key, 1, json.dumps(chunk_id))
+                    pipe.expire(key, ttl_seconds)
+                await pipe.execute()
+                
+        except Exception as e:
+            logger.error(f"Error recording knowledge hits: {e}")
+    
+    async def get_top_knowledge_chunks(
+        self,
+        organization_id: str,
+        knowledge_base_id: str,
+        intent: Optional[str] = None,
+        limit: int = 20
+    ) -> List[Any]:
+        """IDs dos chunks mais retornados da base (do intent, se informado)"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"kb_hits:{organization_id}:{knowledge_base_id}"
+        if intent:
+            key = f"{key}:{intent}"
+        
+        try:
+            return [json.loads(member) for member in await redis_client.zrevrange(key, 0, limit - 1)]
+            
+        except Exception as e:
+            logger.error(f"Error getting top knowledge chunks: {e}")
+            
+        return []
+    
+    async def set_knowledge_qa_pairs(
+        self,
+        organization_id: str,
+        knowledge_base_id: str,
+        document_id: str,
+        qa_pairs: List[Dict[str, Any]]
+    ):
+        """Armazena os pares pergunta/resposta de um documento da base (respostas rápidas)"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"kb_qa:{organization_id}:{knowledge_base_id}"
+        pairs = [{"question": p["question"], "answer": p["answer"]} for p in qa_pairs]
+        
+        try:
+            await redis_client.hset(key, str(document_id), json.dumps(pairs))
+            
+        except Exception as e:
+            logger.error(f"Error storing knowledge Q/A pairs: {e}")
+    
+    async def get_knowledge_qa_pairs(
+        self,
+        organization_id: str,
+        knowledge_base_id: str
+    ) -> List[Dict[str, Any]]:
+        """Todos os pares pergunta/resposta da base"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"kb_qa:{organization_id}:{knowledge_base_id}"
+        
+        try:
+            documents = await redis_client.hvals(key)
+            return [pair for document in documents for pair in json.loads(document)]
+            
+        except Exception as e:
+            logger.error(f"Error getting knowledge Q/A pairs: {e}")
+            
+        return []
+    
+    async def increment_llm_calls_avoided(self, organization_id: str, source: str):
+        """Conta turno respondido sem LLM (entra em get_usage_stats)"""
+        
+        redis_client = await self.get_redis()
+        
+        today = datetime.utcnow().strftime("%Y%m%d")
+        key = f"usage:{organization_id}:{today}:llm_calls_avoided:{source}"
+        
+        try:
+            pipe = redis_client.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, 35 * 24 * 3600)
+            await pipe.execute()
+            
+        except Exception as e:
+            logger.error(f"Error incrementing llm_calls_avoided: {e}")
+    
+    async def get_flow_cursor(self, conversation_id: str) -> Optional[str]:
+        """Recupera a posição da conversa no fluxo do agente ("versão:nó")"""
+        
+        redis_client = await self.get_redis()
+        
+        try:
+            return await redis_client.get(f"flow_cursor:{conversation_id}")
+            
+        except Exception as e:
+            logger.error(f"Error getting flow cursor: {e}")
+            
+        return None
+    
+    async def set_flow_cursor(
+        self,
+        conversation_id: str,
+        cursor: str,
+        ttl_seconds: int = 30 * 24 * 3600  # 30 dias, como o resumo
+    ):
+        """Armazena a posição da conversa no fluxo do agente"""
+        
+        redis_client = await self.get_redis()
+        
+        try:
+            await redis_client.setex(f"flow_cursor:{conversation_id}", ttl_seconds, cursor)
+            
+        except Exception as e:
+            logger.error(f"Error storing flow cursor: {e}")
+    
+    async def get_agent_config(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """Recupera a configuração enxuta do agente (AgentConfigCache)"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"agent_config:{agent_id}"
+        
+        try:
+            cached = await redis_client.get(key)
+            if cached:
+                return json.loads(cached)
+                
+        except Exception as e:
+            logger.error(f"Error getting agent config: {e}")
+            
+        return None
+    
+    async def set_agent_config(
+        self,
+        agent_id: str,
+        config: Dict[str, Any],
+        ttl_seconds: int = 3600
+    ):
+        """Armazena a configuração enxuta do agente"""
+        
+        redis_client = await self.get_redis()
+        
+        key = f"agent_config:{agent_id}"
+        
+        try:
+            await redis_client.setex(key, ttl_seconds, json.dumps(config))
+            
+        except Exception as e:
+            logger.error(f"Error storing agent config: {e}")
+    
+    async def delete_agent_config(self, agent_id: str):
+        """Remove a configuração do agente do cache"""
+        
+        redis_client = await self.get_redis()
+        
+        try:
+            await redis_client.delete(f"agent_config:{agent_id}")
+            
+        except Exception as e:
+            logger.error(f"Error deleting agent config: {e}")
+    
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        """Publica mensagem (JSON) num canal pub/sub"""
+        
+        redis_client = await self.get_redis()
+        
+        try:
+            await redis_client.publish(channel, json.dumps(message))
+            
+        except Exception as e:
+            logger.error(f"Error publishing to {channel}: {e}")
+    
+    async def acquire_lock(self, name: str, ttl_seconds: int = 60) -> bool:
+        """Lock simples (SET NX) para evitar trabalho duplicado entre workers"""
+        
+        redis_client = await self.get_redis()
+        
+        try:
+            return bool(await redis_client.set(f"lock:{name}", "1", nx=True, ex=ttl_seconds))
+            
+        except Exception as e:
+            logger.error(f"Error acquiring lock {name}: {e}")
+            return False
+    
+    async def release_lock(self, name: str):
+        """Libera lock adquirido com acquire_lock"""
+        
+        redis_client = await self.get_redis()
+        
+        try:
+            await redis_client.delete(f"lock:{name}")
+            
+        except Exception as e:
+            logger.error(f"Error releasing lock {name}: {e}")
+
 
 # Singleton instance
 cache_service = CacheService()
@@ -0,0 +1,211 @@
+"""
+Resumo incremental de conversas
+Turnos antigos são condensados em background por um modelo tier 1 para limitar o tamanho do prompt
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from app.core.config import settings
+from app.services.cache_service import cache_service
+from app.services.token_budget import prompt_budgeter
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_LOCK_TTL = 120
+
+# Últimas mensagens resumidas guardadas como âncora para reencontrar o ponto no histórico
+ANCHOR_MESSAGES = 3
+
+SUMMARY_PROMPT = """Você mantém o resumo de uma conversa de atendimento.
+Atualize o resumo anterior incorporando os novos turnos. Preserve:
+- nome, empresa e dados informados pelo cliente
+- produtos, preços e condições discutidos
+- problemas relatados e o que já foi tentado
+- compromissos, pendências e próximos passos
+Seja objetivo, em tópicos, sem inventar informações. Responda apenas com o resumo."""
+
+
+def message_key(message: Dict[str, Any]) -> str:
+    """Identidade da mensagem: o id, ou hash de role + conteúdo quando não há id"""
+    if message.get("id") is not None:
+        return f"id:{message['id']}"
+    text = f"{message.get('role')}\x00{message.get('content') or ''}"
+    return "h:" + hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ConversationSummarizer:
+    """
+    Mantém um resumo incremental por conversa.
+
+    O resumo armazenado guarda a âncora (message_key das últimas mensagens
+    resumidas): o ponto resumido é reencontrado pelo conteúdo, e não pela
+    posição, porque o chamador pode mandar o histórico janelado ou
+    truncado. `covered` só versiona o resumo (conferido antes de
+    sobrescrever). O prompt usa resumo + turnos ainda não resumidos; quando estes passam de trigger_tokens, os mais
+    antigos (exceto os keep_recent últimos) são condensados por uma task Celery.
+    """
+
+    def __init__(self):
+        self.tokenizer = prompt_budgeter.tokenizer
+
+    async def load(self, conversation_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not conversation_id:
+            return None
+        return await cache_service.get_conversation_summary(conversation_id)
+
+    def split(
+        self,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """Retorna (texto do resumo, mensagens ainda não resumidas)"""
+
+        if not summary or not summary.get("summary"):
+            return None, conversation_history
+
+        start = self._covered_index(conversation_history, summary)
+        if start is None:
+            # Histórico não contém o ponto resumido (ex.: histórico truncado pelo chamador)
+            return None, conversation_history
+
+        return summary["summary"], conversation_history[start:]
+
+    def _covered_index(
+        self,
+        conversation_history: List[Dict[str, Any]],
+        summary: Dict[str, Any]
+    ) -> Optional[int]:
+        anchor = summary.get("anchor")
+        if not anchor:
+            # Resumo sem âncora: a posição absoluta não vale para um histórico janelado
+            return None
+
+        keys = [message_key(m) for m in conversation_history]
+        # Do fim para o começo; no início do histórico (janela cortou a âncora) vale o pedaço que restou
+        for end in range(len(keys), 0, -1):
+            size = min(len(anchor), end)
+            if keys[end - size:end] == anchor[-size:]:
+                return end
+        return None
+
+    async def maybe_schedule(
+        self,
+        conversation_id: Optional[str],
+        organization_id: Optional[str],
+        pending: List[Dict[str, Any]],
+        previous_summary: Optional[str],
+        base_covered: int,
+        expected_covered: int = 0,
+        trigger_tokens: Optional[int] = None,
+        keep_recent: Optional[int] = None
+    ) -> bool:
+        """
+        Agenda a atualização do resumo se os turnos não resumidos passaram do limite.
+
+        base_covered é a posição de pending no histórico; expected_covered é o
+        covered do resumo armazenado, conferido antes de sobrescrever.
+        """
+
+        if not conversation_id:
+            return False
+
+        trigger_tokens = trigger_tokens or settings.CONVERSATION_SUMMARY_TRIGGER_TOKENS
+        keep_recent = keep_recent if keep_recent is not None else settings.CONVERSATION_SUMMARY_KEEP_RECENT
+
+        if len(pending) <= keep_recent:
+            return False
+        if self.tokenizer.count_messages(pending) <= trigger_tokens:
+            return False
+
+        # Um resumo por vez por conversa
+        if not await cache_service.acquire_lock(f"summary:{conversation_id}", SUMMARY_LOCK_TTL):
+            return False
+
+        turns = pending[:len(pending) - keep_recent] if keep_recent else pending
+
+        # Import tardio: as tasks importam este módulo
+        from app.workers.ai_tasks import update_conversation_summary
+
+        try:
+            update_conversation_summary.delay(
+                conversation_id=conversation_id,
+                organization_id=organization_id,
+                previous_summary=previous_summary,
+                turns=[{"role": m["role"], "content": m["content"]} for m in turns],
+                expected_covered=expected_covered,
+                covered=base_covered + len(turns),
+                anchor=[message_key(m) for m in turns[-ANCHOR_MESSAGES:]]
+            )
+        except Exception as e:
+            logger.error(f"Error scheduling summary for {conversation_id}: {e}")
+            await cache_service.release_lock(f"summary:{conversation_id}")
+            return False
+
+        return True
+
+    def build_prompt(self, previous_summary: Optional[str], turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        transcript = "\n".join(
+            f"{'Cliente' if m['role'] == 'user' else 'Agente'}: {m['content']}"
+            for m in turns
+        )
+
+        content = ""
+        if previous_summary:
+            content += f"Resumo anterior:\n{previous_summary}\n\n"
+        content += f"Novos turnos:\n{transcript}"
+
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": content}
+        ]
+
+    async def update(
+        self,
+        ai_service,
+        conversation_id: str,
+        organization_id: Optional[str],
+        previous_summary: Optional[str],
+        turns: List[Dict[str, str]],
+        expected_covered: int,
+        covered: int,
+        anchor: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Gera o novo resumo e armazena se ninguém avançou o resumo nesse meio tempo"""
+
+        try:
+            response = await ai_service.chat_completion(
+                messages=self.build_prompt(previous_summary, turns),
+                metadata={
+                    "organization_id": organization_id,
+                    "conversation_id": conversation_id,
+                    "task": "conversation_summary",
+                    "intent": "summarization"
+                },
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+
+            current = await cache_service.get_conversation_summary(conversation_id)
+            if (current or {}).get("covered", 0) != expected_covered:
+                logger.info(f"Summary for {conversation_id} changed concurrently, discarding")
+                return None
+
+            summary = {
+                "summary": response["choices"][0]["message"]["content"].strip(),
+                "covered": covered,
+                "anchor": anchor,
+                "updated_at": datetime.utcnow().isoformat()
+            }
+            await cache_service.set_conversation_summary(conversation_id, summary)
+            return summary
+
+        finally:
+            await cache_service.release_lock(f"summary:{conversation_id}")
+
+
+# Singleton instance
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,307 @@
+"""
+Flow Engine - fluxos do AgentStudio compilados em máquina de estados
+"""
+
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple, Callable, Mapping, NamedTuple
+import logging
+
+from app.core.config import settings
+from app.services.agent_config_cache import freeze, thaw
+from app.services.keyword_matcher import normalize
+
+logger = logging.getLogger(__name__)
+
+# Tipos de nó do AgentStudio (packages/agent-studio/src/nodes)
+MESSAGE = "message"
+CONDITION = "condition"
+PROMPT = "prompt"
+API = "api"
+INTEGRATION = "integration"
+
+# Nós sem saída apontam para END
+END = -1
+
+# Campos de nó/aresta validados pelos schemas (o ReactFlow grava outros, como width e selected)
+NODE_FIELDS = ("id", "type", "position", "data")
+EDGE_FIELDS = ("id", "source", "target", "sourceHandle", "targetHandle", "data")
+
+Predicate = Callable[[str], bool]
+
+
+class FlowCompileError(ValueError):
+    """Fluxo inválido (não compila)"""
+
+
+def compile_predicate(data: Mapping[str, Any]) -> Tuple[Predicate, Optional[str]]:
+    """Predicado de um nó de condição sobre a mensagem (e aviso, se não suportado)"""
+    condition_type = data.get("conditionType") or "contains"
+
+    if condition_type == "custom":
+        # Código JavaScript do editor não roda no backend
+        return (lambda message: False), "custom (JavaScript) conditions are not supported, always false"
+
+    value = data.get("conditionValue") or ""
+    if not value:
+        return (lambda message: False), "empty condition value, always false"
+
+    if condition_type == "regex":
+        try:
+            pattern = re.compile(value, re.IGNORECASE)
+        except re.error as e:
+            return (lambda message: False), f"invalid regex ({e}), always false"
+        return (lambda message: pattern.search(message) is not None), None
+
+    expected = " ".join(normalize(value).split())
+    comparisons = {
+        "contains": lambda text: expected in text,
+        "equals": lambda text: text == expected,
+        "startsWith": lambda text: text.startswith(expected),
+        "endsWith": lambda text: text.endswith(expected),
+    }
+    if condition_type not in comparisons:
+        return (lambda message: False), f"unknown condition type {condition_type}, always false"
+
+    compare = comparisons[condition_type]
+    return (lambda message: compare(" ".join(normalize(message).split()))), None
+
+
+class FlowCursor(NamedTuple):
+    """Posição da conversa no fluxo: versão compilada e índice do nó (END: fluxo terminou)"""
+    version: int
+    node: int
+
+    def encode(self) -> str:
+        return f"{self.version}:{self.node}"
+
+    @classmethod
+    def decode(cls, value: Optional[str]) -> Optional["FlowCursor"]:
+        try:
+            version, node = value.split(":")
+            return cls(int(version), int(node))
+        except (AttributeError, ValueError):
+            return None
+
+
+@dataclass(frozen=True)
+class FlowAction:
+    """Efeito colateral de um nó (api/integration), despachado pelo AIService como task run_flow_action"""
+    kind: str
+    node_id: str
+    data: Mapping[str, Any]
+
+
+@dataclass
+class FlowTurn:
+    """
+    Resultado de um turno no fluxo.
+
+    messages: textos fixos a enviar; prompt: dados do nó de prompt alcançado
+    (a resposta é do LLM com esse prompt); sem messages nem prompt, o fluxo
+    não tem o que dizer e vale o caminho normal.
+    """
+    cursor: FlowCursor
+    messages: List[str] = field(default_factory=list)
+    actions: List[FlowAction] = field(default_factory=list)
+    prompt: Optional[Mapping[str, Any]] = None
+    steps: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.cursor.node == END
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "cursor": self.cursor.encode(),
+            "finished": self.finished,
+            "steps": self.steps,
+            "messages": list(self.messages),
+            "actions": [{"kind": a.kind, "node_id": a.node_id, "data": thaw(a.data)} for a in self.actions],
+        }
+
+
+@dataclass(frozen=True)
+class CompiledFlow:
+    """
+    Fluxo de uma versão como tabelas por índice de nó (somente leitura).
+
+    Cada transição é uma indexação de tupla: next_node para a saída
+    padrão, next_true/next_false para condições, com o predicado já
+    compilado em predicates.
+    """
+    agent_id: str
+    version: int
+    node_ids: Tuple[str, ...]
+    kinds: Tuple[str, ...]
+    data: Tuple[Mapping[str, Any], ...]
+    next_node: Tuple[int, ...]
+    next_true: Tuple[int, ...]
+    next_false: Tuple[int, ...]
+    predicates: Tuple[Optional[Predicate], ...]
+    entries: Tuple[int, ...]
+    warnings: Tuple[str, ...] = ()
+
+    def start(self, entry: int = 0) -> FlowCursor:
+        return FlowCursor(self.version, self.entries[entry])
+
+    def advance(self, cursor: Optional[FlowCursor], message: str) -> FlowTurn:
+        """
+        Processa a mensagem a partir do cursor.
+
+        Condições consomem a mensagem do turno; depois que o turno já
+        respondeu, a próxima condição espera a próxima mensagem (o cursor
+        fica nela). Um nó de prompt encerra o turno (responde o LLM).
+        Cursor de outra versão recomeça do ponto de entrada.
+        """
+        if cursor is None or cursor.version != self.version or cursor.node >= len(self.kinds):
+            cursor = self.start()
+
+        turn = FlowTurn(cursor=cursor)
+        node = cursor.node
+        answered = False
+
+        # Limite contra ciclos sem condição
+        while node != END and turn.steps <= len(self.kinds):
+            kind = self.kinds[node]
+
+            if kind == CONDITION:
+                if answered:
+                    break
+                node = self.next_true[node] if self.predicates[node](message) else self.next_false[node]
+                turn.steps += 1
+                continue
+
+            turn.steps += 1
+            if kind == MESSAGE:
+                text = self.data[node].get("message")
+                if text:
+                    turn.messages.append(text)
+                    answered = True
+            elif kind == PROMPT:
+                turn.prompt = self.data[node]
+                node = self.next_node[node]
+                break
+            elif kind in (API, INTEGRATION):
+                turn.actions.append(FlowAction(kind, self.node_ids[node], self.data[node]))
+            node = self.next_node[node]
+
+        turn.cursor = FlowCursor(self.version, node)
+        return turn
+
+
+def compile_flow(agent_id: str, version: int, flow_data: Mapping[str, Any]) -> CompiledFlow:
+    """Valida o JSON do ReactFlow (AgentFlow) e monta as tabelas de transição"""
+    from pydantic import ValidationError
+    from app.models.agent import AgentFlow
+
+    flow_data = thaw(flow_data)
+    try:
+        flow = AgentFlow.model_validate({
+            "nodes": [{k: n[k] for k in NODE_FIELDS if k in n} for n in flow_data.get("nodes") or []],
+            "edges": [{k: e[k] for k in EDGE_FIELDS if k in e} for e in flow_data.get("edges") or []],
+        })
+    except (ValidationError, TypeError, AttributeError) as e:
+        raise FlowCompileError(f"Invalid flow for agent {agent_id} v{version}: {e}")
+
+    if not flow.nodes:
+        raise FlowCompileError(f"Flow for agent {agent_id} v{version} has no nodes")
+
+    index = {node.id: i for i, node in enumerate(flow.nodes)}
+    if len(index) != len(flow.nodes):
+        raise FlowCompileError(f"Flow for agent {agent_id} v{version} has duplicated node ids")
+
+    kinds = [node.type for node in flow.nodes]
+    next_node = [END] * len(kinds)
+    next_true = [END] * len(kinds)
+    next_false = [END] * len(kinds)
+    incoming = [0] * len(kinds)
+    warnings: List[str] = []
+
+    for edge in flow.edges:
+        source, target = index.get(edge.source), index.get(edge.target)
+        if source is None or target is None:
+            warnings.append(f"edge {edge.id} points to a missing node, ignored")
+            continue
+        incoming[target] += 1
+
+        if kinds[source] == CONDITION:
+            branch = next_false if edge.sourceHandle == "false" else next_true
+        else:
+            branch = next_node
+        if branch[source] != END:
+            warnings.append(f"node {edge.source} has more than one {edge.sourceHandle or 'default'} edge, using the first")
+            continue
+        branch[source] = target
+
+    predicates: List[Optional[Predicate]] = []
+    for node, kind in zip(flow.nodes, kinds):
+        if kind != CONDITION:
+            predicates.append(None)
+            continue
+        predicate, warning = compile_predicate(node.data)
+        predicates.append(predicate)
+        if warning:
+            warnings.append(f"node {node.id}: {warning}")
+
+    # Entrada: nós marcados como início ou sem arestas de chegada, na ordem do fluxo
+    entries = [i for i, node in enumerate(flow.nodes) if node.data.get("isStart")]
+    entries += [i for i in range(len(kinds)) if incoming[i] == 0 and i not in entries]
+    if not entries:
+        entries = [0]
+
+    for warning in warnings:
+        logger.warning(f"Flow {agent_id} v{version}: {warning}")
+
+    # Dados dos nós congelados: o fluxo compilado é compartilhado entre conversas
+    return CompiledFlow(
+        agent_id=agent_id,
+        version=version,
+        node_ids=tuple(node.id for node in flow.nodes),
+        kinds=tuple(kinds),
+        data=tuple(freeze(node.data) for node in flow.nodes),
+        next_node=tuple(next_node),
+        next_true=tuple(next_true),
+        next_false=tuple(next_false),
+        predicates=tuple(predicates),
+        entries=tuple(entries),
+        warnings=tuple(warnings)
+    )
+
+
+class CompiledFlowCache:
+    """LRU de fluxos compilados por (agent_id, flow_version): cada versão compila uma vez por processo"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or settings.FLOW_CACHE_SIZE
+        self._flows: "OrderedDict[Tuple[str, int], Optional[CompiledFlow]]" = OrderedDict()
+        self.compiles = 0
+
+    def get(self, agent_config: Mapping[str, Any]) -> Optional[CompiledFlow]:
+        """Fluxo compilado do agente (None sem fluxo ou se não compila)"""
+        flow_data = agent_config.get("flow_data")
+        if not flow_data:
+            return None
+
+        key = (str(agent_config.get("id")), int(agent_config.get("flow_version", 1)))
+        if key in self._flows:
+            self._flows.move_to_end(key)
+            return self._flows[key]
+
+        try:
+            flow = compile_flow(key[0], key[1], flow_data)
+        except FlowCompileError as e:
+            # Guardado como None: uma versão inválida não é recompilada a cada turno
+            logger.error(str(e))
+            flow = None
+        self.compiles += 1
+
+        self._flows[key] = flow
+        while len(self._flows) > self.max_size:
+            self._flows.popitem(last=False)
+        return flow
+
+
+# Singleton instance
+flow_cache = CompiledFlowCache()
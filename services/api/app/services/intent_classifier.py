@@ -0,0 +1,317 @@
+"""
+Intent Classifier - classificador linear em NumPy sobre n-gramas com hashing
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Callable, Sequence
+import logging
+
+from app.core.config import settings
+from app.services.keyword_matcher import normalize
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # Sem NumPy o classificador fica desativado e vale a regra de palavras-chave
+    np = None
+
+# Espaço de features (potência de 2: o hash vira índice com uma máscara)
+N_FEATURES = 1 << 18
+CHAR_NGRAMS = (3, 4, 5)
+KEEP_VERSIONS = 5
+WORD_RE = re.compile(r"\w+")
+
+# Origens de rótulo aceitas no treino (Message.metadata["intent_source"]): revisão humana ou
+# resultado da conversa. Rótulos das regras de palavras-chave ou do próprio modelo ficam de fora,
+# senão o classificador só reaprende as regras e o limiar de confiança não significa acerto.
+CONFIRMED_INTENT_SOURCES = ("human", "outcome")
+
+Prediction = Tuple[str, float]
+
+
+def featurize(text: str) -> Dict[int, float]:
+    """Features esparsas (índice -> valor) de palavras, bigramas e n-gramas de caracteres, norma L2 = 1"""
+    words = WORD_RE.findall(normalize(text or ""))
+    counts: Dict[int, float] = {}
+    mask = N_FEATURES - 1
+
+    def add(feature: str):
+        index = zlib.crc32(feature.encode("utf-8")) & mask
+        counts[index] = counts.get(index, 0.0) + 1.0
+
+    previous = None
+    for word in words:
+        add(f"w:{word}")
+        if previous is not None:
+            add(f"b:{previous} {word}")
+        previous = word
+
+        padded = f" {word} "
+        for n in CHAR_NGRAMS:
+            for i in range(len(padded) - n + 1):
+                add(f"c:{padded[i:i + n]}")
+
+    if counts:
+        norm = sum(v * v for v in counts.values()) ** 0.5
+        for index in counts:
+            counts[index] /= norm
+    return counts
+
+
+def featurize_batch(texts: Sequence[str]) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """Matriz esparsa em CSR (indices, valores, indptr) para um lote de textos"""
+    indices: List[int] = []
+    values: List[float] = []
+    indptr = [0]
+    for text in texts:
+        features = featurize(text)
+        indices.extend(features.keys())
+        values.extend(features.values())
+        indptr.append(len(indices))
+    return (
+        np.asarray(indices, dtype=np.int64),
+        np.asarray(values, dtype=np.float32),
+        np.asarray(indptr, dtype=np.int64)
+    )
+
+
+def softmax(scores: "np.ndarray") -> "np.ndarray":
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class IntentModel:
+    """Pesos (N_FEATURES x classes), bias e rótulos de uma versão"""
+
+    def __init__(self, weights: "np.ndarray", bias: "np.ndarray", labels: List[str], meta: Dict[str, Any]):
+        self.weights = weights
+        self.bias = bias
+        self.labels = labels
+        self.meta = meta
+
+    @property
+    def version(self) -> str:
+        return self.meta.get("version", "unsaved")
+
+    def scores(self, indices: "np.ndarray", values: "np.ndarray", indptr: "np.ndarray") -> "np.ndarray":
+        """Logits por linha do CSR: soma dos pesos das features de cada texto"""
+        rows = len(indptr) - 1
+        scores = np.tile(self.bias.astype(np.float32), (rows, 1))
+        if len(indices):
+            contributions = self.weights[indices] * values[:, None]
+            nonempty = np.flatnonzero(indptr[1:] > indptr[:-1])
+            scores[nonempty] += np.add.reduceat(contributions, indptr[nonempty], axis=0)
+        return scores
+
+    def predict_proba(self, texts: Sequence[str]) -> "np.ndarray":
+        return softmax(self.scores(*featurize_batch(texts)))
+
+    def predict_one(self, text: str) -> Prediction:
+        """Caminho online: sem montar CSR, só as linhas de peso das features da mensagem"""
+        features = featurize(text)
+        scores = self.bias.astype(np.float32)
+        if features:
+            index = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+            value = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+            scores = scores + value @ self.weights[index]
+        probabilities = softmax(scores[None, :])[0]
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+
+def train_model(
+    texts: Sequence[str],
+    labels: Sequence[str],
+    epochs: int = 10,
+    learning_rate: float = 5.0,
+    l2: float = 1e-6,
+    batch_size: int = 256,
+    holdout: float = 0.1,
+    seed: int = 42
+) -> IntentModel:
+    """Regressão logística multinomial com SGD em mini-batches (gradiente esparso por linha de peso)"""
+    classes = sorted(set(labels))
+    class_index = {label: i for i, label in enumerate(classes)}
+    y = np.asarray([class_index[label] for label in labels], dtype=np.int64)
+    indices, values, indptr = featurize_batch(texts)
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(y))
+    n_holdout = int(len(y) * holdout) if len(y) >= 50 else 0
+    test, train = order[:n_holdout], order[n_holdout:]
+
+    weights = np.zeros((N_FEATURES, len(classes)), dtype=np.float32)
+    bias = np.zeros(len(classes), dtype=np.float32)
+    model = IntentModel(weights, bias, classes, {})
+
+    def rows(batch: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray", "np.ndarray", "np.ndarray"]:
+        starts, ends = indptr[batch], indptr[batch + 1]
+        lengths = ends - starts
+        positions = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if lengths.sum() else np.zeros(0, np.int64)
+        return indices[positions], values[positions], np.concatenate([[0], np.cumsum(lengths)]), np.repeat(np.arange(len(batch)), lengths)
+
+    for epoch in range(epochs):
+        rate = learning_rate / (1 + epoch)
+        for start in range(0, len(train), batch_size):
+            batch = train[start:start + batch_size]
+            b_indices, b_values, b_indptr, b_rows = rows(batch)
+
+            delta = softmax(model.scores(b_indices, b_values, b_indptr))
+            delta[np.arange(len(batch)), y[batch]] -= 1.0
+            delta /= len(batch)
+
+            # Gradiente só nas linhas de peso tocadas pelo batch
+            touched, inverse = np.unique(b_indices, return_inverse=True)
+            gradient = np.empty((len(touched), len(classes)), dtype=np.float32)
+            for c in range(len(classes)):
+                gradient[:, c] = np.bincount(inverse, weights=b_values * delta[b_rows, c], minlength=len(touched))
+
+            weights[touched] -= rate * (gradient + l2 * weights[touched])
+            bias -= rate * delta.sum(axis=0)
+
+    accuracy = None
+    if len(test):
+        t_indices, t_values, t_indptr, _ = rows(test)
+        predicted = model.scores(t_indices, t_values, t_indptr).argmax(axis=1)
+        accuracy = float((predicted == y[test]).mean())
+
+    model.meta = {
+        "labels": classes,
+        "n_features": N_FEATURES,
+        "char_ngrams": list(CHAR_NGRAMS),
+        "train_size": int(len(train)),
+        "holdout_size": int(len(test)),
+        "holdout_accuracy": accuracy,
+        "epochs": epochs,
+        "trained_at": datetime.utcnow().isoformat()
+    }
+    return model
+
+
+class IntentClassifier:
+    """
+    Classificador de intent com artefatos versionados.
+
+    Cada versão é um diretório com weights.npy, bias.npy e meta.json; o
+    arquivo CURRENT aponta a versão ativa (troca atômica). Os pesos são
+    abertos com mmap, então processos da API e workers Celery compartilham
+    as páginas do page cache. Abaixo de min_confidence vale a regra de
+    palavras-chave do chamador.
+    """
+
+    def __init__(self, model_dir: Optional[str] = None, min_confidence: Optional[float] = None):
+        self.model_dir = model_dir or settings.INTENT_MODEL_DIR
+        self.min_confidence = min_confidence if min_confidence is not None else settings.INTENT_MIN_CONFIDENCE
+        self.reload_interval = settings.INTENT_MODEL_RELOAD_SECONDS
+        self.model: Optional[IntentModel] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def _current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.model_dir, "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self, force: bool = False) -> Optional[IntentModel]:
+        """Carrega (mmap) a versão de CURRENT; verificada no máximo a cada reload_interval"""
+        if np is None:
+            return None
+
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval:
+            return self.model
+
+        with self._lock:
+            self._checked_at = now
+            version = self._current_version()
+            if version is None or (self.model is not None and self.model.version == version):
+                return self.model
+
+            path = os.path.join(self.model_dir, version)
+            try:
+                with open(os.path.join(path, "meta.json")) as f:
+                    meta = json.load(f)
+                self.model = IntentModel(
+                    np.load(os.path.join(path, "weights.npy"), mmap_mode="r"),
+                    np.load(os.path.join(path, "bias.npy")),
+                    meta["labels"],
+                    meta
+                )
+                logger.info(f"Intent model {version} loaded ({len(meta['labels'])} intents)")
+            except Exception as e:
+                logger.error(f"Error loading intent model {version}: {e}")
+
+        return self.model
+
+    def save(self, model: IntentModel) -> str:
+        """Grava uma nova versão e a ativa; mantém as KEEP_VERSIONS mais recentes"""
+        version = datetime.utcnow().strftime("v%Y%m%d%H%M%S")
+        path = os.path.join(self.model_dir, version)
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, "weights.npy"), np.ascontiguousarray(model.weights, dtype=np.float32))
+        np.save(os.path.join(path, "bias.npy"), model.bias.astype(np.float32))
+        model.meta = {**model.meta, "version": version}
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(model.meta, f)
+
+        current = os.path.join(self.model_dir, "CURRENT")
+        with open(f"{current}.tmp", "w") as f:
+            f.write(version)
+        os.replace(f"{current}.tmp", current)
+
+        versions = sorted(d for d in os.listdir(self.model_dir) if d.startswith("v"))
+        for old in versions[:-KEEP_VERSIONS]:
+            shutil.rmtree(os.path.join(self.model_dir, old), ignore_errors=True)
+
+        self.load(force=True)
+        return version
+
+    def predict(self, text: str) -> Optional[Prediction]:
+        """(intent, confiança) para uma mensagem, ou None sem modelo"""
+        model = self.load()
+        if model is None or not text:
+            return None
+        return model.predict_one(text)
+
+    def predict_batch(self, texts: Sequence[str], chunk_size: int = 4096) -> List[Optional[Prediction]]:
+        """Inferência vetorizada em blocos (analytics)"""
+        model = self.load()
+        if model is None:
+            return [None] * len(texts)
+
+        predictions: List[Optional[Prediction]] = []
+        for start in range(0, len(texts), chunk_size):
+            probabilities = model.predict_proba(texts[start:start + chunk_size])
+            best = probabilities.argmax(axis=1)
+            predictions.extend(
+                (model.labels[i], float(probabilities[row, i]))
+                for row, i in enumerate(best)
+            )
+        return predictions
+
+    def classify(self, text: str, fallback: Callable[[str], str]) -> Tuple[str, Optional[float]]:
+        """Intent do modelo se confiante; senão a regra de palavras-chave (confiança do modelo ou None)"""
+        prediction = self.predict(text)
+        if prediction and prediction[1] >= self.min_confidence:
+            return prediction
+        return fallback(text), prediction[1] if prediction else None
+
+
+# Singleton instance
+intent_classifier = IntentClassifier()
@@ -0,0 +1,115 @@
+"""
+Keyword Matcher - vocabulários de intent e complexidade em uma única passada
+"""
+
+import re
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Vocabulários por categoria (termos sem acento também casam: "preco" == "preço")
+KEYWORD_VOCABULARIES: Dict[str, FrozenSet[str]] = {
+    # Complexidade (ComplexityAnalyzer)
+    "technical": frozenset({
+        "api", "integração", "erro", "bug", "debug", "código", "programação",
+        "database", "servidor", "configuração", "instalação", "atualização",
+        "ssl", "certificado", "autenticação", "token", "webhook"
+    }),
+    "business": frozenset({
+        "roi", "investimento", "orçamento", "proposta", "contrato", "negociação",
+        "desconto", "enterprise", "corporativo", "personalizado", "consultoria"
+    }),
+    "simple": frozenset({
+        "horário", "telefone", "endereço", "email", "contato", "localização",
+        "preço", "valor", "custo", "plano", "funciona", "aberto", "fechado"
+    }),
+
+    # Intents (AIRouter e AIService)
+    "greeting": frozenset({"oi", "olá", "bom dia", "boa tarde", "boa noite"}),
+    "smalltalk": frozenset({"tudo bem"}),
+    "contact_info": frozenset({"horário", "endereço", "telefone", "email"}),
+    "pricing": frozenset({"preço", "custo", "valor", "plano", "pacote", "quanto custa"}),
+    "price_question": frozenset({"quanto"}),
+    "enterprise": frozenset({"enterprise", "corporativo", "personalizado"}),
+    "support": frozenset({"erro", "problema", "bug", "não funciona", "travou"}),
+    "help": frozenset({"ajuda"}),
+    "purchase": frozenset({"comprar", "adquirir", "contratar", "assinar"}),
+    "order": frozenset({"pedido"}),
+    "team": frozenset({"empresa", "equipe", "usuários", "licenças"}),
+    "negotiation": frozenset({"desconto", "negociar", "proposta", "orçamento"}),
+    "cancellation": frozenset({"cancelar", "desistir", "parar"}),
+}
+
+
+def _accent_table() -> Dict[int, str]:
+    """Tabela para str.translate: letras acentuadas (Latin-1 e Latin Extended-A) sem acento"""
+    table = {}
+    for code in range(0x00C0, 0x0180):
+        char = chr(code)
+        base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+        if base and base != char:
+            table[code] = base
+    return table
+
+
+ACCENT_TABLE = _accent_table()
+
+
+def normalize(text: str) -> str:
+    """Minúsculas e sem acentos"""
+    return text.lower().translate(ACCENT_TABLE)
+
+
+class KeywordMatcher:
+    """
+    Todas as categorias de palavras-chave em um regex de alternância.
+
+    Os termos casam como palavras inteiras (com plural opcional "s"/"es"),
+    sem diferenciar acentos. Um termo que contém outro ("não funciona" e
+    "funciona") carrega as categorias dos dois, então uma única passada
+    sem sobreposição retorna todas as categorias presentes no texto.
+    """
+
+    def __init__(self, vocabularies: Dict[str, Iterable[str]]):
+        self._categories: Dict[str, FrozenSet[str]] = {}
+
+        terms: Dict[str, set] = {}
+        for category, words in vocabularies.items():
+            for word in words:
+                terms.setdefault(normalize(word).strip(), set()).add(category)
+
+        # Termos contidos (como palavras inteiras) em outros termos
+        for term in terms:
+            padded = f" {term} "
+            categories = set()
+            for other, other_categories in terms.items():
+                if f" {other} " in padded:
+                    categories |= other_categories
+            self._categories[term] = frozenset(categories)
+
+        # Mais longos primeiro: a alternância do regex pega o primeiro que casar
+        alternation = "|".join(
+            r"\s+".join(re.escape(part) for part in term.split())
+            for term in sorted(terms, key=len, reverse=True)
+        )
+        self._pattern = re.compile(rf"\b({alternation})(?:e?s)?\b")
+
+    def scan(self, text: str) -> FrozenSet[str]:
+        """Categorias com pelo menos um termo no texto"""
+        if not text:
+            return frozenset()
+
+        hits = set()
+        for match in self._pattern.finditer(normalize(text)):
+            hits |= self._categories[" ".join(match.group(1).split())]
+        return frozenset(hits)
+
+    def terms(self, text: str) -> List[str]:
+        """Termos encontrados, na ordem do texto (debug)"""
+        return [" ".join(m.group(1).split()) for m in self._pattern.finditer(normalize(text or ""))]
+
+
+# Singleton instance (compilado uma vez por processo)
+keyword_matcher = KeywordMatcher(KEYWORD_VOCABULARIES)
@@ -0,0 +1,226 @@
+"""
+Knowledge Prefetch - conhecimento provável da conversa carregado antes da mensagem chegar
+"""
+
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, FrozenSet, Set
+import logging
+
+from app.core.config import settings
+from app.services.cache_service import cache_service
+from app.services.keyword_matcher import normalize
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w{3,}")
+
+# Palavras frequentes que não ajudam a ranquear trechos
+STOPWORDS = frozenset({
+    "que", "para", "com", "uma", "por", "mais", "como", "mas", "foi", "ele", "ela",
+    "isso", "esse", "essa", "este", "esta", "tem", "ter", "sao", "nao", "sim", "meu",
+    "minha", "seu", "sua", "voce", "voces", "qual", "quais", "quando", "onde", "pode",
+    "posso", "sobre", "dos", "das", "nos", "nas", "aos", "pelo", "pela", "muito", "bem",
+    "ola", "boa", "bom", "dia", "tarde", "noite", "obrigado", "obrigada", "queria", "gostaria"
+})
+
+
+def terms(text: str) -> FrozenSet[str]:
+    """Termos normalizados (sem acento, 3+ letras, sem stopwords)"""
+    return frozenset(w for w in WORD_RE.findall(normalize(text or "")) if w not in STOPWORDS)
+
+
+class ConversationKnowledge:
+    """Chunks carregados para uma conversa (com os termos já extraídos)"""
+
+    def __init__(self, knowledge_base_id: str, ttl: float):
+        self.knowledge_base_id = knowledge_base_id
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+        self.chunks: Dict[Any, Dict[str, Any]] = {}
+        self.chunk_terms: Dict[Any, FrozenSet[str]] = {}
+        self.last_intent: Optional[str] = None
+
+    def add(self, chunks: List[Dict[str, Any]]):
+        for chunk in chunks:
+            self.chunks[chunk["id"]] = chunk
+            self.chunk_terms[chunk["id"]] = terms(f"{chunk.get('title', '')} {chunk.get('content', '')}")
+        self.expires_at = time.monotonic() + self.ttl
+
+
+class KnowledgePrefetcher:
+    """
+    Cache em processo, por conversa, de chunks da base de conhecimento.
+
+    Na abertura da conversa e em eventos de "digitando", carrega os chunks
+    mais retornados da base (no geral e para o intent anterior da conversa)
+    por ID, sem gerar embedding. Na resposta, lookup() ranqueia os chunks em
+    memória pela cobertura lexical dos termos da mensagem; se nenhum cobre o
+    suficiente, o chamador faz a busca vetorial normal e os resultados
+    entram no cache da conversa. Eventos e resposta precisam cair no mesmo
+    processo (afinidade por conversa) para aproveitar o cache.
+    """
+
+    def __init__(self):
+        self.enabled = settings.KNOWLEDGE_PREFETCH_ENABLED
+        self.top_k = settings.KNOWLEDGE_PREFETCH_TOP_K
+        self.ttl = settings.KNOWLEDGE_PREFETCH_TTL
+        self.max_conversations = settings.KNOWLEDGE_PREFETCH_MAX_CONVERSATIONS
+        self.min_score = settings.KNOWLEDGE_PREFETCH_MIN_SCORE
+        self._conversations: "OrderedDict[str, ConversationKnowledge]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._knowledge_service = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def knowledge_service(self):
+        if self._knowledge_service is None:
+            from app.services.knowledge_service import KnowledgeService
+            self._knowledge_service = KnowledgeService()
+        return self._knowledge_service
+
+    def _entry(self, conversation_id: str, knowledge_base_id: str, create: bool = False) -> Optional[ConversationKnowledge]:
+        entry = self._conversations.get(conversation_id)
+        if entry is not None and (entry.expires_at < time.monotonic() or entry.knowledge_base_id != knowledge_base_id):
+            del self._conversations[conversation_id]
+            entry = None
+
+        if entry is None and create:
+            entry = ConversationKnowledge(knowledge_base_id, self.ttl)
+            self._conversations[conversation_id] = entry
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+        if entry is not None:
+            self._conversations.move_to_end(conversation_id)
+        return entry
+
+    # Prefetch
+
+    def schedule(
+        self,
+        conversation_id: Optional[str],
+        organization_id: Optional[str],
+        knowledge_base_id: Optional[str],
+        intent: Optional[str] = None
+    ) -> bool:
+        """Dispara o prefetch em background (um por conversa de cada vez)"""
+        if not (self.enabled and conversation_id and organization_id and knowledge_base_id):
+            return False
+        if conversation_id in self._inflight:
+            return False
+
+        task = asyncio.create_task(self.prefetch(conversation_id, organization_id, knowledge_base_id, intent))
+        self._inflight[conversation_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(conversation_id, None))
+        return True
+
+    async def prefetch(
+        self,
+        conversation_id: str,
+        organization_id: str,
+        knowledge_base_id: str,
+        intent: Optional[str] = None
+    ) -> int:
+        """Carrega os chunks mais retornados da base e do intent anterior; retorna quantos são novos"""
+        try:
+            entry = self._entry(conversation_id, knowledge_base_id)
+            intent = intent or (entry.last_intent if entry else None)
+
+            lookups = [cache_service.get_top_knowledge_chunks(organization_id, knowledge_base_id, limit=self.top_k)]
+            if intent:
+                lookups.append(cache_service.get_top_knowledge_chunks(
+                    organization_id, knowledge_base_id, intent=intent, limit=self.top_k
+                ))
+
+            # Intent primeiro: são os trechos mais prováveis para o próximo turno
+            chunk_ids = list(dict.fromkeys(
+                chunk_id for ids in reversed(await asyncio.gather(*lookups)) for chunk_id in ids
+            ))
+            loaded = set(entry.chunks) if entry else set()
+            missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in loaded]
+
+            chunks = await self.knowledge_service.get_chunks(missing, knowledge_base_id, organization_id)
+            if chunks:
+                self._entry(conversation_id, knowledge_base_id, create=True).add(chunks)
+            return len(chunks)
+
+        except Exception as e:
+            logger.warning(f"Knowledge prefetch failed for conversation {conversation_id}: {e}")
+            return 0
+
+    # Resposta
+
+    def lookup(
+        self,
+        conversation_id: Optional[str],
+        knowledge_base_id: str,
+        query: str,
+        limit: int = 5
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Chunks em memória que cobrem a mensagem (None: buscar na base)"""
+        entry = self._entry(conversation_id, knowledge_base_id) if conversation_id and self.enabled else None
+        query_terms = terms(query)
+        if entry is None or not entry.chunks or not query_terms:
+            self.misses += 1
+            return None
+
+        scored = []
+        for chunk_id, chunk_terms in entry.chunk_terms.items():
+            score = len(query_terms & chunk_terms) / len(query_terms)
+            if score >= self.min_score:
+                scored.append((score, chunk_id))
+
+        if not scored:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [{**entry.chunks[chunk_id], "score": score} for score, chunk_id in scored[:limit]]
+
+    def remember(
+        self,
+        conversation_id: Optional[str],
+        organization_id: str,
+        knowledge_base_id: str,
+        results: List[Dict[str, Any]],
+        intent: Optional[str] = None
+    ):
+        """Guarda o resultado de uma busca na conversa e conta os chunks retornados (em background)"""
+        if not self.enabled:
+            return
+
+        if conversation_id:
+            entry = self._entry(conversation_id, knowledge_base_id, create=True)
+            entry.add(results)
+            entry.last_intent = intent or entry.last_intent
+
+        if results:
+            task = asyncio.create_task(cache_service.record_knowledge_hits(
+                organization_id, knowledge_base_id, [result["id"] for result in results], intent
+            ))
+            # Referência forte até terminar (o loop só guarda referências fracas)
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def forget(self, conversation_id: str):
+        """Conversa encerrada"""
+        self._conversations.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "conversations": len(self._conversations),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+# Singleton instance
+knowledge_prefetcher = KnowledgePrefetcher()
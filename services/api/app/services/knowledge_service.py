@@ -57,26 +57,49 @@ class KnowledgeService:
     async def generate_embedding(self, text: str) -> List[float]:
         """Gera embedding usando LiteLLM com modelo de embedding"""
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.litellm_url}/embeddings",
-                headers={
-                    "Authorization": f"Bearer {self.litellm_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "input": text,
-                    "model": settings.KNOWLEDGE_EMBEDDING_MODEL
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data["data"][0]["embedding"]
-            else:
-                # Fallback para embedding local se LiteLLM falhar
-                logger.warning(f"LiteLLM embedding failed, using fallback")
-                return self._generate_fallback_embedding(text)
+        embeddings = await self.generate_embeddings([text])
+        return embeddings[0]
+    
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Gera embeddings em lote via LiteLLM.
+        
+        O gateway agrupa e cacheia por hash de conteúdo: reprocessar um documento
+        com poucos chunks alterados quase não gera chamadas ao provider.
+        """
+        
+        embeddings: List[List[float]] = []
+        batch_size = settings.KNOWLEDGE_EMBEDDING_BATCH_SIZE
+        
+        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0)) as client:
+            for start in range(0, len(texts), batch_size):
+                batch = texts[start:start + batch_size]
+                
+                try:
+                    response = await client.post(
+                        f"{self.litellm_url}/embeddings",
+                        headers={
+                            "Authorization": f"Bearer {self.litellm_key}",
+                            "Content-Type": "application/json"
+                        },
+                        json={
+                            "input": batch,
+                            "model": settings.KNOWLEDGE_EMBEDDING_MODEL
+                        }
+                    )
+                except httpx.HTTPError as e:
+                    logger.warning(f"LiteLLM embedding request failed: {e}")
+                    response = None
+                
+                if response is not None and response.status_code == 200:
+                    data = sorted(response.json()["data"], key=lambda item: item["index"])
+                    embeddings.extend(item["embedding"] for item in data)
+                else:
+                    # Fallback para embedding local se LiteLLM falhar
+                    logger.warning(f"LiteLLM embedding failed, using fallback")
+                    embeddings.extend(self._generate_fallback_embedding(text) for text in batch)
+        
+        return embeddings
     
     def _generate_fallback_embedding(self, text: str) -> List[float]:
         """Gera embedding simples como fallback"""
@@ -119,11 +142,13 @@ class KnowledgeService:
         points = []
         errors = []
         
-        for i, doc in enumerate(documents):
+        # Gerar embeddings de todos os documentos em lote (sem conteúdo vira erro abaixo)
+        contents = [doc.get("content") for doc in documents]
+        vectors = iter(await self.generate_embeddings([c for c in contents if c]))
+        embeddings = [next(vectors) if c else None for c in contents]
+        
+        for i, (doc, embedding) in enumerate(zip(documents, embeddings)):
             try:
-                # Gerar embedding
-                embedding = await self.generate_embedding(doc["content"])
-                
                 # Criar ponto para Qdrant
                 point = models.PointStruct(
                     id=doc.get("id", i),
@@ -182,8 +207,9 @@ class KnowledgeService:
             # Gerar embedding da query
             query_embedding = await self.generate_embedding(query)
             
-            # Buscar no Qdrant
-            search_result = self.qdrant.search(
+            # Buscar no Qdrant (cliente síncrono: em thread para não bloquear o event loop)
+            search_result = await asyncio.to_thread(
+                self.qdrant.search,
                 collection_name=collection_name,
                 query_vector=query_embedding,
                 limit=limit,
@@ -207,6 +233,42 @@ class KnowledgeService:
             logger.error(f"Error searching knowledge base: {e}")
             return []
     
+    async def get_chunks(
+        self,
+        chunk_ids: List[Any],
+        knowledge_base_id: str,
+        organization_id: str
+    ) -> List[Dict[str, Any]]:
+        """Chunks por ID, no formato de search_knowledge (sem score)"""
+        
+        if not chunk_ids:
+            return []
+        
+        collection_name = f"org_{organization_id}_kb_{knowledge_base_id}"
+        
+        try:
+            points = await asyncio.to_thread(
+                self.qdrant.retrieve,
+                collection_name=collection_name,
+                ids=chunk_ids,
+                with_payload=True
+            )
+            
+            return [
+                {
+                    "id": point.id,
+                    "score": None,
+                    "content": point.payload.get("content", ""),
+                    "title": point.payload.get("title", ""),
+                    "metadata": point.payload.get("metadata", {})
+                }
+                for point in points
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error retrieving knowledge chunks: {e}")
+            return []
+    
     async def enhance_prompt_with_knowledge(
         self,
         prompt: str,
@@ -0,0 +1,280 @@
+"""
+Quick Responder - respostas determinísticas para turnos triviais (sem LLM)
+"""
+
+import asyncio
+import re
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet, Set, Mapping
+import logging
+
+from app.core.config import settings
+from app.services.cache_service import cache_service
+from app.services.intent_classifier import intent_classifier
+from app.services.keyword_matcher import normalize
+from app.services.knowledge_prefetch import STOPWORDS, terms
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+
+# Limites do que fica em memória por processo
+MAX_KNOWLEDGE_BASES = 1000
+MAX_AGENTS = 2000
+
+
+def _normalized(words) -> FrozenSet[str]:
+    return frozenset(normalize(word) for word in words)
+
+
+# Mensagem só de cumprimento ("oi", "bom dia, tudo bem?"): precisa de um termo de GREETING_CORE
+GREETING_WORDS = _normalized({
+    "oi", "oie", "olá", "opa", "eai", "alô", "salve", "hello", "hi", "hey", "bom", "boa", "dia",
+    "tarde", "noite", "tudo", "bem", "td", "blz", "beleza", "como", "vai", "você", "vc", "pessoal", "e", "aí"
+})
+GREETING_CORE = _normalized({"oi", "oie", "olá", "opa", "eai", "alô", "salve", "hello", "hi", "hey", "dia", "tarde", "noite"})
+
+# Palavras de um template sem lista própria de palavras-chave
+DEFAULT_TOPIC_KEYWORDS: Dict[str, FrozenSet[str]] = {
+    "business_hours": _normalized({
+        "horário", "horários", "horas", "funcionamento", "expediente", "abre", "abrem", "aberto",
+        "aberta", "fecha", "fecham", "fechado", "fechada"
+    }),
+    "address": _normalized({"endereço", "localização", "local", "fica", "ficam", "localizados", "localizada", "mapa"}),
+    "phone": _normalized({"telefone", "fone", "whatsapp", "número", "ligar", "celular"}),
+    "email": _normalized({"email", "mail"}),
+    "thanks": _normalized({"obrigado", "obrigada", "valeu", "agradeço", "grato", "grata"}),
+}
+
+# Palavras que não mudam o assunto da pergunta (contam a favor da cobertura)
+FILLER_WORDS = STOPWORDS | _normalized({"vocês", "vcs", "hoje", "amanhã", "ainda", "agora", "favor", "informar", "saber"})
+
+
+@dataclass(frozen=True)
+class QuickReply:
+    content: str
+    source: str
+    intent: str
+    confidence: float
+
+    def describe(self) -> Dict[str, Any]:
+        return {"source": self.source, "intent": self.intent, "confidence": round(self.confidence, 3)}
+
+
+@dataclass(frozen=True)
+class Template:
+    intent: str
+    content: str
+    keywords: FrozenSet[str]
+
+
+class QAIndex:
+    """Pares pergunta/resposta de uma base com índice invertido pelos termos da pergunta"""
+
+    def __init__(self, pairs: List[Dict[str, Any]]):
+        self.answers: List[str] = []
+        self.question_terms: List[FrozenSet[str]] = []
+        self.postings: Dict[str, List[int]] = {}
+
+        for pair in pairs:
+            question_terms = terms(pair.get("question", ""))
+            answer = (pair.get("answer") or "").strip()
+            if not question_terms or not answer:
+                continue
+            index = len(self.answers)
+            self.answers.append(answer)
+            self.question_terms.append(question_terms)
+            for term in question_terms:
+                self.postings.setdefault(term, []).append(index)
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def best(self, message_terms: FrozenSet[str]) -> Tuple[float, Optional[str]]:
+        """Maior sobreposição (termos comuns / termos do maior dos dois) entre a mensagem e as perguntas"""
+        candidates: Set[int] = set()
+        for term in message_terms:
+            candidates.update(self.postings.get(term, ()))
+
+        best_score, best_answer = 0.0, None
+        for index in candidates:
+            question_terms = self.question_terms[index]
+            score = len(message_terms & question_terms) / max(len(message_terms), len(question_terms))
+            if score > best_score:
+                best_score, best_answer = score, self.answers[index]
+        return best_score, best_answer
+
+
+class QuickResponder:
+    """
+    Etapa antes do LLM para turnos triviais, com opt-in por agente
+    (quick_replies_enabled nas opções do agente).
+
+    Responde, nesta ordem: mensagem só de cumprimento (template "greeting"
+    ou greeting_message do agente); templates do agente
+    (quick_reply_templates: intent -> texto ou {"text", "keywords"}) quando o
+    classificador de intent ou a cobertura lexical da mensagem passa do
+    limiar; pares Q/A extraídos da base de conhecimento (extract_qa_pairs).
+    answer() não faz I/O: os Q/A de cada base ficam em memória e são
+    recarregados do Redis em background.
+    """
+
+    def __init__(self):
+        self.min_confidence = settings.QUICK_REPLY_MIN_CONFIDENCE
+        self.min_qa_score = settings.QUICK_REPLY_MIN_QA_SCORE
+        self.max_words = settings.QUICK_REPLY_MAX_WORDS
+        self.qa_ttl = settings.QUICK_REPLY_QA_TTL
+        self._templates: Dict[Tuple[str, Any], Tuple[Template, ...]] = {}
+        self._qa: "OrderedDict[Tuple[str, str], Tuple[float, QAIndex]]" = OrderedDict()
+        self._refreshing: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.llm_calls_avoided: Counter = Counter()
+
+    # Resposta
+
+    def answer(
+        self,
+        message: str,
+        agent_config: Mapping[str, Any],
+        user_context: Mapping[str, Any]
+    ) -> Optional[QuickReply]:
+        """Resposta determinística para a mensagem, ou None (segue para o LLM)"""
+        if not agent_config.get("quick_replies_enabled"):
+            return None
+
+        words = WORD_RE.findall(normalize(message or ""))
+        if not words or len(words) > agent_config.get("quick_reply_max_words", self.max_words):
+            return None
+        word_set = frozenset(words)
+        templates = self._agent_templates(agent_config)
+
+        if word_set <= GREETING_WORDS and word_set & GREETING_CORE:
+            greeting = next((t.content for t in templates if t.intent == "greeting"), None)
+            greeting = greeting or agent_config.get("greeting_message")
+            if greeting:
+                return QuickReply(greeting, "greeting", "greeting", 1.0)
+
+        min_confidence = agent_config.get("quick_reply_min_confidence", self.min_confidence)
+        if templates:
+            reply = self._match_template(message, words, templates, min_confidence)
+            if reply is not None:
+                return reply
+
+        knowledge_base_id = agent_config.get("knowledge_base_id")
+        organization_id = user_context.get("organization_id")
+        if knowledge_base_id and organization_id:
+            index = self._qa_index(organization_id, knowledge_base_id)
+            message_terms = terms(message)
+            if index is not None and message_terms:
+                score, answer = index.best(message_terms)
+                if answer and score >= agent_config.get("quick_reply_min_qa_score", self.min_qa_score):
+                    return QuickReply(answer, "qa", "faq", score)
+
+        return None
+
+    def _match_template(
+        self,
+        message: str,
+        words: List[str],
+        templates: Tuple[Template, ...],
+        min_confidence: float
+    ) -> Optional[QuickReply]:
+        # Classificador: vale se o intent previsto tem template
+        prediction = intent_classifier.predict(message)
+        if prediction is not None and prediction[1] >= min_confidence:
+            for template in templates:
+                if template.intent == prediction[0]:
+                    return QuickReply(template.content, "template", template.intent, prediction[1])
+
+        # Cobertura: palavras do assunto + palavras neutras / palavras da mensagem (curtas são neutras)
+        best = None
+        for template in templates:
+            if not template.keywords:
+                continue
+            topic = sum(1 for word in words if word in template.keywords)
+            if not topic:
+                continue
+            neutral = sum(1 for word in words if word not in template.keywords and (len(word) < 3 or word in FILLER_WORDS))
+            confidence = (topic + neutral) / len(words)
+            if confidence >= min_confidence and (best is None or confidence > best.confidence):
+                best = QuickReply(template.content, "template", template.intent, confidence)
+        return best
+
+    def _agent_templates(self, agent_config: Mapping[str, Any]) -> Tuple[Template, ...]:
+        """Templates do agente já normalizados (por versão da configuração; sem updated_at, a cada turno)"""
+        key = (str(agent_config.get("id")), agent_config.get("updated_at"))
+        templates = self._templates.get(key) if key[1] else None
+        if templates is not None:
+            return templates
+
+        compiled = []
+        for intent, value in (agent_config.get("quick_reply_templates") or {}).items():
+            if isinstance(value, Mapping):
+                content, keywords = value.get("text"), value.get("keywords")
+            else:
+                content, keywords = value, None
+            if not content:
+                continue
+            keywords = _normalized(keywords) if keywords else DEFAULT_TOPIC_KEYWORDS.get(intent, frozenset())
+            compiled.append(Template(intent, content, keywords))
+
+        templates = tuple(compiled)
+        if key[1]:
+            if len(self._templates) >= MAX_AGENTS:
+                self._templates.clear()
+            self._templates[key] = templates
+        return templates
+
+    # Q/A da base de conhecimento
+
+    def _qa_index(self, organization_id: str, knowledge_base_id: str) -> Optional[QAIndex]:
+        """Índice em memória; ausente ou vencido, recarrega em background (esta mensagem segue sem)"""
+        key = (str(organization_id), str(knowledge_base_id))
+        entry = self._qa.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._schedule_refresh(key)
+        if entry is None:
+            return None
+        self._qa.move_to_end(key)
+        return entry[1]
+
+    def _schedule_refresh(self, key: Tuple[str, str]):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: Tuple[str, str]):
+        try:
+            pairs = await cache_service.get_knowledge_qa_pairs(*key)
+            self._qa[key] = (time.monotonic() + self.qa_ttl, QAIndex(pairs))
+            self._qa.move_to_end(key)
+            while len(self._qa) > MAX_KNOWLEDGE_BASES:
+                self._qa.popitem(last=False)
+        except Exception as e:
+            logger.warning(f"Error loading Q/A pairs for knowledge base {key[1]}: {e}")
+
+    # Contador
+
+    def count_avoided(self, organization_id: Optional[str], source: str):
+        """Turno respondido sem LLM (em processo e, por organização/dia, no Redis)"""
+        self.llm_calls_avoided[source] += 1
+        if not organization_id:
+            return
+        task = asyncio.create_task(cache_service.increment_llm_calls_avoided(organization_id, source))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "llm_calls_avoided": sum(self.llm_calls_avoided.values()),
+            "by_source": dict(self.llm_calls_avoided),
+            "knowledge_bases": len(self._qa)
+        }
+
+
+# Singleton instance
+quick_responder = QuickResponder()
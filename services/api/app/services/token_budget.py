@@ -0,0 +1,250 @@
+"""
+Token Budget - contagem de tokens e montagem de prompt por orçamento
+A contagem de tokens é a mesma do gateway (cópia canônica em services/litellm/token_budget.py)
+"""
+
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Contagem de tokens (início) ---
+# Cópia canônica em services/litellm/token_budget.py; services/api/app/services/token_budget.py
+# repete este bloco sem alteração (scripts/check_token_budget_sync.py confere).
+
+# Overhead de formatação por mensagem (role, separadores) e para o "priming" da resposta
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Encoding tiktoken usado por família (None = só heurística)
+FAMILY_ENCODINGS = {
+    "openai": "cl100k_base",
+    "openai-o200k": "o200k_base",
+    "anthropic": "cl100k_base",
+    "gemini": "cl100k_base",
+    "llama": "cl100k_base",
+    "default": "cl100k_base",
+}
+
+# Correção aproximada do cl100k para famílias sem tokenizer público
+FAMILY_RATIOS = {
+    "openai": 1.0,
+    "openai-o200k": 1.0,
+    "anthropic": 1.1,
+    "gemini": 0.95,
+    "llama": 1.05,
+    "default": 1.0,
+}
+
+# Heurística rápida (caracteres por token) quando tiktoken não está disponível
+CHARS_PER_TOKEN = 3.6
+
+
+def model_family(model: Optional[str]) -> str:
+    """Resolve a família de tokenizer a partir do nome do modelo/deployment"""
+    if not model:
+        return "default"
+
+    name = model.lower()
+
+    if "gpt-4o" in name or name.split("/")[-1].startswith("o1"):
+        return "openai-o200k"
+    if "gpt" in name or "text-embedding" in name:
+        return "openai"
+    if "claude" in name or "anthropic" in name:
+        return "anthropic"
+    if "gemini" in name:
+        return "gemini"
+    if "llama" in name:
+        return "llama"
+    return "default"
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(encoding_name: str):
+    """Carrega encoding tiktoken uma única vez por processo"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Tokenizer {encoding_name} indisponível, usando heurística: {e}")
+        return None
+
+
+@lru_cache(maxsize=8192)
+def _count_tokens(family: str, text: str, heuristic_only: bool) -> int:
+    # Histórico é recontado a cada turno; o cache evita re-tokenizar as mesmas mensagens
+    encoding = None if heuristic_only else _load_encoding(
+        FAMILY_ENCODINGS.get(family, FAMILY_ENCODINGS["default"])
+    )
+
+    if encoding is None:
+        return max(1, int(len(text) / CHARS_PER_TOKEN + 0.5))
+
+    tokens = len(encoding.encode(text, disallowed_special=()))
+    return int(tokens * FAMILY_RATIOS.get(family, 1.0) + 0.5)
+
+
+class TokenizerService:
+    """Contador de tokens com tokenizers lazy por família e fallback heurístico"""
+
+    def __init__(self, use_heuristic_only: bool = False):
+        self.use_heuristic_only = use_heuristic_only
+
+    def count_text(self, text: str, model: Optional[str] = None) -> int:
+        """Conta tokens de um texto para o modelo informado"""
+        if not text:
+            return 0
+        return _count_tokens(model_family(model), text, self.use_heuristic_only)
+
+    def count_message(self, message: Dict[str, Any], model: Optional[str] = None) -> int:
+        """Conta tokens de uma mensagem incluindo overhead de formatação"""
+        content = message.get("content") or ""
+
+        # Conteúdo multimodal / blocos (ex: cache_control da Anthropic)
+        if isinstance(content, list):
+            content = "".join(
+                part.get("text", "") for part in content if isinstance(part, dict)
+            )
+
+        return TOKENS_PER_MESSAGE + self.count_text(content, model)
+
+    def count_messages(self, messages: List[Dict[str, Any]], model: Optional[str] = None) -> int:
+        """Conta tokens de uma lista de mensagens no formato chat"""
+        if not messages:
+            return 0
+        return sum(self.count_message(m, model) for m in messages) + TOKENS_PER_REPLY
+
+# --- Contagem de tokens (fim) ---
+
+
+# Janela assumida para tier desconhecido ou sem o config do LiteLLM (a menor entre os deployments)
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Fração do orçamento de entrada reservada para contexto de conhecimento
+KNOWLEDGE_BUDGET_SHARE = 0.3
+
+
+@lru_cache(maxsize=None)
+def load_tier_context_windows(config_path: str) -> Dict[str, int]:
+    """
+    Menor context_window entre os deployments de cada tier no config do
+    LiteLLM (fallbacks ficam no mesmo tier); vazio se o arquivo não abre.
+    """
+    try:
+        import yaml
+        with open(config_path) as f:
+            config = yaml.safe_load(f) or {}
+    except Exception as e:
+        logger.warning(f"Config do LiteLLM indisponível ({config_path}), janela de {DEFAULT_CONTEXT_WINDOW} tokens: {e}")
+        return {}
+
+    windows: Dict[str, int] = {}
+    for entry in config.get("model_list") or []:
+        info = entry.get("model_info") or {}
+        if info.get("mode") == "embedding" or not info.get("tier") or not info.get("context_window"):
+            continue
+        tier = f"tier{info['tier']}"
+        windows[tier] = min(windows.get(tier, info["context_window"]), info["context_window"])
+    return windows
+
+
+class PromptBudgeter:
+    """Empacota system prompt, conhecimento e histórico dentro da janela do tier"""
+
+    def __init__(self, tokenizer: Optional[TokenizerService] = None, config_path: Optional[str] = None):
+        self.tokenizer = tokenizer or token_counter
+        self.config_path = config_path or settings.LITELLM_CONFIG_PATH
+
+    def context_window(self, tier: Optional[str]) -> int:
+        """Janela do tier (a menor conhecida se o tier é desconhecido)"""
+        windows = load_tier_context_windows(self.config_path)
+        if tier in windows:
+            return windows[tier]
+        return min(windows.values(), default=DEFAULT_CONTEXT_WINDOW)
+
+    def input_budget(
+        self,
+        tier: Optional[str],
+        max_output_tokens: int,
+        max_prompt_tokens: Optional[int] = None
+    ) -> int:
+        """Orçamento de tokens de entrada para o tier (ou o menor tier se desconhecido)"""
+        budget = self.context_window(tier) - max_output_tokens - TOKENS_PER_REPLY
+        if max_prompt_tokens:
+            budget = min(budget, max_prompt_tokens)
+        return max(budget, 0)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Trunca texto para no máximo max_tokens (aproximado por proporção)"""
+        tokens = self.tokenizer.count_text(text)
+        if tokens <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+        return text[:int(len(text) * max_tokens / tokens)]
+
+    def pack_knowledge(
+        self,
+        snippets: List[str],
+        budget: int,
+        max_items: int = 5
+    ) -> List[str]:
+        """Seleciona snippets (em ordem de relevância) que cabem no orçamento"""
+        packed = []
+        used = 0
+
+        for snippet in snippets:
+            if len(packed) >= max_items:
+                break
+
+            tokens = self.tokenizer.count_text(snippet)
+            if used + tokens <= budget:
+                packed.append(snippet)
+                used += tokens
+            elif not packed and budget > 50:
+                # Snippet mais relevante não cabe inteiro: truncar em vez de descartar
+                packed.append(self._truncate(snippet, budget) + "...")
+                used = budget
+
+        return packed
+
+    def pack_history(
+        self,
+        history: List[Dict[str, Any]],
+        budget: int,
+        max_messages: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Mantém as mensagens mais recentes que cabem no orçamento.
+
+        max_tokens limita o histórico independente da janela do tier (janelas
+        de 128k+ não significam mandar 128k de histórico a cada turno).
+        Retorna (mensagens mantidas, tokens usados).
+        """
+        kept = []
+        used = 0
+
+        if max_tokens is not None:
+            budget = min(budget, max_tokens)
+
+        candidates = history[-max_messages:] if max_messages else history
+
+        for msg in reversed(candidates):
+            tokens = self.tokenizer.count_message(msg)
+            if used + tokens > budget:
+                break
+            kept.append(msg)
+            used += tokens
+
+        kept.reverse()
+        return kept, used
+
+
+# Singletons
+token_counter = TokenizerService()
+prompt_budgeter = PromptBudgeter(token_counter)
@@ -0,0 +1,91 @@
+"""
+Turn Pipeline - preparação concorrente de um turno com prazos por etapa
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Callable, Awaitable, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TurnStage:
+    """
+    Etapa da preparação do turno.
+
+    run recebe os valores das etapas em after (na mesma ordem). deadline é
+    contado do início do turno, em segundos: uma etapa que depende de outra
+    fica só com o tempo que sobrou. Se estoura o prazo ou falha, vale default.
+    """
+    name: str
+    run: Callable[..., Awaitable[Any]]
+    default: Any = None
+    deadline: float = 0.25
+    after: Tuple[str, ...] = ()
+
+
+@dataclass
+class TurnPreparation:
+    """Resultados, tempos (ms) e etapas degradadas (etapa -> timeout/error)"""
+    results: Dict[str, Any] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    degraded: Dict[str, str] = field(default_factory=dict)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.results[name]
+
+
+class TurnPipeline:
+    """Executa as etapas em paralelo, respeitando dependências e prazos"""
+
+    def __init__(self, stages: List[TurnStage]):
+        names = {stage.name for stage in stages}
+        for stage in stages:
+            missing = set(stage.after) - names
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {sorted(missing)}")
+        self.stages = stages
+
+    async def run(self) -> TurnPreparation:
+        started = time.perf_counter()
+        preparation = TurnPreparation()
+        tasks: Dict[str, "asyncio.Task[Any]"] = {}
+
+        async def execute(stage: TurnStage) -> Any:
+            dependencies = [await tasks[name] for name in stage.after]
+            stage_started = time.perf_counter()
+            remaining = stage.deadline - (stage_started - started)
+
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                value = await asyncio.wait_for(stage.run(*dependencies), remaining)
+            except asyncio.TimeoutError:
+                logger.warning(f"Turn stage {stage.name} missed its {stage.deadline * 1000:.0f}ms deadline")
+                preparation.degraded[stage.name] = "timeout"
+                value = stage.default
+            except Exception as e:
+                logger.error(f"Turn stage {stage.name} failed: {e}")
+                preparation.degraded[stage.name] = "error"
+                value = stage.default
+
+            preparation.timings[stage.name] = round((time.perf_counter() - stage_started) * 1000, 2)
+            preparation.results[stage.name] = value
+            return value
+
+        # As tasks só começam no primeiro await: o dict já está completo quando as dependências são lidas
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.ensure_future(execute(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            # Turno cancelado (cliente desconectou): nenhuma etapa continua rodando
+            for task in tasks.values():
+                task.cancel()
+
+        preparation.timings["prepare"] = round((time.perf_counter() - started) * 1000, 2)
+        return preparation
@@ -63,6 +63,18 @@ celery_app.conf.update(
             "task": "app.workers.analytics_tasks.check_usage_limits",
             "schedule": 600.0,  # 10 minutos
             "options": {"queue": "analytics_tasks"}
+        },
+        "classify-message-intents": {
+            "task": "app.workers.ai_tasks.classify_message_intents",
+            "schedule": 900.0,  # 15 minutos
+            "options": {"queue": "ai_tasks"}
         }
+        # train_intent_classifier fica fora do beat até existir rótulo confirmado
+        # (Message.metadata["intent_source"]); sem ele o treino nunca publica modelo
     }
 )
+
+# Alterações em Agent feitas pelos workers invalidam o cache de configuração dos agentes
+from app.services.agent_config_cache import register_invalidation_hooks
+
+register_invalidation_hooks()
@@ -8,13 +8,18 @@ from datetime import datetime
 import json
 import asyncio
 
+import httpx
 from celery import shared_task
 from sqlalchemy.orm import Session
 
-from app.services.ai_service import AIService
+from app.services.ai_service import AIService, gateway_client
 from app.services.ai_router import AIRouter
 from app.services.cache_service import cache_service
+from app.services.conversation_summary import conversation_summarizer
 from app.services.knowledge_service import KnowledgeService
+from app.services.intent_classifier import (
+    intent_classifier, train_model as train_intent_model, CONFIRMED_INTENT_SOURCES
+)
 from app.database import get_db
 from app.models.conversation import Conversation, Message
 from app.models.agent import Agent
@@ -38,27 +43,39 @@ def process_conversation_batch(
             "analyses": []
         }
         
-        # Usar asyncio.run para chamar funções async
+        # Um batch de baixa prioridade no gateway em vez de uma chamada interativa por conversa
+        requests = [
+            {"custom_id": conv_id, **ai_service.conversation_analysis_request(conv_id, organization_id)}
+            for conv_id in conversation_ids
+        ]
+        
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
+        batch_results = loop.run_until_complete(
+            ai_service.batch_completion(
+                requests,
+                metadata={"organization_id": organization_id, "task": "conversation_analysis"}
+            )
+        )
+        
+        loop.run_until_complete(gateway_client.close())
+        loop.close()
+        
         for conv_id in conversation_ids:
-            try:
-                analysis = loop.run_until_complete(
-                    ai_service.analyze_conversation(
-                        conversation_id=conv_id,
-                        organization_id=organization_id
-                    )
-                )
-                
-                results["analyses"].append(analysis)
-                results["processed"] += 1
-                
-            except Exception as e:
-                logger.error(f"Error analyzing conversation {conv_id}: {e}")
+            analysis = AIService.batch_content(batch_results.get(conv_id))
+            if analysis is None:
+                logger.error(f"Error analyzing conversation {conv_id}: {(batch_results.get(conv_id) or {}).get('error', 'not processed')}")
                 results["failed"] += 1
+                continue
+            
+            results["analyses"].append({
+                "conversation_id": conv_id,
+                "analysis": analysis,
+                "timestamp": datetime.utcnow().isoformat()
+            })
+            results["processed"] += 1
         
-        loop.close()
         return results
         
     except Exception as e:
@@ -105,30 +122,36 @@ def generate_conversation_summary(
         {conversation_text[:3000]}  # Limitar tamanho
         """
         
-        # Executar async em sync context
+        # Executar async em sync context (batch de baixa prioridade: não disputa com o atendimento)
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        response = loop.run_until_complete(
-            ai_service.chat_completion(
-                messages=[
-                    {"role": "system", "content": "Você é um analista especializado em conversas de atendimento."},
-                    {"role": "user", "content": summary_prompt}
-                ],
+        batch_results = loop.run_until_complete(
+            ai_service.batch_completion(
+                [{
+                    "custom_id": conversation_id,
+                    "messages": [
+                        {"role": "system", "content": "Você é um analista especializado em conversas de atendimento."},
+                        {"role": "user", "content": summary_prompt}
+                    ],
+                    "metadata": {"conversation_id": conversation_id},
+                    "temperature": 0.3,
+                    "max_tokens": 500
+                }],
                 metadata={
                     "organization_id": organization_id,
-                    "task": "conversation_summary",
-                    "conversation_id": conversation_id
-                },
-                temperature=0.3,
-                max_tokens=500
+                    "task": "conversation_summary"
+                }
             )
         )
         
+        loop.run_until_complete(gateway_client.close())
         loop.close()
         
         # Extrair resposta
-        summary = response["choices"][0]["message"]["content"]
+        summary = AIService.batch_content(batch_results.get(conversation_id))
+        if summary is None:
+            raise RuntimeError(f"Summary failed: {(batch_results.get(conversation_id) or {}).get('error', 'not processed')}")
         
         # Salvar no banco
         conversation = db.query(Conversation).filter(
@@ -152,6 +175,53 @@ def generate_conversation_summary(
         raise self.retry(exc=e, countdown=60)
 
 
+@shared_task(bind=True, max_retries=2)
+def update_conversation_summary(
+    self,
+    conversation_id: str,
+    organization_id: str,
+    previous_summary: Optional[str],
+    turns: List[Dict[str, str]],
+    expected_covered: int,
+    covered: int,
+    anchor: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Incorpora turnos antigos ao resumo incremental da conversa (modelo tier 1)"""
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    try:
+        summary = loop.run_until_complete(
+            conversation_summarizer.update(
+                AIService(),
+                conversation_id=conversation_id,
+                organization_id=organization_id,
+                previous_summary=previous_summary,
+                turns=turns,
+                expected_covered=expected_covered,
+                covered=covered,
+                anchor=anchor
+            )
+        )
+        
+        return {
+            "conversation_id": conversation_id,
+            "updated": summary is not None,
+            "covered": covered
+        }
+        
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        raise self.retry(exc=e, countdown=30)
+        
+    finally:
+        # Conexão Redis do singleton pertence a este loop
+        loop.run_until_complete(cache_service.disconnect())
+        loop.run_until_complete(gateway_client.close())
+        loop.close()
+
+
 @shared_task(bind=True, max_retries=5)
 def process_streaming_response(
     self,
@@ -199,6 +269,7 @@ def process_streaming_response(
                 )
             )
             
+            loop.run_until_complete(gateway_client.close())
             loop.close()
             
             # Atualizar metadata da mensagem
@@ -219,72 +290,6 @@ def process_streaming_response(
         raise self.retry(exc=e, countdown=30)
 
 
-@shared_task(bind=True)
-def warm_up_models(
-    self,
-    organization_id: str,
-    models: Optional[List[str]] = None
-) -> Dict[str, Any]:
-    """Aquece modelos para reduzir latência inicial"""
-    
-    try:
-        ai_service = AIService()
-        
-        # Modelos padrão para aquecer
-        if not models:
-            models = [
-                "tier1/llama-3.2-3b",
-                "tier2/claude-haiku",
-                "tier3/claude-sonnet"
-            ]
-        
-        results = {}
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        for model in models:
-            try:
-                # Fazer chamada simples
-                start_time = datetime.utcnow()
-                
-                response = loop.run_until_complete(
-                    ai_service.chat_completion(
-                        messages=[
-                            {"role": "user", "content": "Hi"}
-                        ],
-                        metadata={
-                            "organization_id": organization_id,
-                            "task": "warm_up"
-                        },
-                        model=model,
-                        max_tokens=10
-                    )
-                )
-                
-                end_time = datetime.utcnow()
-                latency = (end_time - start_time).total_seconds()
-                
-                results[model] = {
-                    "status": "success",
-                    "latency": latency,
-                    "warmed_at": end_time.isoformat()
-                }
-                
-            except Exception as e:
-                results[model] = {
-                    "status": "error",
-                    "error": str(e)
-                }
-        
-        loop.close()
-        return results
-        
-    except Exception as e:
-        logger.error(f"Warm up task failed: {e}")
-        return {"error": str(e)}
-
-
 @shared_task(bind=True, max_retries=3)
 def optimize_prompt_with_ai(
     self,
@@ -339,6 +344,7 @@ def optimize_prompt_with_ai(
             )
         )
         
+        loop.run_until_complete(gateway_client.close())
         loop.close()
         
         optimization_result = response["choices"][0]["message"]["content"]
@@ -367,3 +373,160 @@ def optimize_prompt_with_ai(
     except Exception as e:
         logger.error(f"Prompt optimization failed: {e}")
         raise self.retry(exc=e, countdown=300)
+
+
+@shared_task(bind=True, max_retries=1)
+def train_intent_classifier(
+    self,
+    min_examples: int = 200,
+    max_examples: int = 200000,
+    min_accuracy: float = 0.7
+) -> Dict[str, Any]:
+    """Treina o classificador de intent com os rótulos confirmados e publica uma nova versão"""
+    
+    try:
+        if not intent_classifier.available:
+            return {"trained": False, "reason": "numpy not installed"}
+        
+        # Só rótulos confirmados (revisão humana ou resultado da conversa); regras e previsões ficam de fora
+        db = next(get_db())
+        rows = db.query(Message.content, Message.intent).filter(
+            Message.role == "user",
+            Message.intent.isnot(None),
+            Message.metadata["intent_source"].astext.in_(CONFIRMED_INTENT_SOURCES)
+        ).order_by(Message.created_at.desc()).limit(max_examples).all()
+        
+        if len(rows) < min_examples:
+            return {"trained": False, "reason": "not enough examples", "examples": len(rows)}
+        
+        model = train_intent_model([row.content for row in rows], [row.intent for row in rows])
+        accuracy = model.meta.get("holdout_accuracy")
+        if accuracy is not None and accuracy < min_accuracy:
+            logger.warning(f"Intent model rejected: holdout accuracy {accuracy:.3f} < {min_accuracy}")
+            return {"trained": False, "reason": "low accuracy", "holdout_accuracy": accuracy}
+        
+        version = intent_classifier.save(model)
+        logger.info(f"Intent model {version} published ({len(rows)} examples, accuracy {accuracy})")
+        
+        return {
+            "trained": True,
+            "version": version,
+            "examples": len(rows),
+            "labels": model.labels,
+            "holdout_accuracy": accuracy
+        }
+        
+    except Exception as e:
+        logger.error(f"Intent training failed: {e}")
+        raise self.retry(exc=e, countdown=600)
+
+
+@shared_task(bind=True, max_retries=3)
+def classify_message_intents(
+    self,
+    batch_size: int = 5000,
+    max_batches: int = 20
+) -> Dict[str, Any]:
+    """Classifica em lote as mensagens de usuário ainda sem intent"""
+    
+    try:
+        db = next(get_db())
+        results = {"classified": 0, "model": 0, "fallback": 0}
+        
+        for _ in range(max_batches):
+            rows = db.query(Message.id, Message.content).filter(
+                Message.role == "user",
+                Message.intent.is_(None)
+            ).order_by(Message.created_at).limit(batch_size).all()
+            
+            if not rows:
+                break
+            
+            predictions = intent_classifier.predict_batch([row.content for row in rows])
+            updates = []
+            for row, prediction in zip(rows, predictions):
+                if prediction and prediction[1] >= intent_classifier.min_confidence:
+                    intent = prediction[0]
+                    results["model"] += 1
+                else:
+                    intent = AIService._keyword_intent(row.content)
+                    results["fallback"] += 1
+                updates.append({
+                    "id": row.id,
+                    "intent": intent,
+                    # Confiança do modelo (0 sem modelo): marca a linha como prevista, fora do treino
+                    "confidence_score": prediction[1] if prediction else 0.0
+                })
+            
+            db.bulk_update_mappings(Message, updates)
+            db.commit()
+            results["classified"] += len(updates)
+        
+        model = intent_classifier.load()
+        results["model_version"] = model.version if model else None
+        return results
+        
+    except Exception as e:
+        logger.error(f"Intent classification failed: {e}")
+        raise self.retry(exc=e, countdown=60)
+
+
+@shared_task(bind=True, max_retries=3)
+def run_flow_action(
+    self,
+    kind: str,
+    node_id: str,
+    data: Dict[str, Any],
+    conversation_id: str,
+    organization_id: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    message: Optional[str] = None
+) -> Dict[str, Any]:
+    """Executa o nó api/integration de um fluxo do AgentStudio (chamada HTTP configurada no nó)"""
+    
+    # Nó api grava url/headers (JSON em texto); integration grava endpoint
+    url = data.get("url") or data.get("endpoint")
+    if not url:
+        logger.warning(f"Flow {kind} node {node_id} has no url, skipped")
+        return {"node_id": node_id, "executed": False, "reason": "missing url"}
+    
+    method = (data.get("method") or "GET").upper()
+    headers = data.get("headers") or {}
+    if isinstance(headers, str):
+        try:
+            headers = json.loads(headers or "{}")
+        except json.JSONDecodeError:
+            logger.warning(f"Flow {kind} node {node_id} has invalid headers JSON, ignored")
+            headers = {}
+    
+    context = {
+        "conversation_id": conversation_id,
+        "organization_id": organization_id,
+        "agent_id": agent_id,
+        "node_id": node_id,
+        "integration_type": data.get("integrationType"),
+        "message": message
+    }
+    
+    try:
+        with httpx.Client(timeout=30.0) as client:
+            if method in ("GET", "DELETE"):
+                params = {k: v for k, v in context.items() if v is not None}
+                response = client.request(method, url, headers=headers, params=params)
+            else:
+                response = client.request(method, url, headers=headers, json=context)
+        
+        # Erro do servidor vale nova tentativa; 4xx é configuração do nó
+        if response.status_code >= 500:
+            response.raise_for_status()
+        
+        return {
+            "node_id": node_id,
+            "executed": True,
+            "success": response.is_success,
+            "status_code": response.status_code
+        }
+        
+    except Exception as e:
+        logger.error(f"Flow {kind} node {node_id} failed: {e}")
+        raise self.retry(exc=e, countdown=30)
@@ -3,6 +3,7 @@ Tasks Celery para analytics e métricas
 """
 
 from typing import Dict, Any, List, Optional
+import asyncio
 import logging
 from datetime import datetime, timedelta
 import json
@@ -11,7 +12,7 @@ from celery import shared_task
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from app.services.ai_service import AIService
+from app.services.ai_service import AIService, gateway_client
 from app.services.cache_service import cache_service
 from app.database import get_db
 from app.models.conversation import Conversation, Message
@@ -21,6 +22,23 @@ from app.models.agent import Agent
 logger = logging.getLogger(__name__)
 
 
+async def _store_json(cache_key: str, ttl: int, value: Dict[str, Any]):
+    redis = await cache_service.get_redis()
+    await redis.setex(cache_key, ttl, json.dumps(value))
+
+
+async def _load_daily_metrics(organization_id: str, start_date, end_date) -> List[Dict[str, Any]]:
+    redis = await cache_service.get_redis()
+    metrics = []
+    current_date = start_date
+    while current_date <= end_date:
+        daily_metrics = await redis.get(f"daily_metrics:{organization_id}:{current_date.isoformat()}")
+        if daily_metrics:
+            metrics.append(json.loads(daily_metrics))
+        current_date += timedelta(days=1)
+    return metrics
+
+
 @shared_task(bind=True)
 def collect_daily_metrics(
     self,
@@ -145,12 +163,14 @@ def collect_daily_metrics(
         
         # Salvar no Redis para análise posterior
         cache_key = f"daily_metrics:{organization_id}:{target_date.isoformat()}"
-        await cache_service.get_redis()
-        await cache_service._redis.setex(
-            cache_key,
-            86400 * 90,  # 90 dias
-            json.dumps(metrics)
-        )
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(_store_json(cache_key, 86400 * 90, metrics))  # 90 dias
+        finally:
+            # Conexão Redis do singleton pertence a este loop
+            loop.run_until_complete(cache_service.disconnect())
+            loop.close()
         
         logger.info(f"Daily metrics collected for {organization_id} on {target_date}")
         return metrics
@@ -204,25 +224,17 @@ def analyze_organization_performance(
 ) -> Dict[str, Any]:
     """Análise detalhada de performance usando Jarvis AI"""
     
+    # Um event loop para a task inteira (cliente Redis e gateway ficam presos ao loop)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
     try:
         # Coletar métricas do período
         end_date = datetime.utcnow().date()
         start_date = end_date - timedelta(days=period_days)
         
-        metrics = []
-        current_date = start_date
-        
         # Buscar métricas diárias do cache
-        while current_date <= end_date:
-            cache_key = f"daily_metrics:{organization_id}:{current_date.isoformat()}"
-            
-            cached_metrics = await cache_service.get_redis()
-            daily_metrics = await cache_service._redis.get(cache_key)
-            
-            if daily_metrics:
-                metrics.append(json.loads(daily_metrics))
-            
-            current_date += timedelta(days=1)
+        metrics = loop.run_until_complete(_load_daily_metrics(organization_id, start_date, end_date))
         
         if not metrics:
             return {
@@ -265,32 +277,32 @@ def analyze_organization_performance(
         Seja específico, use números e percentuais quando relevante.
         """
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        response = loop.run_until_complete(
-            ai_service.chat_completion(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Você é Jarvis, um analista de IA especializado em otimização de chatbots e experiência do cliente. Forneça análises precisas e acionáveis."
-                    },
-                    {"role": "user", "content": analysis_prompt}
-                ],
+        # Batch de baixa prioridade: a análise noturna usa só a capacidade ociosa do gateway
+        batch_results = loop.run_until_complete(
+            ai_service.batch_completion(
+                [{
+                    "custom_id": organization_id,
+                    "messages": [
+                        {
+                            "role": "system",
+                            "content": "Você é Jarvis, um analista de IA especializado em otimização de chatbots e experiência do cliente. Forneça análises precisas e acionáveis."
+                        },
+                        {"role": "user", "content": analysis_prompt}
+                    ],
+                    "temperature": 0.3,
+                    "max_tokens": 2000
+                }],
                 metadata={
                     "organization_id": organization_id,
                     "task": "performance_analysis",
                     "queue": "jarvis_tasks"
-                },
-                temperature=0.3,
-                max_tokens=2000
+                }
             )
         )
         
-        loop.close()
-        
-        analysis = response["choices"][0]["message"]["content"]
+        analysis = AIService.batch_content(batch_results.get(organization_id))
+        if analysis is None:
+            raise RuntimeError(f"Performance analysis failed: {(batch_results.get(organization_id) or {}).get('error', 'not processed')}")
         
         # Salvar análise
         result = {
@@ -304,11 +316,7 @@ def analyze_organization_performance(
         
         # Salvar no cache por 7 dias
         cache_key = f"performance_analysis:{organization_id}:{end_date.isoformat()}"
-        await cache_service._redis.setex(
-            cache_key,
-            86400 * 7,
-            json.dumps(result)
-        )
+        loop.run_until_complete(_store_json(cache_key, 86400 * 7, result))
         
         logger.info(f"Performance analysis completed for {organization_id}")
         return result
@@ -316,6 +324,11 @@ def analyze_organization_performance(
     except Exception as e:
         logger.error(f"Error in performance analysis: {e}")
         raise self.retry(exc=e, countdown=600)
+        
+    finally:
+        loop.run_until_complete(cache_service.disconnect())
+        loop.run_until_complete(gateway_client.close())
+        loop.close()
 
 
 @shared_task(bind=True)
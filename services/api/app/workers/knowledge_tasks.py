@@ -29,6 +29,13 @@ from app.models.knowledge import KnowledgeBase, Document
 logger = logging.getLogger(__name__)
 
 
+async def _purge_search_cache(knowledge_base_id: str):
+    redis = await cache_service.get_redis()
+    pattern = f"kb_search:{knowledge_base_id}:*"
+    async for key in redis.scan_iter(match=pattern):
+        await redis.delete(key)
+
+
 @shared_task(bind=True, max_retries=3)
 def process_document(
     self,
@@ -102,15 +109,22 @@ def process_document(
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        result = loop.run_until_complete(
-            knowledge_service.add_documents(
-                documents=processed_chunks,
-                knowledge_base_id=knowledge_base_id,
-                organization_id=organization_id
+        try:
+            result = loop.run_until_complete(
+                knowledge_service.add_documents(
+                    documents=processed_chunks,
+                    knowledge_base_id=knowledge_base_id,
+                    organization_id=organization_id
+                )
             )
-        )
-        
-        loop.close()
+            
+            # Limpar cache de busca
+            if result["success"]:
+                loop.run_until_complete(_purge_search_cache(knowledge_base_id))
+        finally:
+            # Conexão Redis do singleton pertence a este loop
+            loop.run_until_complete(cache_service.disconnect())
+            loop.close()
         
         # Salvar no banco de dados
         if result["success"]:
@@ -132,12 +146,6 @@ def process_document(
             
             db.add(doc)
             db.commit()
-            
-            # Limpar cache de busca
-            await cache_service.get_redis()
-            pattern = f"kb_search:{knowledge_base_id}:*"
-            async for key in cache_service._redis.scan_iter(match=pattern):
-                await cache_service._redis.delete(key)
         
         # Limpar arquivo temporário
         if os.path.exists(file_path) and file_path.startswith("/tmp/"):
@@ -296,12 +304,15 @@ def extract_qa_pairs(
             return {"error": "No chunks found for document"}
         
         # Usar IA para extrair Q&A
-        from app.services.ai_service import AIService
+        from app.services.ai_service import AIService, gateway_client
         ai_service = AIService()
         
         qa_pairs = []
+        chunks = document_chunks[:5]  # Limitar para não gastar muito
         
-        for chunk in document_chunks[:5]:  # Limitar para não gastar muito
+        # Um batch de baixa prioridade com todos os chunks
+        requests = []
+        for index, chunk in enumerate(chunks):
             extraction_prompt = f"""
             Extraia 3-5 perguntas e respostas do texto abaixo.
             Formato: 
@@ -312,27 +323,36 @@ def extract_qa_pairs(
             {chunk['content'][:1000]}
             """
             
-            response = loop.run_until_complete(
-                ai_service.chat_completion(
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Você é um especialista em criar perguntas e respostas educativas a partir de textos."
-                        },
-                        {"role": "user", "content": extraction_prompt}
-                    ],
-                    metadata={
-                        "organization_id": organization_id,
-                        "task": "qa_extraction",
-                        "document_id": document_id
+            requests.append({
+                "custom_id": str(index),
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": "Você é um especialista em criar perguntas e respostas educativas a partir de textos."
                     },
-                    temperature=0.3,
-                    max_tokens=500
-                )
+                    {"role": "user", "content": extraction_prompt}
+                ],
+                "temperature": 0.3,
+                "max_tokens": 500
+            })
+        
+        batch_results = loop.run_until_complete(
+            ai_service.batch_completion(
+                requests,
+                metadata={
+                    "organization_id": organization_id,
+                    "task": "qa_extraction",
+                    "document_id": document_id
+                }
             )
-            
+        )
+        
+        for index, chunk in enumerate(chunks):
             # Parsear resposta
-            qa_text = response["choices"][0]["message"]["content"]
+            qa_text = AIService.batch_content(batch_results.get(str(index)))
+            if qa_text is None:
+                logger.warning(f"Q&A extraction failed for chunk {chunk['id']} of {document_id}")
+                continue
             
             # Extrair Q&A (simplificado)
             lines = qa_text.split("\n")
@@ -349,6 +369,14 @@ def extract_qa_pairs(
                     })
                     current_q = None
         
+        # Respostas rápidas (QuickResponder) leem os pares do Redis, sem ir ao banco
+        if qa_pairs:
+            loop.run_until_complete(
+                cache_service.set_knowledge_qa_pairs(organization_id, knowledge_base_id, document_id, qa_pairs)
+            )
+        
+        loop.run_until_complete(cache_service.disconnect())
+        loop.run_until_complete(gateway_client.close())
         loop.close()
         
         # Salvar Q&A pairs
@@ -0,0 +1,274 @@
+"""
+Batch de completions em baixa prioridade
+Jobs com muitas requisições executados na capacidade ociosa dos modelos, com resultados por ID
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+import logging
+
+from prometheus_client import Counter, Histogram
+
+from fair_queue import fair_scheduler
+
+logger = logging.getLogger(__name__)
+
+llm_batch_items = Counter(
+    'llm_batch_items_total',
+    'Batch requests processed',
+    ['status']  # status: succeeded/failed
+)
+
+llm_batch_idle_wait = Histogram(
+    'llm_batch_idle_wait_seconds',
+    'Time a batch request waited for idle model capacity',
+    ['model'],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900)
+)
+
+JOB_KEY = "llm_batch:{}"
+REQUESTS_KEY = "llm_batch_requests:{}"
+RESULTS_KEY = "llm_batch_results:{}"
+QUEUE_KEY = "llm_batch_queue"
+RUNNING_KEY = "llm_batch_running"  # job_id -> último heartbeat do processo que executa
+
+TERMINAL_STATUSES = ("completed", "cancelled")
+
+# Parâmetros de completion aceitos por requisição do batch (o modelo vem do roteamento)
+REQUEST_PARAMS = ("temperature", "max_tokens", "top_p", "stop", "response_format")
+
+Executor = Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class BatchValidationError(ValueError):
+    """Batch inválido (vazio, grande demais ou requisição sem messages)"""
+
+
+class BatchRunner:
+    """
+    Executa jobs de batch na capacidade ociosa do gateway.
+
+    Jobs, requisições e resultados ficam no Redis, então qualquer worker
+    responde consultas e um job interrompido é retomado (requisições já
+    respondidas não são refeitas). Cada requisição só é enviada quando o
+    modelo não tem fila interativa e está abaixo de (1 - interactive_reserve)
+    do RPM. O backend "local" passa pelo próprio router; batch endpoints de
+    provider entram como outro backend.
+    """
+
+    def __init__(self):
+        self.redis = None
+        self.execute: Optional[Executor] = None
+        self._cancelled: set = set()
+        self.configure({})
+
+    def configure(self, settings: Dict[str, Any], redis_client=None, execute: Optional[Executor] = None):
+        self.enabled = settings.get("enabled", True)
+        self.backend = settings.get("backend", "local")
+        self.max_concurrency = settings.get("max_concurrency", 8)
+        self.interactive_reserve = settings.get("interactive_reserve", 0.3)
+        self.poll_interval = settings.get("poll_interval_ms", 1000) / 1000
+        self.capacity_poll = settings.get("capacity_poll_ms", 250) / 1000
+        self.max_requests = settings.get("max_requests", 5000)
+        self.result_ttl = int(settings.get("result_ttl_hours", 72) * 3600)
+        self.stale_after = settings.get("stale_after_s", 120)
+
+        if self.backend != "local":
+            logger.warning(f"Batch backend {self.backend} not available, using local")
+            self.backend = "local"
+        if redis_client is not None:
+            self.redis = redis_client
+        if execute is not None:
+            self.execute = execute
+
+    # API
+
+    async def submit(
+        self,
+        organization_id: str,
+        requests: List[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Valida, persiste e enfileira um job"""
+        if not requests:
+            raise BatchValidationError("Batch has no requests")
+        if len(requests) > self.max_requests:
+            raise BatchValidationError(f"Batch exceeds {self.max_requests} requests")
+
+        items = []
+        seen = set()
+        for index, request in enumerate(requests):
+            if not isinstance(request.get("messages"), list) or not request["messages"]:
+                raise BatchValidationError(f"Request {index} has no messages")
+            custom_id = str(request.get("custom_id", index))
+            if custom_id in seen:
+                raise BatchValidationError(f"Duplicate custom_id {custom_id}")
+            seen.add(custom_id)
+            items.append({
+                "custom_id": custom_id,
+                "messages": request["messages"],
+                "metadata": request.get("metadata") or {},
+                **{k: request[k] for k in REQUEST_PARAMS if request.get(k) is not None}
+            })
+
+        job_id = f"batch_{uuid.uuid4().hex}"
+        job = {
+            "id": job_id,
+            "organization_id": organization_id,
+            "status": "queued",
+            "backend": self.backend,
+            "total": len(items),
+            "succeeded": 0,
+            "failed": 0,
+            "metadata": json.dumps(metadata or {}),
+            "created_at": datetime.utcnow().isoformat(),
+        }
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(JOB_KEY.format(job_id), mapping=job)
+            pipe.set(REQUESTS_KEY.format(job_id), json.dumps(items))
+            pipe.rpush(QUEUE_KEY, job_id)
+            await pipe.execute()
+
+        return self._public(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.redis.hgetall(JOB_KEY.format(job_id))
+        return self._public(job) if job else None
+
+    async def results(self, job_id: str) -> Dict[str, Any]:
+        raw = await self.redis.hgetall(RESULTS_KEY.format(job_id))
+        return {custom_id: json.loads(value) for custom_id, value in raw.items()}
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Requisições ainda não enviadas são descartadas; as em andamento terminam"""
+        job = await self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return job
+        status = "cancelled" if job["status"] == "queued" else "cancelling"
+        await self.redis.hset(JOB_KEY.format(job_id), mapping={"status": status})
+        if status == "cancelled":
+            await self._expire(job_id)
+        return {**job, "status": status}
+
+    def _public(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        public = {**job}
+        for field in ("total", "succeeded", "failed"):
+            public[field] = int(public.get(field, 0))
+        public["metadata"] = json.loads(public.get("metadata") or "{}")
+        return public
+
+    # Execução
+
+    async def wait_idle(self, model: str, organization_id: str, plan: str, tokens: int, job_id: str) -> bool:
+        """Aguarda capacidade ociosa do modelo (False se o job foi cancelado)"""
+        started = time.monotonic()
+        while not fair_scheduler.try_acquire(model, organization_id, plan, tokens, reserve=self.interactive_reserve):
+            if job_id in self._cancelled:
+                return False
+            await asyncio.sleep(self.capacity_poll)
+        llm_batch_idle_wait.labels(model=model).observe(time.monotonic() - started)
+        return True
+
+    async def run(self):
+        """Consome a fila de jobs (um job por vez por processo)"""
+        while True:
+            try:
+                await self._requeue_stale()
+                job_id = await self.redis.lpop(QUEUE_KEY)
+                if job_id is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self.process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error running batch queue: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def process(self, job_id: str):
+        raw = await self.redis.hgetall(JOB_KEY.format(job_id))
+        if not raw or raw.get("status") in TERMINAL_STATUSES:
+            return
+        if raw.get("status") == "cancelling":
+            await self.redis.hset(JOB_KEY.format(job_id), mapping={"status": "cancelled"})
+            await self._expire(job_id)
+            return
+        job = self._public(raw)
+
+        await self.redis.hset(RUNNING_KEY, job_id, time.time())
+        await self.redis.hset(JOB_KEY.format(job_id), mapping={
+            "status": "in_progress",
+            "started_at": raw.get("started_at") or datetime.utcnow().isoformat()
+        })
+
+        # Retomada: requisições já respondidas não são refeitas
+        items = json.loads(await self.redis.get(REQUESTS_KEY.format(job_id)) or "[]")
+        done = set(await self.redis.hkeys(RESULTS_KEY.format(job_id)))
+        pending = iter([item for item in items if item["custom_id"] not in done])
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await asyncio.gather(*(self._worker(job, pending) for _ in range(self.max_concurrency)))
+        finally:
+            heartbeat.cancel()
+            cancelled = job_id in self._cancelled
+            self._cancelled.discard(job_id)
+
+        await self.redis.hset(JOB_KEY.format(job_id), mapping={
+            "status": "cancelled" if cancelled else "completed",
+            "completed_at": datetime.utcnow().isoformat()
+        })
+        await self.redis.hdel(RUNNING_KEY, job_id)
+        await self._expire(job_id)
+
+    async def _worker(self, job: Dict[str, Any], pending):
+        for item in pending:
+            if job["id"] in self._cancelled:
+                return
+
+            try:
+                response = await self.execute(job, item)
+                if response is None:
+                    return  # cancelado aguardando capacidade
+                result = {"custom_id": item["custom_id"], "status": "succeeded", "response": response}
+            except Exception as e:
+                logger.warning(f"Batch {job['id']} request {item['custom_id']} failed: {e}")
+                result = {"custom_id": item["custom_id"], "status": "failed", "error": str(e)}
+
+            llm_batch_items.labels(status=result["status"]).inc()
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(RESULTS_KEY.format(job["id"]), item["custom_id"], json.dumps(result))
+                pipe.hincrby(JOB_KEY.format(job["id"]), result["status"], 1)
+                await pipe.execute()
+
+    async def _heartbeat(self, job_id: str):
+        """Mantém o job como ativo e observa pedidos de cancelamento"""
+        while True:
+            await asyncio.sleep(max(1.0, self.stale_after / 3))
+            await self.redis.hset(RUNNING_KEY, job_id, time.time())
+            if await self.redis.hget(JOB_KEY.format(job_id), "status") == "cancelling":
+                self._cancelled.add(job_id)
+
+    async def _requeue_stale(self):
+        """Jobs cujo processo parou de dar heartbeat voltam para a fila"""
+        stale_before = time.time() - self.stale_after
+        for job_id, heartbeat in (await self.redis.hgetall(RUNNING_KEY)).items():
+            # HDEL decide qual processo devolve o job à fila
+            if float(heartbeat) < stale_before and await self.redis.hdel(RUNNING_KEY, job_id):
+                logger.warning(f"Requeueing stale batch {job_id}")
+                await self.redis.rpush(QUEUE_KEY, job_id)
+
+    async def _expire(self, job_id: str):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in (JOB_KEY, REQUESTS_KEY, RESULTS_KEY):
+                pipe.expire(key.format(job_id), self.result_ttl)
+            await pipe.execute()
+
+
+# Singleton instance
+batch_runner = BatchRunner()
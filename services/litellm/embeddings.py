@@ -0,0 +1,191 @@
+"""
+Embeddings com micro-batching e cache por hash de conteúdo
+Chamadas concorrentes de uma organização são agrupadas em poucos milissegundos até o batch do provider
+"""
+
+import asyncio
+import base64
+import hashlib
+from array import array
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+import logging
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+llm_embedding_cache = Counter(
+    'llm_embedding_cache_total',
+    'Embedding cache lookups per text',
+    ['model', 'result']  # result: hit/miss
+)
+
+llm_embedding_batch_size = Histogram(
+    'llm_embedding_batch_size',
+    'Texts per provider embedding call',
+    ['model'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+)
+
+DEFAULT_MAX_BATCH_SIZE = 128
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def pack_vector(vector: List[float]) -> str:
+    """float32 em base64: ~4x menor que JSON e compatível com Redis decode_responses"""
+    return base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+
+
+def unpack_vector(value: str) -> List[float]:
+    vector = array("f")
+    vector.frombytes(base64.b64decode(value))
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """Cache Redis de embeddings por (modelo, hash do texto)"""
+
+    def __init__(self, redis_client, ttl: int = 30 * 24 * 3600, prefix: str = "emb"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, model: str, digest: str) -> str:
+        return f"{self.prefix}:{model}:{digest}"
+
+    async def get_many(self, model: str, digests: List[str]) -> List[Optional[List[float]]]:
+        if not digests:
+            return []
+        try:
+            values = await self.redis.mget([self._key(model, d) for d in digests])
+        except Exception as e:
+            logger.warning(f"Embedding cache unavailable: {e}")
+            return [None] * len(digests)
+        return [unpack_vector(v) if v else None for v in values]
+
+    async def set_many(self, model: str, items: List[Tuple[str, List[float]]]):
+        if not items:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for digest, vector in items:
+                    pipe.setex(self._key(model, digest), self.ttl, pack_vector(vector))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Error caching embeddings: {e}")
+
+
+class PendingBatch:
+    """Textos aguardando a próxima chamada ao provider"""
+
+    __slots__ = ("texts", "futures", "timer")
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa textos de chamadas concorrentes em uma única requisição ao provider.
+
+    O batch de cada (modelo, organização) é enviado quando atinge o tamanho
+    máximo do provider (model_info.max_batch_size) ou após max_wait_ms.
+    """
+
+    def __init__(
+        self,
+        call_provider: Callable[[str, List[str], Dict[str, Any]], Awaitable[List[List[float]]]],
+        cache: EmbeddingCache,
+        batch_sizes: Optional[Dict[str, int]] = None,
+        max_wait_ms: float = 5
+    ):
+        self.call_provider = call_provider
+        self.cache = cache
+        self.batch_sizes = batch_sizes or {}
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[Tuple[str, str], PendingBatch] = {}
+
+    def configure(self, batch_sizes: Dict[str, int], max_wait_ms: float):
+        self.batch_sizes = batch_sizes
+        self.max_wait = max_wait_ms / 1000
+
+    async def embed(self, model: str, texts: List[str], organization_id: str) -> Tuple[List[List[float]], int]:
+        """
+        Embeddings na ordem de entrada.
+
+        Retorna (vetores, quantidade servida do cache). Textos repetidos na
+        mesma chamada geram um único embedding.
+        """
+        digests = [content_hash(t) for t in texts]
+        cached = await self.cache.get_many(model, digests)
+
+        results: List[Optional[List[float]]] = list(cached)
+        hits = sum(1 for v in cached if v is not None)
+        llm_embedding_cache.labels(model=model, result="hit").inc(hits)
+
+        # Um future por texto distinto ainda sem embedding
+        futures: Dict[str, asyncio.Future] = {}
+        for text, digest, vector in zip(texts, digests, cached):
+            if vector is None and digest not in futures:
+                futures[digest] = self._submit(model, organization_id, text)
+
+        llm_embedding_cache.labels(model=model, result="miss").inc(len(futures))
+
+        if futures:
+            vectors = await asyncio.gather(*futures.values())
+            computed = dict(zip(futures.keys(), vectors))
+            await self.cache.set_many(model, list(computed.items()))
+            for i, digest in enumerate(digests):
+                if results[i] is None:
+                    results[i] = computed[digest]
+
+        return results, hits
+
+    def _submit(self, model: str, organization_id: str, text: str) -> asyncio.Future:
+        key = (model, organization_id)
+        loop = asyncio.get_running_loop()
+
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = PendingBatch()
+            batch.timer = loop.call_later(self.max_wait, self._flush, key)
+
+        future = loop.create_future()
+        batch.texts.append(text)
+        batch.futures.append(future)
+
+        if len(batch.texts) >= self.batch_sizes.get(model, DEFAULT_MAX_BATCH_SIZE):
+            self._flush(key)
+
+        return future
+
+    def _flush(self, key: Tuple[str, str]):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key: Tuple[str, str], batch: PendingBatch):
+        model, organization_id = key
+        llm_embedding_batch_size.labels(model=model).observe(len(batch.texts))
+
+        try:
+            vectors = await self.call_provider(model, batch.texts, {"organization_id": organization_id})
+            if len(vectors) != len(batch.texts):
+                raise ValueError(f"Provider returned {len(vectors)} embeddings for {len(batch.texts)} texts")
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, vector in zip(batch.futures, vectors):
+            if not future.done():
+                future.set_result(vector)
@@ -0,0 +1,350 @@
+"""
+Fila justa por organização na frente do router (Deficit Round Robin)
+Capacidade de cada modelo vem do rpm do config; o peso de cada organização vem do plano
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+import logging
+
+from prometheus_client import Gauge, Histogram, Counter
+
+logger = logging.getLogger(__name__)
+
+llm_queue_depth = Gauge(
+    'llm_queue_depth',
+    'Requests waiting for provider capacity',
+    ['model']
+)
+
+llm_queue_wait = Histogram(
+    'llm_queue_wait_seconds',
+    'Time spent waiting in the fair queue',
+    ['model', 'plan'],
+    buckets=(0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+llm_queue_rejections = Counter(
+    'llm_queue_rejections_total',
+    'Requests rejected by the fair queue',
+    ['model', 'reason']  # reason: queue_full/deadline
+)
+
+DEFAULT_PLAN_WEIGHTS = {"free": 1, "starter": 2, "professional": 4, "enterprise": 8}
+DEFAULT_TPM_BUDGETS = {"free": 20000, "starter": 100000, "professional": 400000, "enterprise": 2000000}
+
+
+class QueueFullError(Exception):
+    """Fila da organização (ou global) está cheia"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueDeadlineError(Exception):
+    """Requisição não conseguiu capacidade antes do deadline"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SlidingWindow:
+    """Soma de valores nos últimos 60 segundos"""
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._events: deque = deque()
+        self.total = 0
+
+    def _trim(self, now: float):
+        while self._events and self._events[0][0] <= now - self.window:
+            self.total -= self._events.popleft()[1]
+
+    def used(self, now: float) -> int:
+        self._trim(now)
+        return self.total
+
+    def add(self, now: float, amount: int = 1):
+        self._events.append((now, amount))
+        self.total += amount
+
+    def next_release(self, now: float) -> float:
+        """Segundos até o evento mais antigo sair da janela"""
+        self._trim(now)
+        if not self._events:
+            return 0.0
+        return max(0.0, self._events[0][0] + self.window - now)
+
+
+class Waiter:
+    """Requisição aguardando capacidade"""
+
+    __slots__ = ("organization_id", "plan", "tokens", "future", "enqueued_at")
+
+    def __init__(self, organization_id: str, plan: str, tokens: int, future: asyncio.Future):
+        self.organization_id = organization_id
+        self.plan = plan
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class ModelQueue:
+    """Filas por organização de um modelo, servidas em DRR"""
+
+    def __init__(self, model: str, rpm: Optional[int]):
+        self.model = model
+        self.rpm = rpm
+        self.window = SlidingWindow()
+        self.orgs: "OrderedDict[str, deque]" = OrderedDict()
+        self.deficit: Dict[str, float] = {}
+        self.depth = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def has_capacity(self, now: float, reserve: float = 0.0) -> bool:
+        """Há RPM livre deixando `reserve` (fração do limite) sem uso"""
+        return not self.rpm or self.window.used(now) < self.rpm * (1 - reserve)
+
+
+class FairScheduler:
+    """
+    Distribui a capacidade de RPM de cada modelo entre organizações.
+
+    Sem fila o caminho é imediato; quando o limite é atingido as requisições
+    esperam em filas por organização servidas por Deficit Round Robin com
+    quantum proporcional ao peso do plano. Organizações acima do orçamento
+    de tokens por minuto ficam fora da rodada até a janela liberar.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        self._queues: Dict[str, ModelQueue] = {}
+        self._tpm: Dict[str, SlidingWindow] = {}
+        self._org_plan: Dict[str, str] = {}
+        # Cada worker do gateway agenda só a sua fração do RPM de cada deployment
+        self.workers = max(1, int(os.getenv("LITELLM_WORKERS", 1)))
+        self.configure([], settings or {})
+
+    def configure(self, model_list: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None):
+        settings = settings or {}
+        self.enabled = settings.get("enabled", True)
+        self.plan_weights = {**DEFAULT_PLAN_WEIGHTS, **settings.get("plan_weights", {})}
+        self.tpm_budgets = {**DEFAULT_TPM_BUDGETS, **settings.get("tpm_budgets", {})}
+        self.max_queue_per_org = settings.get("max_queue_per_organization", 50)
+        self.max_queue_total = settings.get("max_queue_total", 1000)
+        self.default_deadline = settings.get("default_deadline_ms", 10000) / 1000
+
+        for model_config in model_list:
+            name = model_config["model_name"]
+            rpm = model_config.get("litellm_params", {}).get("rpm")
+            if rpm:
+                rpm = max(1, rpm // self.workers)
+            if name in self._queues:
+                self._queues[name].rpm = rpm
+            else:
+                self._queues[name] = ModelQueue(name, rpm)
+
+    def _queue(self, model: str) -> ModelQueue:
+        if model not in self._queues:
+            self._queues[model] = ModelQueue(model, None)
+        return self._queues[model]
+
+    def _tpm_window(self, organization_id: str) -> SlidingWindow:
+        if organization_id not in self._tpm:
+            self._tpm[organization_id] = SlidingWindow()
+        return self._tpm[organization_id]
+
+    def _within_tpm(self, organization_id: str, plan: str, tokens: int, now: float) -> bool:
+        budget = self.tpm_budgets.get(plan)
+        if not budget:
+            return True
+        used = self._tpm_window(organization_id).used(now)
+        # Requisição maior que o orçamento inteiro passa sozinha com a janela vazia
+        return used == 0 or used + tokens <= budget
+
+    def _grant(self, queue: ModelQueue, waiter: Waiter, now: float):
+        queue.window.add(now)
+        self._tpm_window(waiter.organization_id).add(now, waiter.tokens)
+        llm_queue_wait.labels(model=queue.model, plan=waiter.plan).observe(now - waiter.enqueued_at)
+
+    def record_tokens(self, organization_id: str, tokens: int):
+        """Contabiliza tokens reais (ex: completion) no orçamento por minuto"""
+        if tokens > 0:
+            self._tpm_window(organization_id).add(time.monotonic(), tokens)
+
+    def queue_depth(self, model: Optional[str] = None) -> int:
+        if model:
+            return self._queue(model).depth
+        return sum(q.depth for q in self._queues.values())
+
+    def try_acquire(
+        self,
+        model: str,
+        organization_id: str,
+        plan: str = "starter",
+        tokens: int = 0,
+        reserve: float = 0.0
+    ) -> bool:
+        """
+        Concede capacidade só se disponível agora e ninguém estiver na fila.
+
+        reserve > 0 (batch) só usa capacidade ociosa: a fração reservada do RPM
+        fica para o tráfego interativo.
+        """
+        if not self.enabled:
+            return True
+
+        queue = self._queue(model)
+        now = time.monotonic()
+
+        if queue.depth == 0 and queue.has_capacity(now, reserve) and self._within_tpm(organization_id, plan, tokens, now):
+            self._grant(queue, Waiter(organization_id, plan, tokens, None), now)
+            return True
+        return False
+
+    async def acquire(
+        self,
+        model: str,
+        organization_id: str,
+        plan: str = "starter",
+        tokens: int = 0,
+        deadline: Optional[float] = None
+    ):
+        """Aguarda capacidade do modelo respeitando a justiça entre organizações"""
+        if self.try_acquire(model, organization_id, plan, tokens):
+            return
+
+        queue = self._queue(model)
+        org_queue = queue.orgs.get(organization_id)
+
+        if self.queue_depth() >= self.max_queue_total or (
+            org_queue is not None and len(org_queue) >= self.max_queue_per_org
+        ):
+            llm_queue_rejections.labels(model=model, reason="queue_full").inc()
+            raise QueueFullError(
+                f"Queue full for organization {organization_id} on {model}",
+                retry_after=queue.window.next_release(time.monotonic()) or 1.0
+            )
+
+        self._org_plan[organization_id] = plan
+        waiter = Waiter(organization_id, plan, tokens, asyncio.get_running_loop().create_future())
+
+        if org_queue is None:
+            org_queue = queue.orgs[organization_id] = deque()
+            queue.deficit.setdefault(organization_id, 0.0)
+        org_queue.append(waiter)
+        queue.depth += 1
+        llm_queue_depth.labels(model=model).set(queue.depth)
+
+        self._pump(queue)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=deadline or self.default_deadline)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return
+            waiter.future.cancel()
+            self._remove(queue, waiter)
+            llm_queue_rejections.labels(model=model, reason="deadline").inc()
+            raise QueueDeadlineError(
+                f"No capacity for {model} before deadline",
+                retry_after=queue.window.next_release(time.monotonic()) or 1.0
+            )
+        except asyncio.CancelledError:
+            # Cliente desistiu: liberar o lugar na fila
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._remove(queue, waiter)
+            raise
+
+    def _remove(self, queue: ModelQueue, waiter: Waiter):
+        org_queue = queue.orgs.get(waiter.organization_id)
+        if org_queue and waiter in org_queue:
+            org_queue.remove(waiter)
+            queue.depth -= 1
+            if not org_queue:
+                del queue.orgs[waiter.organization_id]
+                queue.deficit.pop(waiter.organization_id, None)
+            llm_queue_depth.labels(model=queue.model).set(queue.depth)
+
+    def _pump(self, queue: ModelQueue):
+        """Concede capacidade disponível às filas em Deficit Round Robin"""
+        now = time.monotonic()
+        progressed = True
+
+        while queue.depth and queue.has_capacity(now) and progressed:
+            progressed = False
+
+            for organization_id in list(queue.orgs.keys()):
+                if not queue.has_capacity(now):
+                    break
+
+                org_queue = queue.orgs.get(organization_id)
+                if not org_queue:
+                    continue
+
+                plan = self._org_plan.get(organization_id, "starter")
+                quantum = self.plan_weights.get(plan, 1)
+                # Org que ficou com crédito na rodada anterior retoma sem ganhar novo quantum
+                if queue.deficit[organization_id] < 1:
+                    queue.deficit[organization_id] += quantum
+
+                # Cada requisição custa 1 unidade de RPM
+                while org_queue and queue.deficit[organization_id] >= 1 and queue.has_capacity(now):
+                    waiter = org_queue[0]
+                    if not self._within_tpm(organization_id, waiter.plan, waiter.tokens, now):
+                        # Bloqueada por TPM: perde a vez nesta rodada
+                        queue.deficit[organization_id] = 0.0
+                        break
+
+                    org_queue.popleft()
+                    queue.depth -= 1
+
+                    if waiter.future.done():
+                        continue
+
+                    queue.deficit[organization_id] -= 1
+                    self._grant(queue, waiter, now)
+                    waiter.future.set_result(True)
+                    progressed = True
+
+                if not org_queue:
+                    del queue.orgs[organization_id]
+                    queue.deficit.pop(organization_id, None)
+                elif queue.deficit[organization_id] < 1:
+                    # Quantum consumido: vai para o fim da rodada
+                    queue.orgs.move_to_end(organization_id)
+
+        llm_queue_depth.labels(model=queue.model).set(queue.depth)
+
+        if queue.depth and queue.timer is None:
+            # Reavaliar quando a janela de RPM liberar (ou em 1s para orgs bloqueadas por TPM)
+            delay = queue.window.next_release(now) if not queue.has_capacity(now) else 1.0
+            loop = asyncio.get_running_loop()
+            queue.timer = loop.call_later(max(delay, 0.001), self._on_timer, queue)
+
+    def _on_timer(self, queue: ModelQueue):
+        queue.timer = None
+        self._pump(queue)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Profundidade das filas por modelo e organização"""
+        now = time.monotonic()
+        return {
+            model: {
+                "depth": q.depth,
+                "rpm_used": q.window.used(now),
+                "rpm_limit": q.rpm,
+                "organizations": {org: len(waiters) for org, waiters in q.orgs.items()},
+            }
+            for model, q in self._queues.items()
+            if q.depth or q.window.used(now)
+        }
+
+
+# Singleton
+fair_scheduler = FairScheduler()
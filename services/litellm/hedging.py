@@ -0,0 +1,212 @@
+"""
+Hedged completions - requisição especulativa em deployment equivalente
+Se o primário não entregar o primeiro token a tempo, dispara um segundo e fica com quem responder primeiro
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+import logging
+
+from prometheus_client import Counter
+
+from model_health import HealthTracker
+from spend_guard import BudgetExceededError
+
+logger = logging.getLogger(__name__)
+
+llm_hedges = Counter(
+    'llm_hedges_total',
+    'Hedged requests by outcome',
+    ['model', 'outcome']  # outcome: primary_won/hedge_won/budget_denied/no_alternate
+)
+
+llm_hedge_cost = Counter(
+    'llm_hedge_wasted_cost_total',
+    'Estimated cost of cancelled hedge losers in USD',
+    ['model', 'organization']
+)
+
+
+class HedgeBudget:
+    """Limita hedges por organização (por minuto e custo desperdiçado por dia)"""
+
+    def __init__(self, max_per_minute: int = 30, max_cost_per_day: float = 5.0):
+        self.max_per_minute = max_per_minute
+        self.max_cost_per_day = max_cost_per_day
+        self._recent: Dict[str, deque] = defaultdict(deque)
+        self._cost: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def _today(self) -> str:
+        return datetime.utcnow().strftime("%Y%m%d")
+
+    def allow(self, organization_id: str) -> bool:
+        now = time.monotonic()
+        recent = self._recent[organization_id]
+        while recent and recent[0] < now - 60:
+            recent.popleft()
+
+        if len(recent) >= self.max_per_minute:
+            return False
+        if self._cost[(organization_id, self._today())] >= self.max_cost_per_day:
+            return False
+
+        recent.append(now)
+        return True
+
+    def record_cost(self, organization_id: str, cost: float):
+        key = (organization_id, self._today())
+        # Descartar contadores de dias anteriores
+        for stale in [k for k in self._cost if k[0] == organization_id and k != key]:
+            del self._cost[stale]
+        self._cost[key] += cost
+
+
+async def close_stream(stream: Any):
+    """Fecha o stream do provider (best-effort) para cancelar a geração"""
+    for target in (stream, getattr(stream, "completion_stream", None)):
+        close = getattr(target, "aclose", None)
+        if close:
+            try:
+                await close()
+            except Exception as e:
+                logger.debug(f"Error closing hedged stream: {e}")
+            return
+
+
+class HedgedStreamer:
+    """Corrida entre deployments equivalentes pelo primeiro token"""
+
+    def __init__(self, tracker: HealthTracker, settings: Optional[Dict[str, Any]] = None):
+        self.tracker = tracker
+        self.configure(settings or {})
+
+    def configure(self, settings: Dict[str, Any]):
+        self.enabled = settings.get("enabled", False)
+        self.fraction_of_p95 = settings.get("fraction_of_p95", 0.8)
+        self.min_delay = settings.get("min_delay_ms", 300) / 1000
+        self.default_delay = settings.get("default_delay_ms", 1500) / 1000
+        self.channels = set(settings.get("channels", ["whatsapp"]))
+        self.budget = HedgeBudget(
+            max_per_minute=settings.get("max_hedges_per_minute", 30),
+            max_cost_per_day=settings.get("max_hedge_cost_per_day", 5.0)
+        )
+
+    def should_hedge(self, metadata: Dict[str, Any]) -> bool:
+        """Hedge só para streams sensíveis a latência (canal ou opt-in explícito)"""
+        if not self.enabled:
+            return False
+        if "hedge" in metadata:
+            return bool(metadata["hedge"])
+        return metadata.get("channel") in self.channels
+
+    def hedge_delay(self, model: str) -> float:
+        """Tempo de espera pelo primeiro token antes de disparar o hedge"""
+        p95 = self.tracker.stats(model).ttft_percentile(0.95)
+        if p95 is None:
+            return self.default_delay
+        return max(self.min_delay, p95 * self.fraction_of_p95)
+
+    async def _open(self, start_stream: Callable[[str], Awaitable[Any]], model: str, holder: Dict[str, Any]):
+        stream = await start_stream(model)
+        holder[model] = stream
+        first_chunk = await stream.__anext__()
+        return model, stream, first_chunk
+
+    def _spawn(self, start_stream, model: str, opened: Dict[str, Any]) -> asyncio.Task:
+        task = asyncio.create_task(self._open(start_stream, model, opened))
+        # Erros do perdedor são esperados; evita "exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def stream(
+        self,
+        start_stream: Callable[[str], Awaitable[Any]],
+        primary: str,
+        alternates: List[str],
+        organization_id: str,
+        reserve_hedge: Callable[[str], Awaitable[None]],
+        settle_loser: Callable[[str, bool], float]
+    ) -> Tuple[str, Any, Any]:
+        """
+        Abre o stream no primário e, se necessário, em um alternativo.
+
+        Retorna (modelo vencedor, stream, primeiro chunk). reserve_hedge
+        reserva o orçamento do alternativo antes de dispará-lo (orçamento
+        esgotado: sem hedge). Todo deployment que não venceu é cancelado e
+        liquidado por settle_loser(modelo, stream aberto), que devolve o
+        custo cobrado.
+        """
+        opened: Dict[str, Any] = {}
+        primary_task = self._spawn(start_stream, primary, opened)
+        tasks = {primary_task: primary}
+        winner = None
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay(primary))
+            if done:
+                result = primary_task.result()
+                winner = primary_task
+                return result
+
+            alternates = [m for m in alternates if m != primary and self.tracker.is_healthy(m)]
+            outcome = None
+            if not alternates:
+                outcome = "no_alternate"
+            elif not self.budget.allow(organization_id):
+                outcome = "budget_denied"
+            else:
+                try:
+                    await reserve_hedge(alternates[0])
+                except BudgetExceededError:
+                    outcome = "budget_denied"
+
+            if outcome is not None:
+                llm_hedges.labels(model=primary, outcome=outcome).inc()
+                result = await primary_task
+                winner = primary_task
+                return result
+
+            hedge_model = alternates[0]
+            self.tracker.record_request(hedge_model)
+            hedge_task = self._spawn(start_stream, hedge_model, opened)
+            tasks[hedge_task] = hedge_model
+            logger.info(f"Hedging {primary} with {hedge_model} for org {organization_id}")
+
+            error = None
+            pending = set(tasks)
+
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = task.exception()
+
+            if winner is None:
+                raise error
+
+            outcome = "primary_won" if winner is primary_task else "hedge_won"
+            llm_hedges.labels(model=primary, outcome=outcome).inc()
+
+            return winner.result()
+
+        finally:
+            # Só o stream do vencedor sai daqui aberto; em erro ou cancelamento
+            # (cliente desconectou) nenhum sai, e as gerações em curso param
+            for task, model in tasks.items():
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                if model in opened:
+                    await close_stream(opened[model])
+
+                # Orçamento da organização e analytics; o desperdício conta só com hedge disparado
+                cost = settle_loser(model, model in opened)
+                if len(tasks) > 1:
+                    self.budget.record_cost(organization_id, cost)
+                    llm_hedge_cost.labels(model=model, organization=organization_id).inc(cost)
@@ -3,9 +3,13 @@
 Proxy inteligente para gerenciamento de LLMs com roteamento por tiers
 """
 
+from startup import startup_profile
+
 import os
 import asyncio
-from typing import Dict, Any, Optional, List
+import time
+import uuid
+from typing import Dict, Any, Optional, List, Tuple, TYPE_CHECKING
 from datetime import datetime
 import logging
 from contextlib import asynccontextmanager
@@ -13,136 +17,68 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
-import litellm
-from litellm import Router, completion, acompletion
-from litellm.integrations.custom_logger import CustomLogger
-from prometheus_client import Counter, Histogram, Gauge
+from starlette.background import BackgroundTask
 import redis.asyncio as redis
-import yaml
 import json
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from token_budget import token_counter, prompt_budgeter
+from model_health import health_tracker
+from hedging import HedgedStreamer
+from fair_queue import fair_scheduler, QueueFullError, QueueDeadlineError
+from spend_guard import spend_guard, BudgetExceededError
+from provider_pools import provider_pools
+from usage_accounting import AnalyticsWriter, StreamAccounting, usage_cost, build_usage_record
+from batches import batch_runner, BatchValidationError, REQUEST_PARAMS as BATCH_REQUEST_PARAMS
+from sse import sse_stream
+from prompt_cache import prompt_cache
+from embeddings import EmbeddingBatcher, EmbeddingCache
+from mock_provider import with_mock_provider
+from routing_engine import RoutingTable, IntentMatcher, ConfigWatcher, load_config
 
-# Carregar configuração
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+# litellm (e o callback de métricas) é importado no lifespan: o import leva segundos
+# e não é necessário para carregar o módulo (scripts, workers, testes)
+if TYPE_CHECKING:
+    from litellm import Router
 
-# Métricas Prometheus
-llm_requests = Counter(
-    'llm_requests_total',
-    'Total LLM requests',
-    ['model', 'tier', 'status']
-)
+startup_profile.mark("imports")
 
-llm_tokens = Counter(
-    'llm_tokens_total',
-    'Total tokens processed',
-    ['model', 'type']  # type: prompt/completion
-)
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-llm_latency = Histogram(
-    'llm_request_duration_seconds',
-    'LLM request latency',
-    ['model', 'tier']
-)
+# Sem isso o litellm baixa o mapa de custos do GitHub ao ser importado (até 5s sem rede);
+# o custo por token usado no gateway vem do model_info do config
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
 
-llm_cost = Counter(
-    'llm_cost_total',
-    'Total cost in USD',
-    ['model', 'organization']
-)
+# Configuração carregada e compilada no lifespan (em índices para o caminho quente)
+CONFIG_PATH = os.getenv("LITELLM_CONFIG_PATH", "config.yaml")
 
-active_llm_requests = Gauge(
-    'llm_active_requests',
-    'Active LLM requests',
-    ['model']
-)
+def read_config(path: str) -> Dict:
+    """Lê o YAML validado aplicando o provider simulado (mock_provider.enabled) se configurado"""
+    return with_mock_provider(load_config(path))
 
-# Custom Logger para métricas e análise
-class MetricsLogger(CustomLogger):
-    def __init__(self, redis_client):
-        self.redis = redis_client
-        
-    async def log_pre_api_call(self, model, messages, kwargs):
-        """Log antes da chamada"""
-        active_llm_requests.labels(model=model).inc()
-        
-    async def log_success_event(self, kwargs, response_obj, start_time, end_time):
-        """Log de sucesso com métricas"""
-        model = kwargs.get("model", "unknown")
-        
-        # Extrair tier do nome do modelo
-        tier = model.split("/")[0] if "/" in model else "unknown"
-        
-        # Métricas
-        llm_requests.labels(model=model, tier=tier, status="success").inc()
-        
-        # Tokens
-        usage = response_obj.get("usage", {})
-        if usage:
-            llm_tokens.labels(model=model, type="prompt").inc(usage.get("prompt_tokens", 0))
-            llm_tokens.labels(model=model, type="completion").inc(usage.get("completion_tokens", 0))
-        
-        # Latência
-        duration = end_time - start_time
-        llm_latency.labels(model=model, tier=tier).observe(duration)
-        
-        # Custo estimado
-        cost = self._calculate_cost(model, usage)
-        if cost > 0:
-            org_id = kwargs.get("metadata", {}).get("organization_id", "unknown")
-            llm_cost.labels(model=model, organization=org_id).inc(cost)
-        
-        # Salvar no Redis para analytics
-        await self._save_to_redis(model, kwargs, response_obj, duration, cost)
-        
-        active_llm_requests.labels(model=model).dec()
-        
-    async def log_failure_event(self, kwargs, response_obj, start_time, end_time):
-        """Log de falha"""
-        model = kwargs.get("model", "unknown")
-        tier = model.split("/")[0] if "/" in model else "unknown"
-        
-        llm_requests.labels(model=model, tier=tier, status="failure").inc()
-        active_llm_requests.labels(model=model).dec()
-        
-    def _calculate_cost(self, model: str, usage: Dict) -> float:
-        """Calcula custo baseado no modelo e uso"""
-        # Buscar informações do modelo no config
-        for model_config in config["model_list"]:
-            if model_config["model_name"] == model:
-                cost_per_token = model_config.get("model_info", {}).get("cost_per_token", 0)
-                total_tokens = usage.get("total_tokens", 0)
-                return total_tokens * cost_per_token
-        return 0
-        
-    async def _save_to_redis(self, model: str, kwargs: Dict, response: Dict, duration: float, cost: float):
-        """Salva dados para analytics"""
-        data = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "model": model,
-            "organization_id": kwargs.get("metadata", {}).get("organization_id"),
-            "user_id": kwargs.get("metadata", {}).get("user_id"),
-            "conversation_id": kwargs.get("metadata", {}).get("conversation_id"),
-            "duration": duration,
-            "cost": cost,
-            "tokens": response.get("usage", {}),
-            "intent": kwargs.get("metadata", {}).get("intent"),
-            "tier": model.split("/")[0] if "/" in model else "unknown"
-        }
-        
-        # Salvar no Redis com TTL de 30 dias
-        key = f"llm_analytics:{data['organization_id']}:{datetime.utcnow().strftime('%Y%m%d')}:{response.get('id')}"
-        await self.redis.setex(key, 30 * 24 * 3600, json.dumps(data))
+config: Dict = {}
+routing_table: Optional[RoutingTable] = None
+intent_matcher = IntentMatcher()
 
 # Lifespan manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global config, routing_table
+    
     # Startup
+    startup_profile.mark("server")
     logger.info("🚀 LiteLLM Gateway iniciando...")
     
+    # Config validado e compilado (erro aqui impede o start em vez de falhar na primeira requisição)
+    config = read_config(CONFIG_PATH)
+    routing_table = RoutingTable(config)
+    startup_profile.mark("config")
+    
+    import litellm
+    from metrics_logger import MetricsLogger
+    startup_profile.mark("litellm_import")
+    
     # Conectar Redis
     app.state.redis = await redis.from_url(
         os.getenv("REDIS_URL", "redis://localhost:6379"),
@@ -160,29 +96,149 @@ async def lifespan(app: FastAPI):
         password=os.getenv("REDIS_PASSWORD", None)
     )
     
+    # Limites de RPM para seleção por saúde/latência
+    health_tracker.configure(
+        config["model_list"],
+        config["router_settings"].get("health_routing")
+    )
+    
+    # Fila justa por organização na frente dos limites de RPM
+    fair_scheduler.configure(config["model_list"], config.get("fair_queue_settings"))
+    
+    # Orçamento por organização com leases locais sobre o Redis
+    spend_guard.configure(config.get("spend_guard_settings") or {}, redis_client=app.state.redis)
+    spend_task = asyncio.create_task(spend_guard.run())
+    
+    # Cache de prefixo de prompt por agente
+    prompt_cache.configure(config.get("prompt_cache_settings") or {})
+    
+    # Hedging de streams sensíveis a latência
+    app.state.hedger = HedgedStreamer(health_tracker, config.get("hedging_settings"))
+    
     # Criar router com configuração
-    app.state.router = Router(
-        model_list=config["model_list"],
-        fallbacks=config["litellm_settings"]["fallbacks"],
-        context_window_fallbacks=config["litellm_settings"]["context_window_fallbacks"],
-        num_retries=config["litellm_settings"]["num_retries"],
-        timeout=config["litellm_settings"]["request_timeout"],
-        retry_after=config["litellm_settings"]["retry_after"],
-        routing_strategy="cost-optimized-routing"
+    app.state.router = build_router(config)
+    startup_profile.mark("router")
+    
+    # Pools de conexão por provider, aquecidos antes da primeira requisição
+    provider_pools.configure(config["model_list"], config.get("connection_pool_settings"))
+    provider_pools.install(app.state.router)
+    await provider_pools.warm()
+    startup_profile.mark("pool_warmup")
+    
+    # Embeddings com micro-batching e cache por hash de conteúdo
+    embedding_settings = config.get("embedding_settings") or {}
+    app.state.embedder = EmbeddingBatcher(
+        lambda model, texts, metadata: call_embedding_provider(app, model, texts, metadata),
+        EmbeddingCache(app.state.redis, ttl=embedding_settings.get("cache_ttl_days", 30) * 24 * 3600),
+        batch_sizes=routing_table.batch_sizes,
+        max_wait_ms=embedding_settings.get("max_wait_ms", 5)
     )
     
+    # Registros de uso gravados no Redis em lote (callback e streams)
+    app.state.analytics = AnalyticsWriter(app.state.redis)
+    app.state.analytics.configure(config.get("analytics_settings") or {})
+    analytics_task = asyncio.create_task(app.state.analytics.run())
+    
+    # Batch de completions em baixa prioridade (backend local pelo router)
+    batch_runner.configure(
+        config.get("batch_settings") or {},
+        redis_client=app.state.redis,
+        execute=lambda job, item: run_batch_request(app, job, item)
+    )
+    batch_task = asyncio.create_task(batch_runner.run()) if batch_runner.enabled else None
+    
     # Adicionar custom logger
-    metrics_logger = MetricsLogger(app.state.redis)
+    metrics_logger = MetricsLogger(app.state.analytics, lambda: routing_table)
     litellm.callbacks = [metrics_logger]
     
+    # Hot reload do config sem reiniciar o serviço (0 desativa)
+    reload_interval = float(os.getenv("CONFIG_RELOAD_INTERVAL", 5))
+    watcher_task = None
+    if reload_interval > 0:
+        watcher = ConfigWatcher(CONFIG_PATH, reload_interval, loader=read_config)
+        watcher_task = asyncio.create_task(watcher.watch(lambda table: apply_config(app, table)))
+    
+    startup_profile.mark("components")
+    startup_profile.ready()
     logger.info("✅ LiteLLM Gateway pronto!")
     
     yield
     
     # Shutdown
     logger.info("🛑 LiteLLM Gateway encerrando...")
+    if watcher_task:
+        watcher_task.cancel()
+    spend_task.cancel()
+    analytics_task.cancel()
+    if batch_task:
+        # Jobs interrompidos são retomados por outro processo (heartbeat expira)
+        batch_task.cancel()
+    await spend_guard.close()
+    await app.state.analytics.flush()
+    await provider_pools.close()
     await app.state.redis.close()
 
+def build_router(cfg: Dict) -> "Router":
+    """Cria o Router do LiteLLM a partir do config"""
+    from litellm import Router
+    
+    return Router(
+        model_list=cfg["model_list"],
+        fallbacks=cfg["litellm_settings"]["fallbacks"],
+        context_window_fallbacks=cfg["litellm_settings"]["context_window_fallbacks"],
+        num_retries=cfg["litellm_settings"]["num_retries"],
+        timeout=cfg["litellm_settings"]["request_timeout"],
+        retry_after=cfg["litellm_settings"]["retry_after"],
+        routing_strategy="cost-optimized-routing"
+    )
+
+async def call_embedding_provider(app: FastAPI, model: str, texts: List[str], metadata: Dict) -> List[List[float]]:
+    """Uma chamada de embeddings ao provider para o batch inteiro"""
+    health_tracker.record_request(model)
+    response = await app.state.router.aembedding(model=model, input=texts, metadata=metadata)
+    
+    items = sorted(
+        (item if isinstance(item, dict) else item.dict() for item in response.data),
+        key=lambda item: item.get("index", 0)
+    )
+    return [item["embedding"] for item in items]
+
+async def apply_config(app: FastAPI, table: RoutingTable):
+    """Aplica um config recarregado (já compilado) aos componentes do gateway"""
+    global config, routing_table
+    
+    new_config = table.config
+    
+    # Router só é recriado se modelos ou fallbacks mudaram; requisições em andamento mantêm o antigo
+    router = app.state.router
+    if (new_config["model_list"] != config["model_list"] or
+            new_config["litellm_settings"] != config["litellm_settings"]):
+        router = build_router(new_config)
+    
+    # Pools alterados são recriados (os antigos fecham depois de drenar) e reinstalados no router
+    provider_pools.configure(new_config["model_list"], new_config.get("connection_pool_settings"))
+    provider_pools.install(router)
+    asyncio.create_task(provider_pools.warm())
+    
+    health_tracker.configure(
+        new_config["model_list"],
+        new_config["router_settings"].get("health_routing")
+    )
+    fair_scheduler.configure(new_config["model_list"], new_config.get("fair_queue_settings"))
+    spend_guard.configure(new_config.get("spend_guard_settings") or {})
+    app.state.analytics.configure(new_config.get("analytics_settings") or {})
+    batch_runner.configure(new_config.get("batch_settings") or {})
+    prompt_cache.configure(new_config.get("prompt_cache_settings") or {})
+    app.state.embedder.configure(
+        table.batch_sizes,
+        (new_config.get("embedding_settings") or {}).get("max_wait_ms", 5)
+    )
+    if new_config.get("hedging_settings") != config.get("hedging_settings"):
+        app.state.hedger.configure(new_config.get("hedging_settings") or {})
+    
+    app.state.router = router
+    config, routing_table = new_config, table
+
 # Criar app
 app = FastAPI(
     title="LiteLLM Gateway - Agentes de Conversão",
@@ -224,6 +280,7 @@ async def chat_completion(
 ):
     """Endpoint principal para chat completions com roteamento inteligente"""
     
+    reservation = None
     try:
         body = await request.json()
         
@@ -235,38 +292,253 @@ async def chat_completion(
         metadata["organization_id"] = organization_id
         
         # Determinar modelo baseado no contexto
-        model = await determine_model(
+        route = await resolve_route(
             messages=messages,
             metadata=metadata,
             router=request.app.state.router
         )
+        model = route["model"]
+        
+        # Janela de contexto do modelo escolhido e prefixo de cache do agente
+        base_messages, messages, prompt_tokens = prepare_messages(messages, model, metadata, body.get("max_tokens"))
+        plan = metadata.get("plan") or "starter"
+        
+        # Reservar o pior caso no orçamento da organização (liquidado com o uso real)
+        estimated_cost, estimated_tokens = spend_guard.estimate(
+            prompt_tokens,
+            body.get("max_tokens") or get_model_params(model).get("max_tokens"),
+            routing_table.cost_per_token(model)
+        )
+        reservation = await spend_guard.reserve(organization_id, plan, estimated_cost, estimated_tokens)
+        
+        # Aguardar capacidade do modelo de forma justa entre organizações
+        deadline_ms = metadata.get("deadline_ms")
+        await fair_scheduler.acquire(
+            model,
+            organization_id,
+            plan=plan,
+            tokens=prompt_tokens,
+            deadline=deadline_ms / 1000 if deadline_ms else None
+        )
+        health_tracker.record_request(model)
         
         # Preparar request
         completion_kwargs = {
             "model": model,
             "messages": messages,
             "metadata": metadata,
-            **{k: v for k, v in body.items() if k not in ["messages", "metadata", "model"]}
+            **{k: v for k, v in body.items() if k not in ["messages", "metadata", "model", "stream"]}
         }
         
         # Stream ou não
         if body.get("stream", False):
-            response = await request.app.state.router.acompletion(**completion_kwargs, stream=True)
+            router = request.app.state.router
+            hedger = request.app.state.hedger
+            started = time.perf_counter()
             
-            async def generate():
-                async for chunk in response:
-                    yield f"data: {json.dumps(chunk.dict())}\n\n"
-                yield "data: [DONE]\n\n"
+            def stream_options(deployment: str) -> Dict[str, Any]:
+                # Usage do provider no último chunk (StreamAccounting prefere à contagem local)
+                if "stream_options" in body or not routing_table.supports_stream_usage(deployment):
+                    return {}
+                return {"stream_options": {"include_usage": True}}
+            
+            if hedger.should_hedge(metadata):
+                reservations = {model: reservation}
+                
+                async def reserve_hedge(deployment: str):
+                    hedge_cost, hedge_tokens = spend_guard.estimate(
+                        prompt_tokens,
+                        body.get("max_tokens") or get_model_params(deployment).get("max_tokens"),
+                        routing_table.cost_per_token(deployment)
+                    )
+                    reservations[deployment] = await spend_guard.reserve(
+                        organization_id, plan, hedge_cost, hedge_tokens
+                    )
+                
+                def settle_loser(deployment: str, opened: bool) -> float:
+                    # Stream aberto: o provider recebeu o prompt; a saída cancelada não é contada
+                    loser_reservation = reservations.pop(deployment, None)
+                    if not opened:
+                        spend_guard.release(loser_reservation)
+                        return 0.0
+                    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
+                    cost, tokens, _, _ = usage_cost(routing_table, deployment, usage)
+                    spend_guard.commit(loser_reservation, cost, tokens)
+                    request.app.state.analytics.record(
+                        build_usage_record(
+                            deployment, metadata, usage, time.perf_counter() - started, cost,
+                            stream=True,
+                            status="hedge_cancelled",
+                            usage_source="estimated"
+                        ),
+                        record_id=f"hedge-{uuid.uuid4().hex}"
+                    )
+                    return cost
                 
-            return StreamingResponse(generate(), media_type="text/event-stream")
+                async def start_stream(deployment: str):
+                    # Hedge não espera na fila: só dispara se houver capacidade imediata
+                    if deployment != route["model"] and not fair_scheduler.try_acquire(
+                        deployment, organization_id, plan, prompt_tokens
+                    ):
+                        raise QueueFullError(f"No capacity to hedge on {deployment}")
+                    deployment_messages = completion_kwargs["messages"]
+                    if deployment != route["model"]:
+                        deployment_messages, _ = prompt_cache.prepare(
+                            base_messages,
+                            deployment,
+                            metadata.get("agent_id"),
+                            routing_table.supports_prompt_markers(deployment)
+                        )
+                    return await router.acompletion(
+                        **{**completion_kwargs, "model": deployment, "messages": deployment_messages},
+                        **stream_options(deployment),
+                        stream=True
+                    )
+                
+                model, response, first_chunk = await hedger.stream(
+                    start_stream,
+                    primary=model,
+                    alternates=route["candidates"],
+                    organization_id=organization_id,
+                    reserve_hedge=reserve_hedge,
+                    settle_loser=settle_loser
+                )
+                # O stream continua com a reserva do deployment vencedor
+                reservation = reservations.get(model)
+                chunks = [first_chunk]
+            else:
+                response = await router.acompletion(**completion_kwargs, **stream_options(model), stream=True)
+                chunks = []
+            
+            # Um evento de uso por stream; desconexão do cliente cancela o provider
+            accounting = StreamAccounting(
+                routing_table,
+                request.app.state.analytics,
+                model,
+                metadata,
+                prompt_tokens,
+                reservation,
+                started,
+                upstream=response,
+                first_chunks=chunks
+            )
+            
+            streaming_settings = config.get("streaming_settings") or {}
+            return StreamingResponse(
+                sse_stream(
+                    accounting.stream(),
+                    coalesce_ms=streaming_settings.get("coalesce_ms", 0),
+                    max_coalesce_chars=streaming_settings.get("max_coalesce_chars", 256)
+                ),
+                media_type="text/event-stream",
+                background=BackgroundTask(accounting.close)
+            )
         else:
             response = await request.app.state.router.acompletion(**completion_kwargs)
-            return response.dict()
-            
+            result = response.dict()
+            cost, tokens, _, _ = usage_cost(routing_table, model, result.get("usage"))
+            spend_guard.commit(reservation, cost, tokens)
+            return result
+    
+    except BudgetExceededError as e:
+        logger.warning(f"Spend guard rejected request for {organization_id}: {e}")
+        raise HTTPException(
+            402,
+            str(e),
+            headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
+    except (QueueFullError, QueueDeadlineError) as e:
+        spend_guard.release(reservation)
+        logger.warning(f"Fair queue rejected request for {organization_id}: {e}")
+        raise HTTPException(
+            429,
+            str(e),
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.5)))}
+        )
     except Exception as e:
+        spend_guard.release(reservation)
         logger.error(f"Error in chat completion: {e}")
         raise HTTPException(500, f"Internal server error: {str(e)}")
 
+@app.post("/ai/batches")
+async def create_batch(
+    request: Request,
+    organization_id: str = Depends(get_organization_id)
+):
+    """Cria um job de batch: executado em baixa prioridade, resultados por ID"""
+    
+    if not batch_runner.enabled:
+        raise HTTPException(503, "Batch completions are disabled")
+    
+    body = await request.json()
+    try:
+        return await batch_runner.submit(organization_id, body.get("requests") or [], body.get("metadata"))
+    except BatchValidationError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/ai/batches/{batch_id}")
+async def get_batch(
+    batch_id: str,
+    organization_id: str = Depends(get_organization_id)
+):
+    """Status e contadores do job"""
+    return await owned_batch(batch_id, organization_id)
+
+@app.get("/ai/batches/{batch_id}/results")
+async def get_batch_results(
+    batch_id: str,
+    organization_id: str = Depends(get_organization_id)
+):
+    """Resultados já disponíveis, por custom_id"""
+    job = await owned_batch(batch_id, organization_id)
+    return {**job, "results": await batch_runner.results(batch_id)}
+
+@app.post("/ai/batches/{batch_id}/cancel")
+async def cancel_batch(
+    batch_id: str,
+    organization_id: str = Depends(get_organization_id)
+):
+    """Cancela as requisições ainda não enviadas"""
+    await owned_batch(batch_id, organization_id)
+    return await batch_runner.cancel(batch_id)
+
+@app.post("/embeddings")
+@app.post("/ai/embeddings")
+async def create_embeddings(
+    request: Request,
+    organization_id: str = Depends(get_organization_id)
+):
+    """Embeddings (texto único ou lista) com micro-batching e cache por conteúdo"""
+    
+    body = await request.json()
+    inputs = body.get("input")
+    texts = [inputs] if isinstance(inputs, str) else list(inputs or [])
+    model = body.get("model") or (config.get("embedding_settings") or {}).get("default_model")
+    
+    if not texts or not all(isinstance(t, str) for t in texts):
+        raise HTTPException(400, "input must be a string or a list of strings")
+    if not routing_table.is_available(model):
+        raise HTTPException(400, f"Unknown embedding model: {model}")
+    
+    try:
+        vectors, cached = await request.app.state.embedder.embed(model, texts, organization_id)
+    except Exception as e:
+        logger.error(f"Error in embeddings: {e}")
+        raise HTTPException(500, f"Internal server error: {str(e)}")
+    
+    prompt_tokens = sum(token_counter.count_text(t, model) for t in texts)
+    
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": vector}
+            for i, vector in enumerate(vectors)
+        ],
+        "model": model,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        "cached": cached
+    }
+
 @app.get("/ai/models")
 async def list_models(
     organization_id: str = Depends(get_organization_id)
@@ -318,14 +590,106 @@ async def get_usage(
     
     return usage_data
 
+@app.get("/ai/routing/decisions")
+async def routing_decisions(
+    limit: int = 50,
+    organization_id: str = Depends(get_organization_id)
+):
+    """Estado de saúde dos deployments e decisões recentes de roteamento (debug)"""
+    return {
+        **health_tracker.snapshot(limit=limit),
+        "queues": fair_scheduler.snapshot(),
+        "spend": spend_guard.snapshot(),
+        "connection_pools": provider_pools.snapshot()
+    }
+
 # Funções auxiliares
 
+def prepare_messages(
+    messages: List[Dict],
+    model: str,
+    metadata: Dict,
+    max_tokens: Optional[int] = None
+) -> Tuple[List[Dict], List[Dict], int]:
+    """Ajusta o histórico à janela do modelo e aplica o prefixo de cache (base, mensagens, tokens)"""
+    base_messages = prompt_budgeter.fit_messages(
+        messages,
+        model=model,
+        context_window=get_model_info(model).get("context_window"),
+        reserve_output=max_tokens or get_model_params(model).get("max_tokens", 0)
+    )
+    
+    # System prompt do agente como prefixo estável (cache_control quando suportado)
+    prepared, _ = prompt_cache.prepare(
+        base_messages, model, metadata.get("agent_id"), routing_table.supports_prompt_markers(model)
+    )
+    return base_messages, prepared, token_counter.count_messages(prepared, model)
+
+async def run_batch_request(app: FastAPI, job: Dict, item: Dict) -> Optional[Dict]:
+    """Executa uma requisição de batch pelo router quando o modelo tem capacidade ociosa"""
+    organization_id = job["organization_id"]
+    metadata = {
+        **job["metadata"],
+        **item["metadata"],
+        "organization_id": organization_id,
+        "priority": "batch",
+        "batch_id": job["id"]
+    }
+    plan = metadata.get("plan") or "starter"
+    
+    route = await resolve_route(item["messages"], metadata, app.state.router)
+    model = route["model"]
+    _, messages, prompt_tokens = prepare_messages(item["messages"], model, metadata, item.get("max_tokens"))
+    
+    if not await batch_runner.wait_idle(model, organization_id, plan, prompt_tokens, job["id"]):
+        return None
+    
+    estimated_cost, estimated_tokens = spend_guard.estimate(
+        prompt_tokens,
+        item.get("max_tokens") or get_model_params(model).get("max_tokens"),
+        routing_table.cost_per_token(model)
+    )
+    reservation = await spend_guard.reserve(organization_id, plan, estimated_cost, estimated_tokens)
+    health_tracker.record_request(model)
+    
+    try:
+        response = await app.state.router.acompletion(
+            model=model,
+            messages=messages,
+            metadata=metadata,
+            **{k: item[k] for k in BATCH_REQUEST_PARAMS if k in item}
+        )
+    except Exception:
+        spend_guard.release(reservation)
+        raise
+    
+    result = response.dict()
+    cost, tokens, _, _ = usage_cost(routing_table, model, result.get("usage"))
+    spend_guard.commit(reservation, cost, tokens)
+    return result
+
+async def owned_batch(batch_id: str, organization_id: str) -> Dict:
+    """Job da organização (404 para jobs de outras organizações)"""
+    job = await batch_runner.get(batch_id)
+    if job is None or job["organization_id"] != organization_id:
+        raise HTTPException(404, "Batch not found")
+    return job
+
 async def determine_model(
     messages: List[Dict],
     metadata: Dict,
-    router: Router
+    router: "Router"
 ) -> str:
     """Determina o melhor modelo baseado no contexto"""
+    route = await resolve_route(messages, metadata, router)
+    return route["model"]
+
+async def resolve_route(
+    messages: List[Dict],
+    metadata: Dict,
+    router: "Router"
+) -> Dict:
+    """Resolve modelo, regra e candidatos equivalentes (mesmo tier) para a requisição"""
     
     # Extrair última mensagem
     last_message = messages[-1]["content"] if messages else ""
@@ -339,47 +703,45 @@ async def determine_model(
     # Complexidade estimada
     complexity = estimate_complexity(messages)
     
-    # Aplicar regras de roteamento
-    for rule in config["router_settings"]["model_rules"]:
-        conditions = rule["conditions"]
-        
-        # Verificar condições
-        if "intent" in conditions and intent not in conditions["intent"]:
-            continue
-            
-        if "user_value" in conditions and user_value != conditions["user_value"]:
-            continue
-            
-        if "max_tokens" in conditions and complexity["estimated_tokens"] > conditions["max_tokens"]:
-            continue
-            
-        # Condições atendidas - retornar primeiro modelo disponível
-        for model in rule["preferred_models"]:
-            if is_model_available(model, router):
-                return model
+    # Regra já indexada por intent/user_value; candidatos pré-filtrados pelo model_list
+    table = routing_table
+    
+    # Tier decidido pelo AIRouter da API: o prompt foi montado para a janela desse tier
+    tier = metadata.get("model_tier")
+    tier_models = table.tier_models.get(tier) if tier else None
+    
+    rule = table.match(intent, user_value, complexity["estimated_tokens"])
+    if rule:
+        # Escolher o candidato mais rápido e saudável (do tier pedido, se houver)
+        candidates = list(rule.candidates)
+        if tier_models:
+            candidates = [m for m in candidates if m in tier_models]
+        model = health_tracker.choose(rule.name, candidates)
+        if model:
+            return {"model": model, "rule": rule.name, "candidates": candidates}
+    
+    # Regra sem candidato no tier pedido: modelos do próprio tier
+    if tier_models:
+        candidates = list(tier_models)
+        model = health_tracker.choose(tier, candidates)
+        if model:
+            return {"model": model, "rule": tier, "candidates": candidates}
     
     # Fallback para tier 1
-    return "tier1/llama-3.2-3b"
+    return {
+        "model": table.fallback_model,
+        "rule": None,
+        "candidates": list(table.fallback_candidates)
+    }
 
 def analyze_intent(message: str) -> str:
     """Analisa intent da mensagem (simplificado)"""
-    message_lower = message.lower()
-    
-    if any(word in message_lower for word in ["oi", "olá", "bom dia", "boa tarde", "boa noite"]):
-        return "greeting"
-    elif any(word in message_lower for word in ["preço", "custo", "valor", "quanto custa"]):
-        return "product_query"
-    elif any(word in message_lower for word in ["erro", "problema", "não funciona", "ajuda"]):
-        return "technical_support"
-    elif any(word in message_lower for word in ["comprar", "adquirir", "negociar", "desconto"]):
-        return "sales_negotiation"
-    else:
-        return "general_query"
+    return intent_matcher.match(message)
 
 def estimate_complexity(messages: List[Dict]) -> Dict:
     """Estima complexidade da conversa"""
-    total_chars = sum(len(msg["content"]) for msg in messages)
-    estimated_tokens = total_chars // 4  # Aproximação
+    total_chars = sum(len(msg.get("content") or "") for msg in messages)
+    estimated_tokens = token_counter.count_messages(messages)
     
     return {
         "message_count": len(messages),
@@ -388,9 +750,21 @@ def estimate_complexity(messages: List[Dict]) -> Dict:
         "complexity_score": min(estimated_tokens / 1000, 1.0)
     }
 
-def is_model_available(model: str, router: Router) -> bool:
+def get_model_config(model: str) -> Dict:
+    """Retorna a entrada do model_list para o modelo"""
+    return routing_table.model_config(model)
+
+def get_model_info(model: str) -> Dict:
+    """Retorna model_info do modelo (tier, custo, janela de contexto)"""
+    return routing_table.model_info(model)
+
+def get_model_params(model: str) -> Dict:
+    """Retorna litellm_params do modelo"""
+    return routing_table.params(model)
+
+def is_model_available(model: str, router: "Router") -> bool:
     """Verifica se modelo está disponível"""
-    return any(m["model_name"] == model for m in router.model_list)
+    return routing_table.is_available(model)
 
 async def calculate_usage(
     redis_client,
@@ -410,6 +784,8 @@ async def calculate_usage(
     # Agregar dados
     total_cost = 0
     total_tokens = 0
+    total_cached_tokens = 0
+    total_cache_savings = 0
     model_usage = {}
     
     for key in keys:
@@ -423,18 +799,24 @@ async def calculate_usage(
             
         total_cost += data["cost"]
         total_tokens += data["tokens"].get("total_tokens", 0)
+        total_cached_tokens += data.get("cached_tokens", 0)
+        total_cache_savings += data.get("cache_savings", 0)
         
         model = data["model"]
         if model not in model_usage:
             model_usage[model] = {
                 "requests": 0,
                 "tokens": 0,
-                "cost": 0
+                "cached_tokens": 0,
+                "cost": 0,
+                "cache_savings": 0
             }
         
         model_usage[model]["requests"] += 1
         model_usage[model]["tokens"] += data["tokens"].get("total_tokens", 0)
         model_usage[model]["cost"] += data["cost"]
+        model_usage[model]["cached_tokens"] += data.get("cached_tokens", 0)
+        model_usage[model]["cache_savings"] += data.get("cache_savings", 0)
     
     return {
         "organization_id": organization_id,
@@ -445,6 +827,8 @@ async def calculate_usage(
         "summary": {
             "total_cost": round(total_cost, 4),
             "total_tokens": total_tokens,
+            "cached_tokens": total_cached_tokens,
+            "cache_savings": round(total_cache_savings, 4),
             "total_requests": len(keys)
         },
         "by_model": model_usage
@@ -458,6 +842,7 @@ async def health_check():
         "status": "healthy",
         "service": "litellm-gateway",
         "models_available": len(config["model_list"]),
+        "startup": startup_profile.report(),
         "timestamp": datetime.utcnow().isoformat()
     }
 
@@ -473,16 +858,28 @@ async def metrics():
         media_type="text/plain"
     )
 
-if __name__ == "__main__":
+def serve():
+    """
+    Entry point de produção: sem reload e com o app já importado.
+    
+    LITELLM_RELOAD=1 ativa o reload para desenvolvimento; com LITELLM_WORKERS > 1
+    cada worker importa o app (o uvicorn exige o caminho "main:app").
+    """
     import uvicorn
     
-    # Usar configuração do LiteLLM se disponível
     port = int(os.getenv("LITELLM_PORT", 4000))
+    reload = os.getenv("LITELLM_RELOAD", "").lower() in ("1", "true", "yes")
+    workers = int(os.getenv("LITELLM_WORKERS", 1))
     
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=port,
-        log_level="info",
-        reload=True
-    )
+    options = {
+        "host": "0.0.0.0",
+        "port": port,
+        "log_level": "info",
+    }
+    if reload or workers > 1:
+        uvicorn.run("main:app", reload=reload, workers=None if reload else workers, **options)
+    else:
+        uvicorn.run(app, **options)
+
+if __name__ == "__main__":
+    serve()
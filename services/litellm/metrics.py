@@ -0,0 +1,36 @@
+"""
+Métricas Prometheus das chamadas aos provedores
+Compartilhadas pelo callback do LiteLLM e pela contabilização de streams
+"""
+
+from prometheus_client import Counter, Histogram, Gauge
+
+llm_requests = Counter(
+    'llm_requests_total',
+    'Total LLM requests',
+    ['model', 'tier', 'status']
+)
+
+llm_tokens = Counter(
+    'llm_tokens_total',
+    'Total tokens processed',
+    ['model', 'type']  # type: prompt/completion
+)
+
+llm_latency = Histogram(
+    'llm_request_duration_seconds',
+    'LLM request latency',
+    ['model', 'tier']
+)
+
+llm_cost = Counter(
+    'llm_cost_total',
+    'Total cost in USD',
+    ['model', 'organization']
+)
+
+active_llm_requests = Gauge(
+    'llm_active_requests',
+    'Active LLM requests',
+    ['model']
+)
@@ -0,0 +1,106 @@
+"""
+Callback do LiteLLM para métricas Prometheus, saúde dos deployments e analytics no Redis
+Importado na inicialização do gateway junto com o litellm (import pesado fora do módulo principal)
+"""
+
+from typing import Dict, Optional, Callable
+
+from litellm.integrations.custom_logger import CustomLogger
+
+from metrics import llm_requests, llm_tokens, llm_latency, llm_cost, active_llm_requests
+from model_health import health_tracker, to_seconds
+from fair_queue import fair_scheduler
+from prompt_cache import prompt_cache
+from routing_engine import RoutingTable
+from usage_accounting import AnalyticsWriter, usage_dict, usage_cost, build_usage_record
+
+
+class MetricsLogger(CustomLogger):
+    """
+    Custom Logger para métricas e análise.
+
+    Chamadas com streaming são contabilizadas por StreamAccounting (um evento
+    por stream, inclusive quando o cliente desconecta) e ignoradas aqui.
+    """
+
+    def __init__(self, writer: AnalyticsWriter, routing_table: Callable[[], RoutingTable]):
+        self.writer = writer
+        # Getter: o hot reload troca a tabela sem recriar o logger
+        self.routing_table = routing_table
+        
+    async def log_pre_api_call(self, model, messages, kwargs):
+        """Log antes da chamada"""
+        if kwargs.get("stream"):
+            return
+        active_llm_requests.labels(model=model).inc()
+        
+    async def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        """Log de sucesso com métricas"""
+        if kwargs.get("stream"):
+            return
+        
+        model = deployment_name(kwargs)
+        metadata = kwargs.get("metadata", {})
+        
+        # Extrair tier do nome do modelo
+        tier = model.split("/")[0] if "/" in model else "unknown"
+        
+        # Métricas
+        llm_requests.labels(model=model, tier=tier, status="success").inc()
+        
+        # Tokens
+        usage = usage_dict(response_obj.get("usage"))
+        if usage:
+            llm_tokens.labels(model=model, type="prompt").inc(usage.get("prompt_tokens", 0))
+            llm_tokens.labels(model=model, type="completion").inc(usage.get("completion_tokens", 0))
+            # Prompt já foi reservado na fila; completion entra no orçamento por minuto agora
+            fair_scheduler.record_tokens(
+                metadata.get("organization_id", "unknown"),
+                usage.get("completion_tokens", 0)
+            )
+        
+        # Latência
+        duration = to_seconds(end_time - start_time)
+        llm_latency.labels(model=model, tier=tier).observe(duration)
+        health_tracker.record_success(model, duration)
+        
+        # Custo estimado (descontando tokens servidos do cache de prompt do provider)
+        org_id = metadata.get("organization_id", "unknown")
+        cost, _, cached_tokens, cache_savings = usage_cost(self.routing_table(), model, usage)
+        prompt_cache.record(model, org_id, cached_tokens, cache_savings)
+        if cost > 0:
+            llm_cost.labels(model=model, organization=org_id).inc(cost)
+        
+        # Analytics no Redis (gravado em lote)
+        self.writer.record(
+            build_usage_record(model, metadata, usage, duration, cost, cached_tokens, cache_savings),
+            record_id=response_obj.get("id")
+        )
+        
+        active_llm_requests.labels(model=model).dec()
+        
+    async def log_failure_event(self, kwargs, response_obj, start_time, end_time):
+        """Log de falha"""
+        model = deployment_name(kwargs)
+        tier = model.split("/")[0] if "/" in model else "unknown"
+        
+        llm_requests.labels(model=model, tier=tier, status="failure").inc()
+        health_tracker.record_failure(model, rate_limited=is_rate_limit_error(kwargs.get("exception")))
+        if not kwargs.get("stream"):
+            active_llm_requests.labels(model=model).dec()
+
+
+def deployment_name(kwargs: Dict) -> str:
+    """Nome do deployment (model_name do config) a partir dos kwargs do callback"""
+    metadata = kwargs.get("litellm_params", {}).get("metadata") or kwargs.get("metadata") or {}
+    return metadata.get("model_group") or kwargs.get("model", "unknown")
+
+
+def is_rate_limit_error(exception: Optional[Exception]) -> bool:
+    """Verifica se a falha foi rate limit do provider (429)"""
+    if exception is None:
+        return False
+    return (
+        getattr(exception, "status_code", None) == 429 or
+        "RateLimit" in type(exception).__name__
+    )
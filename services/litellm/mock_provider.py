@@ -0,0 +1,246 @@
+"""
+Provider LLM simulado (API compatível com OpenAI) para testes de carga offline
+TTFT, tokens/s, taxa de erro e comportamento de 429 configuráveis em mock_provider no config.yaml
+
+Uso:
+    python mock_provider.py --config config.yaml --port 4010
+
+Com mock_provider.enabled: true o gateway aponta todos os modelos para api_base.
+"""
+
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "api_base": "http://localhost:4010/v1",
+    "ttft_ms": 300,              # Tempo até o primeiro token
+    "ttft_jitter": 0.3,          # Variação relativa do TTFT
+    "tokens_per_second": 60,     # Velocidade de geração
+    "output_tokens": 120,        # Tokens por resposta (limitado por max_tokens)
+    "error_rate": 0.0,           # Fração de respostas 500
+    "rate_limit_rate": 0.0,      # Fração de respostas 429 aleatórias
+    "rpm": None,                 # Limite de RPM por modelo (429 com Retry-After quando excedido)
+    "embedding_dimensions": 1536,
+    "embedding_latency_ms": 50,
+    "models": {},                # Sobrescritas por model_name
+}
+
+WORDS = (
+    "claro posso ajudar com isso o plano inclui suporte integração whatsapp "
+    "agentes atendimento automático relatórios preço mensal teste gratuito "
+    "equipe comercial próximo passo agendar demonstração obrigado"
+).split()
+
+
+def mock_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    return {**DEFAULT_SETTINGS, **(config.get("mock_provider") or {})}
+
+
+def with_mock_provider(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Aponta todos os deployments para o provider simulado se habilitado.
+
+    O model_name é enviado como modelo para o mock, que aplica as
+    sobrescritas de mock_provider.models por deployment.
+    """
+    settings = mock_settings(config)
+    if not settings["enabled"]:
+        return config
+
+    config = copy.deepcopy(config)
+    for model_config in config.get("model_list", []):
+        params = model_config.setdefault("litellm_params", {})
+        params["model"] = f"openai/{model_config['model_name']}"
+        params["api_base"] = settings["api_base"]
+        params["api_key"] = "sk-mock"
+    return config
+
+
+class MockBehavior:
+    """Parâmetros efetivos e limite de RPM de um modelo simulado"""
+
+    def __init__(self, settings: Dict[str, Any], model: str):
+        self.params = {**settings, **settings["models"].get(model, {})}
+        self._recent: deque = deque()
+
+    def __getitem__(self, key: str) -> Any:
+        return self.params[key]
+
+    def ttft(self) -> float:
+        jitter = self["ttft_jitter"]
+        return max(0.0, self["ttft_ms"] / 1000 * random.uniform(1 - jitter, 1 + jitter))
+
+    def check_rpm(self) -> Optional[float]:
+        """Segundos até liberar se o RPM simulado foi excedido"""
+        rpm = self["rpm"]
+        if not rpm:
+            return None
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now - 60:
+            self._recent.popleft()
+        if len(self._recent) >= rpm:
+            return self._recent[0] + 60 - now
+        self._recent.append(now)
+        return None
+
+
+def create_app(settings: Dict[str, Any]):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI(title="Mock LLM Provider")
+    behaviors: Dict[str, MockBehavior] = {}
+
+    def behavior(model: str) -> MockBehavior:
+        if model not in behaviors:
+            behaviors[model] = MockBehavior(settings, model)
+        return behaviors[model]
+
+    def error_response(b: MockBehavior) -> Optional[JSONResponse]:
+        retry_after = b.check_rpm()
+        if retry_after is not None or random.random() < b["rate_limit_rate"]:
+            return JSONResponse(
+                {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"Retry-After": str(max(1, int(retry_after or 1)))}
+            )
+        if random.random() < b["error_rate"]:
+            return JSONResponse(
+                {"error": {"message": "Internal error (mock)", "type": "server_error"}},
+                status_code=500
+            )
+        return None
+
+    def prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+        return sum(len(str(m.get("content") or "")) for m in messages) // 4 + 3 * len(messages)
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        b = behavior(model)
+
+        error = error_response(b)
+        if error:
+            return error
+
+        n_tokens = min(b["output_tokens"], body.get("max_tokens") or b["output_tokens"])
+        tokens = [random.choice(WORDS) + " " for _ in range(n_tokens)]
+        usage = {
+            "prompt_tokens": prompt_tokens(body.get("messages", [])),
+            "completion_tokens": n_tokens,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + n_tokens
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        interval = 1 / b["tokens_per_second"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(b.ttft() + n_tokens * interval)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def frame(choices: List[Dict[str, Any]], **extra) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        def delta(content: Optional[Dict[str, Any]], finish_reason: Optional[str] = None) -> List[Dict[str, Any]]:
+            return [{"index": 0, "delta": content, "finish_reason": finish_reason}]
+
+        async def generate():
+            await asyncio.sleep(b.ttft())
+            yield frame(delta({"role": "assistant", "content": ""}))
+            for token in tokens:
+                yield frame(delta({"content": token}))
+                await asyncio.sleep(interval)
+            yield frame(delta({}, "stop"))
+            if include_usage:
+                yield frame([], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    @app.post("/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock-embedding")
+        b = behavior(model)
+
+        error = error_response(b)
+        if error:
+            return error
+
+        inputs = body.get("input")
+        texts = [inputs] if isinstance(inputs, str) else inputs
+        dimensions = b["embedding_dimensions"]
+        await asyncio.sleep(b["embedding_latency_ms"] / 1000)
+
+        data = []
+        for i, text in enumerate(texts):
+            # Vetor determinístico por texto
+            rng = random.Random(hashlib.md5(str(text).encode()).digest())
+            data.append({"object": "embedding", "index": i, "embedding": [rng.uniform(-1, 1) for _ in range(dimensions)]})
+
+        tokens = sum(len(str(t)) // 4 for t in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": m, "object": "model"} for m in behaviors]}
+
+    return app
+
+
+def main():
+    import uvicorn
+    import yaml
+
+    parser = argparse.ArgumentParser(description="Provider LLM simulado compatível com OpenAI")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=4010)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        settings = mock_settings(yaml.safe_load(f))
+
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Saúde e latência por deployment para seleção de modelos
+EWMA de TTFT, taxa de erro (com decaimento no tempo) e folga de RPM com histerese entre candidatos
+"""
+
+import os
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def to_seconds(value) -> float:
+    """Normaliza duração (timedelta ou número) para segundos"""
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value or 0)
+
+
+class DeploymentStats:
+    """Estatísticas móveis de um deployment"""
+
+    def __init__(self, name: str, rpm_limit: Optional[int], alpha: float, error_half_life: float):
+        self.name = name
+        self.rpm_limit = rpm_limit
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+
+        self.ewma_ttft: Optional[float] = None
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.error_updated_at = 0.0
+
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited_until = 0.0
+
+        # Janela de 60s para folga de RPM e amostras para percentis de TTFT
+        self._recent_requests: deque = deque()
+        self.ttft_samples: deque = deque(maxlen=200)
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * current
+
+    def record_request(self, now: float):
+        self.requests += 1
+        self._recent_requests.append(now)
+
+    def record_ttft(self, seconds: float):
+        self.ewma_ttft = self._ewma(self.ewma_ttft, seconds)
+        self.ttft_samples.append(seconds)
+
+    def error_rate(self, now: float) -> float:
+        """
+        Taxa de erro decaída pelo tempo sem amostras (meia-vida error_half_life).
+
+        Um deployment fora da seleção não recebe tráfego e, portanto, nenhum
+        sucesso para baixar o EWMA; o decaimento o traz de volta abaixo de
+        max_error_rate e a próxima requisição funciona como sonda.
+        """
+        if not self.ewma_error_rate or self.error_half_life <= 0:
+            return self.ewma_error_rate
+        elapsed = max(0.0, now - self.error_updated_at)
+        return self.ewma_error_rate * 0.5 ** (elapsed / self.error_half_life)
+
+    def _record_error_sample(self, now: float, value: float):
+        self.ewma_error_rate = self._ewma(self.error_rate(now), value)
+        self.error_updated_at = now
+
+    def record_success(self, now: float, latency: float):
+        self.ewma_latency = self._ewma(self.ewma_latency, latency)
+        self._record_error_sample(now, 0.0)
+
+    def record_failure(self, now: float, rate_limited: bool, cooldown: float):
+        self.failures += 1
+        self._record_error_sample(now, 1.0)
+        if rate_limited:
+            self.rate_limited_until = now + cooldown
+
+    def rpm_used(self, now: float) -> int:
+        while self._recent_requests and self._recent_requests[0] < now - 60:
+            self._recent_requests.popleft()
+        return len(self._recent_requests)
+
+    def headroom(self, now: float) -> float:
+        """Fração do RPM ainda disponível no último minuto (1.0 = ociosa)"""
+        if not self.rpm_limit:
+            return 1.0
+        return max(0.0, 1.0 - self.rpm_used(now) / self.rpm_limit)
+
+    def ttft_percentile(self, percentile: float) -> Optional[float]:
+        if not self.ttft_samples:
+            return self.ewma_ttft
+        ordered = sorted(self.ttft_samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile))
+        return ordered[index]
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "ewma_ttft": round(self.ewma_ttft, 4) if self.ewma_ttft is not None else None,
+            "ewma_latency": round(self.ewma_latency, 4) if self.ewma_latency is not None else None,
+            "p95_ttft": self.ttft_percentile(0.95),
+            "error_rate": round(self.error_rate(now), 4),
+            "rpm_used": self.rpm_used(now),
+            "rpm_limit": self.rpm_limit,
+            "headroom": round(self.headroom(now), 4),
+            "rate_limited": now < self.rate_limited_until,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class HealthTracker:
+    """
+    Escolhe o deployment mais rápido e saudável entre candidatos equivalentes.
+
+    A escolha anterior de cada grupo só é trocada quando outro candidato é
+    melhor por uma margem (histerese), evitando oscilação entre provedores.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        switch_margin: float = 0.2,
+        max_error_rate: float = 0.5,
+        min_headroom: float = 0.05,
+        rate_limit_cooldown: float = 30.0,
+        error_half_life: float = 60.0,
+        decision_log_size: int = 200
+    ):
+        self.alpha = alpha
+        self.switch_margin = switch_margin
+        self.max_error_rate = max_error_rate
+        self.min_headroom = min_headroom
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.error_half_life = error_half_life
+
+        self._stats: Dict[str, DeploymentStats] = {}
+        self._rpm_limits: Dict[str, Optional[int]] = {}
+        # Cada worker do gateway só vê o próprio tráfego: folga sobre a sua fração do RPM (como a fila)
+        self.workers = max(1, int(os.getenv("LITELLM_WORKERS", 1)))
+        self._current_choice: Dict[str, str] = {}
+        self.decisions: deque = deque(maxlen=decision_log_size)
+
+    def configure(self, model_list: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None):
+        """Carrega limites de RPM do model_list e parâmetros de router_settings.health_routing"""
+        settings = settings or {}
+        self.alpha = settings.get("ewma_alpha", self.alpha)
+        self.switch_margin = settings.get("switch_margin", self.switch_margin)
+        self.max_error_rate = settings.get("max_error_rate", self.max_error_rate)
+        self.min_headroom = settings.get("min_rpm_headroom", self.min_headroom)
+        self.rate_limit_cooldown = settings.get("rate_limit_cooldown", self.rate_limit_cooldown)
+        self.error_half_life = settings.get("error_half_life", self.error_half_life)
+
+        self._rpm_limits = {}
+        for m in model_list:
+            rpm = m.get("litellm_params", {}).get("rpm")
+            self._rpm_limits[m["model_name"]] = max(1, rpm // self.workers) if rpm else rpm
+        for name, stats in self._stats.items():
+            stats.rpm_limit = self._rpm_limits.get(name)
+            stats.alpha = self.alpha
+            stats.error_half_life = self.error_half_life
+
+    def stats(self, model: str) -> DeploymentStats:
+        if model not in self._stats:
+            self._stats[model] = DeploymentStats(
+                model, self._rpm_limits.get(model), self.alpha, self.error_half_life
+            )
+        return self._stats[model]
+
+    # Registro de eventos
+
+    def record_request(self, model: str):
+        self.stats(model).record_request(time.monotonic())
+
+    def record_ttft(self, model: str, seconds: float):
+        self.stats(model).record_ttft(seconds)
+
+    def record_success(self, model: str, latency: float, ttft: Optional[float] = None):
+        stats = self.stats(model)
+        stats.record_success(time.monotonic(), latency)
+        # TTFT só quando medido (streams); a latência completa fica em ewma_latency
+        if ttft is not None:
+            stats.record_ttft(ttft)
+
+    def record_failure(self, model: str, rate_limited: bool = False):
+        self.stats(model).record_failure(time.monotonic(), rate_limited, self.rate_limit_cooldown)
+
+    # Seleção
+
+    def is_healthy(self, model: str, now: Optional[float] = None) -> bool:
+        now = now or time.monotonic()
+        stats = self.stats(model)
+        return (
+            now >= stats.rate_limited_until and
+            stats.error_rate(now) <= self.max_error_rate and
+            stats.headroom(now) >= self.min_headroom
+        )
+
+    def score(self, model: str, now: float) -> float:
+        """Custo relativo do candidato (menor é melhor)"""
+        stats = self.stats(model)
+        # Sem streams, a latência completa; sem amostras, 0 garante que o candidato seja explorado
+        ttft = stats.ewma_ttft if stats.ewma_ttft is not None else stats.ewma_latency or 0.0
+        # Penaliza erros e deployments perto do limite de RPM
+        return ttft * (1 + 2 * stats.error_rate(now)) * (1 + (1 - stats.headroom(now)))
+
+    def choose(self, group: str, candidates: List[str]) -> Optional[str]:
+        """Seleciona o melhor candidato do grupo e registra a decisão"""
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        healthy = [m for m in candidates if self.is_healthy(m, now)]
+        pool = healthy or candidates
+        scores = {m: self.score(m, now) for m in pool}
+
+        # Em caso de empate mantém a ordem de preferência da regra
+        best = min(pool, key=lambda m: (scores[m], candidates.index(m)))
+        previous = self._current_choice.get(group)
+        reason = "best_score"
+
+        if previous in scores and previous != best:
+            if scores[previous] <= scores[best] * (1 + self.switch_margin):
+                best = previous
+                reason = "hysteresis"
+        elif previous == best:
+            reason = "unchanged"
+
+        if not healthy:
+            reason = "no_healthy_candidate"
+
+        self._current_choice[group] = best
+        self.decisions.append({
+            "timestamp": time.time(),
+            "group": group,
+            "selected": best,
+            "previous": previous,
+            "reason": reason,
+            "scores": {m: round(s, 4) for m, s in scores.items()},
+            "unhealthy": [m for m in candidates if m not in healthy],
+        })
+
+        if previous and previous != best:
+            logger.info(f"Routing group '{group}' switched {previous} -> {best}")
+
+        return best
+
+    def snapshot(self, limit: int = 50) -> Dict[str, Any]:
+        """Estado atual para debug de roteamento"""
+        now = time.monotonic()
+        return {
+            "deployments": {name: s.to_dict(now) for name, s in self._stats.items()},
+            "current_choice": dict(self._current_choice),
+            "recent_decisions": list(self.decisions)[-limit:],
+        }
+
+
+# Singleton
+health_tracker = HealthTracker()
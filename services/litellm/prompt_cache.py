@@ -0,0 +1,178 @@
+"""
+Cache de prefixo de prompt por agente
+Marca o system prompt estável para cache do provider e contabiliza tokens servidos do cache
+"""
+
+import copy
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from prometheus_client import Counter
+
+from token_budget import TokenizerService, model_family, token_counter
+
+logger = logging.getLogger(__name__)
+
+llm_prefix_cache = Counter(
+    'llm_prompt_prefix_cache_total',
+    'Local prompt prefix cache lookups',
+    ['result']  # result: hit/miss
+)
+
+llm_cached_tokens = Counter(
+    'llm_cached_prompt_tokens_total',
+    'Prompt tokens served from the provider prompt cache',
+    ['model']
+)
+
+llm_cache_savings = Counter(
+    'llm_prompt_cache_savings_total',
+    'Estimated savings from provider prompt caching in USD',
+    ['model', 'organization']
+)
+
+# Desconto padrão do token lido do cache, por família (sobrescrito por model_info.cached_token_discount)
+DEFAULT_CACHED_DISCOUNT = {
+    "anthropic": 0.9,
+    "openai": 0.5,
+    "openai-o200k": 0.5,
+}
+
+# Sobrepreço de escrita no cache (Anthropic cobra 25% a mais na criação)
+DEFAULT_WRITE_PREMIUM = {
+    "anthropic": 0.25,
+}
+
+
+def _field(obj: Any, name: str) -> Any:
+    """Lê campo de dict ou objeto de usage do LiteLLM"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+class PromptPrefix:
+    """Prefixo estável já tokenizado e formatado"""
+
+    __slots__ = ("tokens", "message", "marked")
+
+    def __init__(self, tokens: int, message: Dict[str, Any], marked: bool):
+        self.tokens = tokens
+        self.message = message
+        self.marked = marked
+
+
+class PromptPrefixCache:
+    """
+    Reconhece o system prompt do agente como prefixo estável entre turnos.
+
+    O primeiro system message é tokenizado e formatado uma vez por
+    (agente, família de tokenizer). Quando o deployment escolhido tem
+    model_info.supports_prompt_caching o bloco recebe cache_control; nos
+    demais a estabilidade do prefixo basta para o cache automático.
+    """
+
+    def __init__(self, tokenizer: TokenizerService, settings: Optional[Dict[str, Any]] = None):
+        self.tokenizer = tokenizer
+        self._entries: "OrderedDict[Tuple, PromptPrefix]" = OrderedDict()
+        self.configure(settings or {})
+
+    def configure(self, settings: Dict[str, Any]):
+        self.enabled = settings.get("enabled", True)
+        self.provider_markers = settings.get("provider_markers", True)
+        self.min_prefix_tokens = settings.get("min_prefix_tokens", 1024)
+        self.max_entries = settings.get("max_entries", 2048)
+
+    def _lookup(self, key: Tuple, content: str, model: str, marked: bool) -> PromptPrefix:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            llm_prefix_cache.labels(result="hit").inc()
+            return entry
+
+        llm_prefix_cache.labels(result="miss").inc()
+        tokens = self.tokenizer.count_message({"content": content}, model)
+        marked = marked and tokens >= self.min_prefix_tokens
+
+        if marked:
+            message = {
+                "role": "system",
+                "content": [{
+                    "type": "text",
+                    "text": content,
+                    "cache_control": {"type": "ephemeral"},
+                }],
+            }
+        else:
+            message = {"role": "system", "content": content}
+
+        entry = self._entries[key] = PromptPrefix(tokens, message, marked)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def prepare(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        agent_id: Optional[str],
+        supports_markers: bool
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Substitui o prefixo estável pela versão cacheada.
+
+        Retorna (mensagens, tokens do prefixo). Mensagens sem system prompt
+        inicial ou sem agente são devolvidas inalteradas.
+        """
+        if not self.enabled or not agent_id or not messages:
+            return messages, 0
+
+        first = messages[0]
+        content = first.get("content")
+        if first.get("role") != "system" or not isinstance(content, str):
+            return messages, 0
+
+        key = (agent_id, model_family(model), supports_markers and self.provider_markers, hash(content))
+        entry = self._lookup(key, content, model, supports_markers and self.provider_markers)
+
+        # Cópia profunda: o LiteLLM altera a lista content e os cache_control ao converter para o provider
+        return [copy.deepcopy(entry.message)] + messages[1:], entry.tokens
+
+    def savings(self, model: str, usage: Any, model_info: Dict[str, Any]) -> Tuple[int, float]:
+        """
+        Tokens de prompt servidos do cache do provider e economia estimada.
+
+        OpenAI informa prompt_tokens_details.cached_tokens; Anthropic informa
+        cache_read_input_tokens e cache_creation_input_tokens.
+        """
+        if not usage:
+            return 0, 0.0
+
+        cached = max(
+            _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0,
+            _field(usage, "cache_read_input_tokens") or 0
+        )
+        created = _field(usage, "cache_creation_input_tokens") or 0
+        if not cached and not created:
+            return 0, 0.0
+
+        family = model_family(model)
+        cost_per_token = model_info.get("cost_per_token", 0)
+        discount = model_info.get("cached_token_discount", DEFAULT_CACHED_DISCOUNT.get(family, 0.0))
+        premium = model_info.get("cache_write_premium", DEFAULT_WRITE_PREMIUM.get(family, 0.0))
+
+        saved = cost_per_token * (cached * discount - created * premium)
+        return cached, saved
+
+    def record(self, model: str, organization_id: str, cached_tokens: int, saved: float):
+        if cached_tokens:
+            llm_cached_tokens.labels(model=model).inc(cached_tokens)
+        if saved > 0:
+            llm_cache_savings.labels(model=model, organization=organization_id).inc(saved)
+
+
+# Singleton
+prompt_cache = PromptPrefixCache(token_counter)
@@ -0,0 +1,300 @@
+"""
+Pools de conexão HTTP por provider
+Um httpx.AsyncClient por provider, dimensionado pelo RPM dos deployments, pré-aquecido no start
+"""
+
+import asyncio
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+pool_wait = Histogram(
+    'llm_pool_wait_seconds',
+    'Time a provider request waited for a free pooled connection',
+    ['provider'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+pool_connections_opened = Counter(
+    'llm_pool_connections_opened_total',
+    'New TCP connections opened to a provider (keep-alive misses)',
+    ['provider']
+)
+
+pool_size = Gauge(
+    'llm_pool_size',
+    'Maximum connections per provider pool in this worker',
+    ['provider']
+)
+
+DEFAULT_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "together_ai": "https://api.together.xyz/v1",
+    "anthropic": "https://api.anthropic.com",
+    "gemini": "https://generativelanguage.googleapis.com",
+}
+
+# Providers servidos pelo SDK da OpenAI no litellm: o Router aceita o client injetado.
+# Anthropic e Gemini criam o transporte dentro do handler (litellm 1.35) e ficam fora.
+OPENAI_CLIENT_PROVIDERS = {"openai", "together_ai", "groq", "mistral", "deepinfra", "fireworks_ai", "perplexity"}
+
+# Clients injetados no cache do Router não devem expirar (o Router recriaria os seus)
+CLIENT_TTL = 30 * 24 * 3600
+
+
+def provider_of(litellm_params: Dict[str, Any]) -> str:
+    """Provider de um deployment a partir de custom_llm_provider ou do prefixo do modelo"""
+    if litellm_params.get("custom_llm_provider"):
+        return litellm_params["custom_llm_provider"]
+
+    model = litellm_params.get("model", "")
+    if "/" in model:
+        return model.split("/", 1)[0]
+    if model.startswith("claude"):
+        return "anthropic"
+    if model.startswith("gemini"):
+        return "gemini"
+    return "openai"
+
+
+def resolve_secret(value: Optional[str]) -> Optional[str]:
+    """Resolve a notação os.environ/NOME do config"""
+    if isinstance(value, str) and value.startswith("os.environ/"):
+        return os.getenv(value.split("/", 1)[1])
+    return value
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class TimedTransport(httpx.AsyncHTTPTransport):
+    """
+    Transporte que mede a espera por conexão livre no pool.
+
+    Usa os eventos de trace do httpcore: a espera é o tempo até o envio dos
+    headers descontado o tempo de abrir a conexão (TCP + TLS), se houve.
+    """
+
+    def __init__(self, provider: str, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        connect = {"started": None, "seconds": 0.0, "observed": False}
+        previous_trace = request.extensions.get("trace")
+        provider = self.provider
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            now = time.perf_counter()
+            if event_name == "connection.connect_tcp.started":
+                connect["started"] = now
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                if connect["started"] is not None:
+                    connect["seconds"] = now - connect["started"]
+                if event_name == "connection.connect_tcp.complete":
+                    pool_connections_opened.labels(provider=provider).inc()
+            elif event_name.endswith("send_request_headers.started") and not connect["observed"]:
+                connect["observed"] = True
+                pool_wait.labels(provider=provider).observe(max(0.0, now - started - connect["seconds"]))
+
+            if previous_trace is not None:
+                await previous_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        return await super().handle_async_request(request)
+
+
+@dataclass
+class ProviderPool:
+    """Client compartilhado pelos deployments de um provider"""
+    provider: str
+    base_url: str
+    rpm: int
+    size: int
+    http2: bool
+    client: httpx.AsyncClient
+
+    @property
+    def key(self) -> Tuple[str, int, bool]:
+        return self.base_url, self.size, self.http2
+
+
+class ProviderPools:
+    """
+    Pools de conexão por provider.
+
+    O tamanho vem da lei de Little: conexões ocupadas ≈ rpm/60 × latência
+    média, com folga (headroom) e dividido pelo número de workers do
+    processo. Os clients são injetados no Router para os deployments que
+    usam o SDK da OpenAI e aquecidos com requisições HEAD (sem gastar tokens).
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.http2 = True
+        self.expected_latency = 4.0
+        self.headroom = 1.5
+        self.min_connections = 4
+        self.max_connections = 200
+        self.keepalive_expiry = 120.0
+        self.warm_connections = 4
+        self.connect_timeout = 5.0
+        self.retire_after = 120.0
+        self.workers = max(1, int(os.getenv("LITELLM_WORKERS", 1)))
+        self._pools: Dict[str, ProviderPool] = {}
+        self._unmanaged: Dict[str, int] = {}
+
+    def configure(self, model_list: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None):
+        """(Re)cria os pools cujo tamanho, endpoint ou protocolo mudou"""
+        settings = settings or {}
+        self.enabled = settings.get("enabled", True)
+        self.http2 = settings.get("http2", True) and http2_available()
+        self.expected_latency = settings.get("expected_latency_s", 4.0)
+        self.headroom = settings.get("headroom", 1.5)
+        self.min_connections = settings.get("min_connections", 4)
+        self.max_connections = settings.get("max_connections", 200)
+        self.keepalive_expiry = settings.get("keepalive_expiry_s", 120.0)
+        self.warm_connections = settings.get("warm_connections", 4)
+        self.connect_timeout = settings.get("connect_timeout_s", 5.0)
+
+        if settings.get("http2", True) and not self.http2:
+            logger.warning("HTTP/2 requested but h2 is not installed, using HTTP/1.1 pools")
+
+        demand: Dict[str, Dict[str, Any]] = {}
+        self._unmanaged = {}
+        for deployment in model_list if self.enabled else []:
+            params = deployment.get("litellm_params", {})
+            provider = provider_of(params)
+            if provider not in OPENAI_CLIENT_PROVIDERS:
+                self._unmanaged[provider] = self._unmanaged.get(provider, 0) + (params.get("rpm") or 0)
+                continue
+            entry = demand.setdefault(provider, {"rpm": 0, "base_url": None})
+            entry["rpm"] += params.get("rpm") or 0
+            entry["base_url"] = entry["base_url"] or params.get("api_base")
+
+        pools: Dict[str, ProviderPool] = {}
+        for provider, entry in demand.items():
+            base_url = entry["base_url"] or DEFAULT_BASE_URLS.get(provider, DEFAULT_BASE_URLS["openai"])
+            size = self.size_for(entry["rpm"])
+            current = self._pools.get(provider)
+            if current and current.key == (base_url, size, self.http2):
+                current.rpm = entry["rpm"]
+                pools[provider] = current
+                continue
+            pools[provider] = ProviderPool(provider, base_url, entry["rpm"], size, self.http2, self._client(provider, size))
+            pool_size.labels(provider=provider).set(size)
+
+        # Pools substituídos ainda atendem requisições em andamento; fecham depois
+        for provider, pool in self._pools.items():
+            if pools.get(provider) is not pool:
+                asyncio.get_running_loop().call_later(
+                    self.retire_after, lambda client=pool.client: asyncio.ensure_future(client.aclose())
+                )
+                if provider not in pools:
+                    pool_size.labels(provider=provider).set(0)
+
+        self._pools = pools
+
+    def size_for(self, rpm: int) -> int:
+        busy = rpm / 60 * self.expected_latency * self.headroom / self.workers
+        return max(self.min_connections, min(self.max_connections, math.ceil(busy)))
+
+    def _client(self, provider: str, size: int) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        return httpx.AsyncClient(
+            transport=TimedTransport(provider, http2=self.http2, limits=limits),
+            timeout=httpx.Timeout(600.0, connect=self.connect_timeout)
+        )
+
+    def client(self, provider: str) -> Optional[httpx.AsyncClient]:
+        pool = self._pools.get(provider)
+        return pool.client if pool else None
+
+    def install(self, router) -> int:
+        """Substitui os clients criados pelo Router pelos clients dos pools"""
+        if not self._pools:
+            return 0
+
+        import openai
+
+        installed = 0
+        for deployment in router.model_list:
+            params = deployment.get("litellm_params", {})
+            pool = self._pools.get(provider_of(params))
+            model_id = deployment.get("model_info", {}).get("id")
+            if pool is None or model_id is None:
+                continue
+
+            client = openai.AsyncOpenAI(
+                api_key=resolve_secret(params.get("api_key")) or "none",
+                base_url=resolve_secret(params.get("api_base")) or pool.base_url,
+                timeout=params.get("timeout") or 600,
+                max_retries=params.get("max_retries") or 0,
+                http_client=pool.client
+            )
+            for suffix in ("async_client", "stream_async_client"):
+                router.cache.set_cache(key=f"{model_id}_{suffix}", value=client, ttl=CLIENT_TTL, local_only=True)
+            installed += 1
+
+        return installed
+
+    async def warm(self) -> Dict[str, float]:
+        """Abre conexões (DNS, TCP, TLS) antes da primeira requisição"""
+
+        async def open_connection(client: httpx.AsyncClient, url: str):
+            try:
+                await client.head(url, timeout=self.connect_timeout)
+            except httpx.HTTPError as e:
+                logger.debug(f"Warm-up request to {url} failed: {e}")
+
+        async def warm_pool(pool: ProviderPool) -> Tuple[str, float]:
+            started = time.perf_counter()
+            # HTTP/2 multiplexa em uma conexão; HTTP/1.1 abre uma por requisição simultânea
+            count = 1 if pool.http2 else min(pool.size, self.warm_connections)
+            await asyncio.gather(*(open_connection(pool.client, pool.base_url) for _ in range(count)))
+            return pool.provider, time.perf_counter() - started
+
+        results = dict(await asyncio.gather(*(warm_pool(pool) for pool in self._pools.values())))
+        if results:
+            logger.info(
+                "🔌 Pools aquecidos: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in results.items())
+            )
+        return results
+
+    async def close(self):
+        await asyncio.gather(*(pool.client.aclose() for pool in self._pools.values()), return_exceptions=True)
+        self._pools = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "http2": self.http2,
+            "pools": {
+                name: {"base_url": pool.base_url, "rpm": pool.rpm, "max_connections": pool.size}
+                for name, pool in self._pools.items()
+            },
+            # Providers cujo transporte é criado pelo próprio litellm
+            "unmanaged": sorted(self._unmanaged)
+        }
+
+
+# Singleton instance
+provider_pools = ProviderPools()
@@ -0,0 +1,302 @@
+"""
+Motor de roteamento compilado a partir do YAML
+Índices O(1) de metadados por modelo e regras pré-indexadas por intent/user_value
+"""
+
+import asyncio
+import copy
+import os
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+import logging
+
+import yaml
+
+try:
+    # Parser em C (libyaml): ~10x mais rápido que o SafeLoader puro Python
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+logger = logging.getLogger(__name__)
+
+# Palavras-chave por intent, em ordem de prioridade (primeira que casar vence)
+INTENT_KEYWORDS: List[Tuple[str, List[str]]] = [
+    ("greeting", ["oi", "olá", "bom dia", "boa tarde", "boa noite"]),
+    ("product_query", ["preço", "custo", "valor", "quanto custa"]),
+    ("technical_support", ["erro", "problema", "não funciona", "ajuda"]),
+    ("sales_negotiation", ["comprar", "adquirir", "negociar", "desconto"]),
+]
+DEFAULT_INTENT = "general_query"
+
+FALLBACK_MODEL = "tier1/llama-3.2-3b"
+
+# Chave coringa: intent/user_value que nenhuma regra menciona
+ANY = None
+
+
+class IntentMatcher:
+    """
+    Classificador por palavras-chave com tabela pré-compilada.
+
+    Só decide quando a requisição chega sem metadata["intent"] (a API
+    manda o intent do seu classificador); por isso fica no substring
+    simples, sem normalização de acentos nem palavras inteiras.
+    """
+
+    def __init__(self, keywords: List[Tuple[str, List[str]]] = INTENT_KEYWORDS, default: str = DEFAULT_INTENT):
+        self.default = default
+        # Tuplas planas: laço simples com "in" é mais rápido que any() com gerador ou regex
+        self._keywords = tuple((intent, tuple(words)) for intent, words in keywords)
+
+    def match(self, message: str) -> str:
+        if not message:
+            return self.default
+
+        text = message.lower()
+        for intent, words in self._keywords:
+            for word in words:
+                if word in text:
+                    return intent
+        return self.default
+
+
+class CompiledRule:
+    """Regra de roteamento com candidatos já filtrados pelo model_list"""
+
+    __slots__ = ("name", "max_tokens", "candidates")
+
+    def __init__(self, name: str, max_tokens: Optional[int], candidates: Tuple[str, ...]):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.candidates = candidates
+
+
+class RoutingTable:
+    """
+    Config compilado para consultas por requisição sem varrer listas.
+
+    As regras são indexadas por (intent, user_value) preservando a ordem do
+    YAML; valores não mencionados por nenhuma regra caem na chave coringa,
+    que só contém regras sem essa condição.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.models: Dict[str, Dict[str, Any]] = {
+            m["model_name"]: m for m in config.get("model_list", [])
+        }
+        self.model_infos = {name: m.get("model_info", {}) for name, m in self.models.items()}
+        self.model_params = {name: m.get("litellm_params", {}) for name, m in self.models.items()}
+        self.costs = {name: info.get("cost_per_token", 0) for name, info in self.model_infos.items()}
+        self.batch_sizes = {
+            name: info["max_batch_size"] for name, info in self.model_infos.items() if "max_batch_size" in info
+        }
+
+        # Modelos de chat por tier (ordem do YAML), para o tier já decidido pela API
+        self.tier_models: Dict[str, Tuple[str, ...]] = {}
+        for name, info in self.model_infos.items():
+            if info.get("tier") and info.get("mode") != "embedding":
+                tier = f"tier{info['tier']}"
+                self.tier_models[tier] = self.tier_models.get(tier, ()) + (name,)
+
+        fallbacks = config.get("litellm_settings", {}).get("fallbacks", {})
+        self.fallback_model = FALLBACK_MODEL
+        self.fallback_candidates = [FALLBACK_MODEL] + list(fallbacks.get(FALLBACK_MODEL, []))
+
+        # cache_control por deployment escolhido (o LiteLLM remove o marcador ao cair para provider sem suporte)
+        self.prompt_marker_models = frozenset(
+            name for name, info in self.model_infos.items() if info.get("supports_prompt_caching")
+        )
+
+        # stream_options.include_usage: usage real no último chunk em vez da contagem local
+        self.stream_usage_models = frozenset(
+            name for name, info in self.model_infos.items() if info.get("supports_stream_usage")
+        )
+
+        self.rules = self._compile_rules(config.get("router_settings", {}).get("model_rules", []))
+        self._index = self._build_index(config.get("router_settings", {}).get("model_rules", []))
+
+    def _compile_rules(self, rules: List[Dict[str, Any]]) -> List[CompiledRule]:
+        compiled = []
+        for rule in rules:
+            candidates = tuple(m for m in rule.get("preferred_models", []) if m in self.models)
+            if not candidates:
+                # Sem candidato disponível a regra nunca seleciona modelo
+                continue
+            compiled.append(CompiledRule(
+                rule["name"],
+                rule["conditions"].get("max_tokens"),
+                candidates
+            ))
+        return compiled
+
+    def _build_index(self, rules: List[Dict[str, Any]]) -> Dict[Tuple, Tuple[CompiledRule, ...]]:
+        compiled = {rule.name: rule for rule in self.rules}
+        active = [r for r in rules if r["name"] in compiled]
+
+        self.known_intents = frozenset(i for r in active for i in r["conditions"].get("intent", []))
+        self.known_user_values = frozenset(
+            r["conditions"]["user_value"] for r in active if "user_value" in r["conditions"]
+        )
+
+        index = {}
+        for intent in list(self.known_intents) + [ANY]:
+            for user_value in list(self.known_user_values) + [ANY]:
+                index[(intent, user_value)] = tuple(
+                    compiled[r["name"]] for r in active
+                    if ("intent" not in r["conditions"] or intent in r["conditions"]["intent"])
+                    and ("user_value" not in r["conditions"] or r["conditions"]["user_value"] == user_value)
+                )
+        return index
+
+    # Metadados por modelo
+
+    def model_config(self, model: str) -> Dict[str, Any]:
+        return self.models.get(model, {})
+
+    def model_info(self, model: str) -> Dict[str, Any]:
+        return self.model_infos.get(model, {})
+
+    def params(self, model: str) -> Dict[str, Any]:
+        return self.model_params.get(model, {})
+
+    def cost_per_token(self, model: str) -> float:
+        return self.costs.get(model, 0)
+
+    def is_available(self, model: str) -> bool:
+        return model in self.models
+
+    def supports_prompt_markers(self, model: str) -> bool:
+        return model in self.prompt_marker_models
+
+    def supports_stream_usage(self, model: str) -> bool:
+        return model in self.stream_usage_models
+
+    # Regras
+
+    def match(self, intent: str, user_value: Any, estimated_tokens: int) -> Optional[CompiledRule]:
+        """Primeira regra (ordem do YAML) cujas condições a requisição atende"""
+        key = (
+            intent if intent in self.known_intents else ANY,
+            user_value if user_value in self.known_user_values else ANY
+        )
+        for rule in self._index[key]:
+            if rule.max_tokens is None or estimated_tokens <= rule.max_tokens:
+                return rule
+        return None
+
+
+REQUIRED_LITELLM_SETTINGS = ("fallbacks", "context_window_fallbacks", "num_retries", "request_timeout", "retry_after")
+
+
+class ConfigError(ValueError):
+    """Config do gateway inválido"""
+
+
+def validate_config(config: Any) -> Dict[str, Any]:
+    """Valida a estrutura do config antes de qualquer componente usá-lo"""
+    if not isinstance(config, dict):
+        raise ConfigError("config deve ser um mapeamento YAML")
+
+    model_list = config.get("model_list")
+    if not isinstance(model_list, list) or not model_list:
+        raise ConfigError("model_list vazio ou ausente")
+
+    names = set()
+    for i, model in enumerate(model_list):
+        name = model.get("model_name") if isinstance(model, dict) else None
+        if not name:
+            raise ConfigError(f"model_list[{i}] sem model_name")
+        if not (model.get("litellm_params") or {}).get("model"):
+            raise ConfigError(f"{name}: litellm_params.model ausente")
+        if name in names:
+            raise ConfigError(f"{name}: model_name duplicado")
+        names.add(name)
+
+    litellm_settings = config.get("litellm_settings")
+    if not isinstance(litellm_settings, dict):
+        raise ConfigError("litellm_settings ausente")
+    missing = [key for key in REQUIRED_LITELLM_SETTINGS if key not in litellm_settings]
+    if missing:
+        raise ConfigError(f"litellm_settings sem {', '.join(missing)}")
+
+    for model, targets in (litellm_settings["fallbacks"] or {}).items():
+        unknown = [m for m in [model] + list(targets) if m not in names]
+        if unknown:
+            raise ConfigError(f"fallbacks de {model} referenciam modelos inexistentes: {unknown}")
+
+    router_settings = config.get("router_settings")
+    if not isinstance(router_settings, dict):
+        raise ConfigError("router_settings ausente")
+    for rule in router_settings.get("model_rules", []):
+        if not rule.get("name") or not isinstance(rule.get("conditions"), dict):
+            raise ConfigError(f"regra de roteamento sem name/conditions: {rule}")
+        # Modelo desconhecido em preferred_models só desativa o candidato (ver RoutingTable)
+        unknown = [m for m in rule.get("preferred_models", []) if m not in names]
+        if unknown:
+            logger.warning(f"Regra {rule['name']}: modelos inexistentes ignorados {unknown}")
+
+    return config
+
+
+# path -> ((mtime_ns, tamanho), config validado)
+_config_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    """
+    Lê e valida o YAML do gateway.
+
+    O resultado validado é cacheado por (mtime, tamanho) do arquivo; cada
+    chamada devolve uma cópia, já que o Router do LiteLLM altera o model_list.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _config_cache.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, "r") as f:
+            config = validate_config(yaml.load(f, Loader=YamlLoader))
+        cached = _config_cache[path] = (key, config)
+
+    return copy.deepcopy(cached[1])
+
+
+class ConfigWatcher:
+    """Recarrega o config quando o arquivo muda (polling de mtime)"""
+
+    def __init__(
+        self,
+        path: str,
+        interval: float = 5.0,
+        loader: Callable[[str], Dict[str, Any]] = load_config
+    ):
+        self.path = path
+        self.interval = interval
+        self.loader = loader
+        self._mtime = self._current_mtime()
+
+    def _current_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    async def watch(self, on_change: Callable[[RoutingTable], Awaitable[None]]):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            mtime = self._current_mtime()
+            if mtime is None or mtime == self._mtime:
+                continue
+
+            try:
+                # Compilar antes de aplicar: config inválido não derruba o atual
+                table = RoutingTable(self.loader(self.path))
+                await on_change(table)
+                self._mtime = mtime
+                logger.info(f"Config recarregado de {self.path}")
+            except Exception as e:
+                # Evitar repetir o erro a cada ciclo até o arquivo mudar de novo
+                self._mtime = mtime
+                logger.error(f"Config inválido em {self.path}, mantendo o atual: {e}")
@@ -0,0 +1,414 @@
+"""
+Orçamento de custo e tokens por organização no caminho da requisição
+Reserva atômica no Redis (Lua) em leases locais: a checagem por requisição é em memória
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+import logging
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+llm_spend_guard = Counter(
+    'llm_spend_guard_total',
+    'Spend guard decisions',
+    ['result']  # result: allowed/rejected/offline
+)
+
+llm_spend_guard_check = Histogram(
+    'llm_spend_guard_check_seconds',
+    'Time spent reserving budget before the call',
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.025, 0.1)
+)
+
+DEFAULT_BUDGETS = {
+    "free": {"cost": 5.0, "tokens": 1000000},
+    "starter": {"cost": 50.0, "tokens": 10000000},
+    "professional": {"cost": 250.0, "tokens": 50000000},
+    "enterprise": {"cost": 0, "tokens": 0},
+}
+
+# Reserva um lease para esta instância.
+# KEYS: gasto do período, leases do período, orçamento da organização (sobrescrita opcional)
+# ARGV: instância, agora, idade máxima de lease, limite de custo, limite de tokens,
+#       custo pedido, tokens pedidos, TTL das chaves
+RESERVE_SCRIPT = """
+local instance = ARGV[1]
+local now = tonumber(ARGV[2])
+local stale_before = now - tonumber(ARGV[3])
+local cost_limit = tonumber(redis.call('HGET', KEYS[3], 'cost') or ARGV[4])
+local token_limit = tonumber(redis.call('HGET', KEYS[3], 'tokens') or ARGV[5])
+local want_cost = tonumber(ARGV[6])
+local want_tokens = tonumber(ARGV[7])
+local ttl = tonumber(ARGV[8])
+
+local spent_cost = tonumber(redis.call('HGET', KEYS[1], 'cost') or '0')
+local spent_tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or '0')
+
+local leased_cost, leased_tokens = 0, 0
+local own_cost, own_tokens = 0, 0
+local leases = redis.call('HGETALL', KEYS[2])
+for i = 1, #leases, 2 do
+  local c, t, ts = string.match(leases[i + 1], '([^:]+):([^:]+):([^:]+)')
+  c, t, ts = tonumber(c), tonumber(t), tonumber(ts)
+  if leases[i] == instance then
+    own_cost, own_tokens = c, t
+  elseif ts < stale_before then
+    redis.call('HDEL', KEYS[2], leases[i])
+  else
+    leased_cost = leased_cost + c
+    leased_tokens = leased_tokens + t
+  end
+end
+
+local grant_cost, grant_tokens = want_cost, want_tokens
+if cost_limit > 0 then
+  grant_cost = math.max(0, math.min(want_cost, cost_limit - spent_cost - leased_cost - own_cost))
+end
+if token_limit > 0 then
+  grant_tokens = math.max(0, math.min(want_tokens, token_limit - spent_tokens - leased_tokens - own_tokens))
+end
+if (cost_limit > 0 and grant_cost <= 0) or (token_limit > 0 and grant_tokens <= 0) then
+  grant_cost, grant_tokens = 0, 0
+end
+
+redis.call('HSET', KEYS[2], instance, (own_cost + grant_cost) .. ':' .. (own_tokens + grant_tokens) .. ':' .. now)
+redis.call('EXPIRE', KEYS[2], ttl)
+return {tostring(grant_cost), tostring(grant_tokens), tostring(cost_limit), tostring(token_limit),
+        tostring(spent_cost), tostring(spent_tokens)}
+"""
+
+# Converte uso real em gasto e devolve o que sobrou do lease.
+# KEYS: gasto do período, leases do período
+# ARGV: instância, agora, custo usado, tokens usados, TTL, "1" para encerrar o lease
+COMMIT_SCRIPT = """
+local instance = ARGV[1]
+local used_cost = tonumber(ARGV[3])
+local used_tokens = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+
+if used_cost > 0 then redis.call('HINCRBYFLOAT', KEYS[1], 'cost', ARGV[3]) end
+if used_tokens > 0 then redis.call('HINCRBY', KEYS[1], 'tokens', used_tokens) end
+redis.call('EXPIRE', KEYS[1], ttl)
+
+if ARGV[6] == '1' then
+  redis.call('HDEL', KEYS[2], instance)
+else
+  local own_cost, own_tokens = 0, 0
+  local lease = redis.call('HGET', KEYS[2], instance)
+  if lease then
+    local c, t = string.match(lease, '([^:]+):([^:]+):')
+    own_cost, own_tokens = tonumber(c), tonumber(t)
+  end
+  redis.call('HSET', KEYS[2], instance,
+    math.max(0, own_cost - used_cost) .. ':' .. math.max(0, own_tokens - used_tokens) .. ':' .. ARGV[2])
+  redis.call('EXPIRE', KEYS[2], ttl)
+end
+return 1
+"""
+
+
+class BudgetExceededError(Exception):
+    """Orçamento do período da organização esgotado"""
+
+    def __init__(self, message: str, retry_after: float = 3600.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Lease:
+    """Parte do orçamento da organização reservada para esta instância"""
+
+    __slots__ = (
+        "organization_id", "period", "plan",
+        "granted_cost", "granted_tokens", "reserved_cost", "reserved_tokens",
+        "unflushed_cost", "unflushed_tokens", "limit_cost", "limit_tokens",
+        "synced_at", "used_at", "offline_grants", "lock"
+    )
+
+    def __init__(self, organization_id: str, period: str, plan: str, limits: Dict[str, float]):
+        self.organization_id = organization_id
+        self.period = period
+        self.plan = plan
+        self.granted_cost = 0.0
+        self.granted_tokens = 0
+        self.reserved_cost = 0.0       # Estimativas de chamadas em andamento
+        self.reserved_tokens = 0
+        self.unflushed_cost = 0.0      # Uso real ainda não gravado no Redis
+        self.unflushed_tokens = 0
+        self.limit_cost = float(limits.get("cost") or 0)
+        self.limit_tokens = int(limits.get("tokens") or 0)
+        self.synced_at = 0.0
+        self.used_at = time.monotonic()
+        self.offline_grants = 0
+        self.lock = asyncio.Lock()
+
+    def fits(self, cost: float, tokens: int) -> bool:
+        cost_ok = not self.limit_cost or (
+            self.granted_cost - self.reserved_cost - self.unflushed_cost >= cost
+        )
+        tokens_ok = not self.limit_tokens or (
+            self.granted_tokens - self.reserved_tokens - self.unflushed_tokens >= tokens
+        )
+        return cost_ok and tokens_ok
+
+    @property
+    def idle(self) -> bool:
+        return not self.reserved_cost and not self.reserved_tokens
+
+
+class Reservation:
+    """Estimativa reservada para uma chamada; liquidada com o uso real"""
+
+    __slots__ = ("lease", "cost", "tokens", "settled")
+
+    def __init__(self, lease: Lease, cost: float, tokens: int):
+        self.lease = lease
+        self.cost = cost
+        self.tokens = tokens
+        self.settled = False
+
+
+class SpendGuard:
+    """
+    Orçamento de custo (USD) e tokens por organização e período.
+
+    Cada instância reserva do Redis um lease (lease_fraction do orçamento)
+    por organização; as requisições reservam a estimativa desse lease em
+    memória e liquidam com o uso real ao final. O uso é gravado no Redis em
+    lote a cada flush_interval_ms. Leases sem heartbeat por 3x lease_ttl são
+    descartados pelas outras instâncias (instância que caiu não prende orçamento).
+
+    Com o Redis fora, a organização recebe um lease provisório
+    (offline_lease_fraction) e o uso é gravado quando o Redis voltar.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.redis = None
+        self._leases: Dict[Tuple[str, str], Lease] = {}
+        self._reserve_script = None
+        self._commit_script = None
+        self.configure(settings or {})
+
+    def configure(self, settings: Dict[str, Any], redis_client=None):
+        self.enabled = settings.get("enabled", True)
+        self.period = settings.get("period", "month")
+        self.budgets = {**DEFAULT_BUDGETS, **(settings.get("budgets") or {})}
+        self.lease_fraction = settings.get("lease_fraction", 0.01)
+        self.offline_lease_fraction = settings.get("offline_lease_fraction", 0.005)
+        self.lease_ttl = settings.get("lease_ttl_seconds", 60)
+        self.flush_interval = settings.get("flush_interval_ms", 1000) / 1000
+        self.redis_timeout = settings.get("redis_timeout_ms", 50) / 1000
+        self.default_output_tokens = settings.get("default_output_tokens", 512)
+
+        if redis_client is not None:
+            self.redis = redis_client
+            self._reserve_script = redis_client.register_script(RESERVE_SCRIPT)
+            self._commit_script = redis_client.register_script(COMMIT_SCRIPT)
+
+    # Período
+
+    def _period(self, now: datetime) -> Tuple[str, datetime]:
+        """Identificador do período atual e início do próximo"""
+        if self.period == "day":
+            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            return now.strftime("%Y%m%d"), start + timedelta(days=1)
+
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return now.strftime("%Y%m"), (start + timedelta(days=32)).replace(day=1)
+
+    def _keys(self, organization_id: str, period: str):
+        return [
+            f"spend:{organization_id}:{period}",
+            f"spend_leases:{organization_id}:{period}",
+            f"spend_budget:{organization_id}",
+        ]
+
+    def _key_ttl(self) -> int:
+        return (2 if self.period == "day" else 35) * 24 * 3600
+
+    # Caminho da requisição
+
+    def estimate(self, prompt_tokens: int, max_tokens: Optional[int], cost_per_token: float) -> Tuple[float, int]:
+        """Pior caso da chamada: prompt + max_tokens de saída"""
+        tokens = prompt_tokens + (max_tokens or self.default_output_tokens)
+        return tokens * cost_per_token, tokens
+
+    async def reserve(self, organization_id: str, plan: str, cost: float, tokens: int) -> Optional[Reservation]:
+        """Reserva a estimativa da chamada ou levanta BudgetExceededError"""
+        if not self.enabled:
+            return None
+
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        period, period_end = self._period(now)
+        key = (organization_id, period)
+
+        lease = self._leases.get(key)
+        if lease is None:
+            limits = self.budgets.get(plan) or self.budgets["starter"]
+            lease = self._leases[key] = Lease(organization_id, period, plan, limits)
+
+        if not lease.fits(cost, tokens):
+            # Uma renovação por organização por vez; as demais reaproveitam o resultado
+            async with lease.lock:
+                if not lease.fits(cost, tokens):
+                    await self._renew(lease, cost, tokens)
+
+        if not lease.fits(cost, tokens):
+            llm_spend_guard.labels(result="rejected").inc()
+            raise BudgetExceededError(
+                f"Budget exceeded for organization {organization_id} in period {period}",
+                retry_after=(period_end - now).total_seconds()
+            )
+
+        lease.reserved_cost += cost
+        lease.reserved_tokens += tokens
+        lease.used_at = time.monotonic()
+
+        llm_spend_guard_check.observe(time.perf_counter() - start)
+        llm_spend_guard.labels(result="allowed").inc()
+        return Reservation(lease, cost, tokens)
+
+    def commit(self, reservation: Optional[Reservation], cost: float, tokens: int):
+        """Liquida a reserva com o uso real (gravado no Redis no próximo flush)"""
+        if reservation is None or reservation.settled:
+            return
+        reservation.settled = True
+        lease = reservation.lease
+        lease.reserved_cost = max(0.0, lease.reserved_cost - reservation.cost)
+        lease.reserved_tokens = max(0, lease.reserved_tokens - reservation.tokens)
+        lease.unflushed_cost += cost
+        lease.unflushed_tokens += tokens
+
+    def release(self, reservation: Optional[Reservation]):
+        """Devolve a reserva de uma chamada que falhou antes de consumir tokens"""
+        self.commit(reservation, 0.0, 0)
+
+    async def _renew(self, lease: Lease, cost: float, tokens: int):
+        want_cost = max(cost, lease.limit_cost * self.lease_fraction)
+        want_tokens = max(tokens, int(lease.limit_tokens * self.lease_fraction))
+        limits = self.budgets.get(lease.plan) or self.budgets["starter"]
+
+        try:
+            if self._reserve_script is None:
+                raise ConnectionError("Redis not configured")
+            result = await asyncio.wait_for(
+                self._reserve_script(
+                    keys=self._keys(lease.organization_id, lease.period),
+                    args=[
+                        self.instance_id, int(time.time()), self.lease_ttl * 3,
+                        limits.get("cost") or 0, limits.get("tokens") or 0,
+                        want_cost, want_tokens, self._key_ttl()
+                    ]
+                ),
+                self.redis_timeout
+            )
+        except Exception as e:
+            self._grant_offline(lease, cost, tokens, e)
+            return
+
+        granted_cost, granted_tokens, limit_cost, limit_tokens = (float(v) for v in result[:4])
+        lease.granted_cost += granted_cost
+        lease.granted_tokens += int(granted_tokens)
+        lease.limit_cost = limit_cost
+        lease.limit_tokens = int(limit_tokens)
+        lease.synced_at = time.monotonic()
+        lease.offline_grants = 0
+
+    def _grant_offline(self, lease: Lease, cost: float, tokens: int, error: Exception):
+        """Redis indisponível: um lease provisório por organização até a próxima sincronização"""
+        if lease.offline_grants:
+            return
+        lease.offline_grants += 1
+        lease.granted_cost += max(cost, lease.limit_cost * self.offline_lease_fraction)
+        lease.granted_tokens += max(tokens, int(lease.limit_tokens * self.offline_lease_fraction))
+        llm_spend_guard.labels(result="offline").inc()
+        logger.warning(f"Spend guard offline for {lease.organization_id}, provisional lease: {error}")
+
+    # Sincronização em background
+
+    async def run(self):
+        """Grava o uso no Redis em lote e libera leases ociosos"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing spend: {e}")
+
+    async def flush(self, release_all: bool = False):
+        if self._commit_script is None:
+            return
+
+        now = time.monotonic()
+        current_period, _ = self._period(datetime.utcnow())
+
+        for key, lease in list(self._leases.items()):
+            stale = lease.period != current_period or now - lease.used_at > self.lease_ttl
+            release = (release_all or stale) and lease.idle
+            heartbeat = now - lease.synced_at > self.lease_ttl / 3
+            if not (lease.unflushed_cost or lease.unflushed_tokens or release or heartbeat):
+                continue
+
+            cost, tokens = lease.unflushed_cost, lease.unflushed_tokens
+            try:
+                await asyncio.wait_for(
+                    self._commit_script(
+                        keys=self._keys(lease.organization_id, lease.period)[:2],
+                        args=[
+                            self.instance_id, int(time.time()), cost, tokens,
+                            self._key_ttl(), "1" if release else "0"
+                        ]
+                    ),
+                    self.redis_timeout * 4
+                )
+            except Exception as e:
+                logger.warning(f"Spend flush failed for {lease.organization_id}, retrying: {e}")
+                continue
+
+            lease.unflushed_cost -= cost
+            lease.unflushed_tokens -= tokens
+            lease.granted_cost = max(0.0, lease.granted_cost - cost)
+            lease.granted_tokens = max(0, lease.granted_tokens - tokens)
+            if lease.offline_grants:
+                # Lease provisório não existe no Redis: a próxima requisição renova de verdade
+                lease.granted_cost = lease.reserved_cost
+                lease.granted_tokens = lease.reserved_tokens
+                lease.offline_grants = 0
+            lease.synced_at = now
+            if release:
+                self._leases.pop(key, None)
+
+    async def close(self):
+        """Grava o uso pendente e devolve os leases (shutdown)"""
+        try:
+            await self.flush(release_all=True)
+        except Exception as e:
+            logger.error(f"Error releasing spend leases: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            f"{lease.organization_id}:{lease.period}": {
+                "limit_cost": lease.limit_cost,
+                "limit_tokens": lease.limit_tokens,
+                "lease_cost": round(lease.granted_cost, 6),
+                "lease_tokens": lease.granted_tokens,
+                "reserved_cost": round(lease.reserved_cost, 6),
+                "unflushed_cost": round(lease.unflushed_cost, 6),
+                "offline": bool(lease.offline_grants),
+            }
+            for lease in self._leases.values()
+        }
+
+
+# Singleton
+spend_guard = SpendGuard()
@@ -0,0 +1,225 @@
+"""
+Codificação SSE de baixo custo para streaming de completions
+Envelope do chunk pré-serializado por stream; só o texto do token é codificado a cada frame
+"""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import logging
+
+try:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+except ImportError:  # pragma: no cover - orjson é opcional
+    import json
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+logger = logging.getLogger(__name__)
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+# Marcador que substitui o conteúdo ao gerar o template do envelope
+_SENTINEL = "\x00sse-content\x00"
+
+
+def _to_dict(chunk: Any) -> Dict[str, Any]:
+    if isinstance(chunk, dict):
+        return chunk
+    return chunk.dict()
+
+
+# Campos que podem variar entre chunks de texto sem invalidar o template
+_DELTA_TEXT_FIELDS = frozenset(("role", "content"))
+_CHOICE_TEXT_FIELDS = frozenset(("index", "delta", "finish_reason"))
+
+
+def _fields(obj: Any) -> Dict[str, Any]:
+    """Campos do objeto do stream (inclui extras do pydantic)"""
+    fields = getattr(obj, "__dict__", None) or {}
+    extra = getattr(obj, "__pydantic_extra__", None)
+    return {**fields, **extra} if extra else fields
+
+
+def _content_delta(chunk: Any) -> Optional[Tuple[Any, str, Tuple]]:
+    """
+    Retorna (role, texto, chave do envelope) se o chunk é só um pedaço de texto.
+
+    A chave reúne todos os campos do chunk fora de choices (id, model,
+    created, system_fingerprint, ...): o template só é reutilizado quando
+    ela é igual. Chunks com finish_reason, logprobs, tool calls, várias
+    choices, usage ou qualquer outro campo além de role/content no delta
+    seguem pelo caminho completo.
+    """
+    if isinstance(chunk, dict) or getattr(chunk, "usage", None):
+        return None
+
+    choices = chunk.choices
+    if len(choices) != 1:
+        return None
+
+    choice = choices[0]
+    if choice.finish_reason is not None:
+        return None
+    if any(v is not None for k, v in _fields(choice).items() if k not in _CHOICE_TEXT_FIELDS):
+        return None
+
+    delta = choice.delta
+    content = delta.content
+    if content is None:
+        return None
+    if any(v is not None for k, v in _fields(delta).items() if k not in _DELTA_TEXT_FIELDS):
+        return None
+
+    envelope = [choice.index]
+    for name, value in _fields(chunk).items():
+        if name == "choices" or value is None:
+            continue
+        if not isinstance(value, (str, int, float, bool)):
+            return None
+        envelope.append((name, value))
+
+    return delta.role, content, tuple(envelope)
+
+
+class SSEEncoder:
+    """
+    Serializa chunks de um stream em frames SSE (bytes).
+
+    O primeiro chunk de texto gera um template (prefixo/sufixo já em JSON);
+    os seguintes só codificam o conteúdo do token. O template é refeito se
+    role ou qualquer campo do envelope mudar (id, modelo, created,
+    system_fingerprint; ex: vencedor de hedge).
+    """
+
+    def __init__(self):
+        self._key: Optional[Tuple] = None
+        self._prefix = b""
+        self._suffix = b""
+
+    def _build_template(self, chunk: Any, key: Tuple):
+        data = _to_dict(chunk)
+        data["choices"][0]["delta"]["content"] = _SENTINEL
+        encoded = dumps(data)
+        marker = dumps(_SENTINEL)
+        prefix, _, suffix = encoded.partition(marker)
+
+        self._key = key
+        self._prefix = b"data: " + prefix
+        self._suffix = suffix + b"\n\n"
+
+    def encode(self, chunk: Any) -> bytes:
+        """Frame SSE de um chunk"""
+        delta = _content_delta(chunk)
+        if delta is None:
+            return self.encode_full(chunk)
+
+        role, content, envelope = delta
+        return self.encode_text(chunk, role, content, envelope)
+
+    def encode_text(self, chunk: Any, role: Any, content: str, envelope: Tuple) -> bytes:
+        """Frame SSE com o envelope de chunk e o texto informado"""
+        key = (role, envelope)
+        if key != self._key:
+            self._build_template(chunk, key)
+        return self._prefix + dumps(content) + self._suffix
+
+    def encode_full(self, chunk: Any) -> bytes:
+        return b"data: " + dumps(_to_dict(chunk)) + b"\n\n"
+
+
+async def sse_stream(
+    chunks: AsyncIterator[Any],
+    coalesce_ms: float = 0,
+    max_coalesce_chars: int = 256
+) -> AsyncIterator[bytes]:
+    """
+    Converte um stream de chunks em frames SSE.
+
+    Com coalesce_ms > 0, tokens que chegam dentro da janela são enviados em
+    um único frame (menos writes e menos JSON por token), limitado a
+    max_coalesce_chars.
+    """
+    encoder = SSEEncoder()
+
+    if coalesce_ms <= 0:
+        async for chunk in chunks:
+            yield encoder.encode(chunk)
+        yield DONE_FRAME
+        return
+
+    window = coalesce_ms / 1000
+    iterator = chunks.__aiter__()
+    pending: Optional[asyncio.Future] = None
+
+    # Pedaços de texto acumulados: último chunk (envelope), role e partes
+    buffered_chunk = None
+    buffered_role = None
+    buffered_envelope = None
+    parts = []
+    size = 0
+    deadline = 0.0
+
+    def flush() -> bytes:
+        nonlocal buffered_chunk, parts, size
+        frame = encoder.encode_text(buffered_chunk, buffered_role, "".join(parts), buffered_envelope)
+        buffered_chunk, parts, size = None, [], 0
+        return frame
+
+    try:
+        while True:
+            if pending is None:
+                # Task separada: cancelar __anext__ no timeout encerraria o stream do provider
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            if buffered_chunk is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    yield flush()
+                    continue
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield flush()
+                    continue
+
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+
+            delta = _content_delta(chunk)
+
+            if delta is None:
+                if buffered_chunk is not None:
+                    yield flush()
+                yield encoder.encode_full(chunk)
+                continue
+
+            role, content, envelope = delta
+            if buffered_chunk is not None and (role != buffered_role or envelope != buffered_envelope):
+                yield flush()
+
+            if buffered_chunk is None:
+                deadline = time.monotonic() + window
+                buffered_role = role
+                buffered_envelope = envelope
+
+            buffered_chunk = chunk
+            parts.append(content)
+            size += len(content)
+
+            if size >= max_coalesce_chars:
+                yield flush()
+
+        if buffered_chunk is not None:
+            yield flush()
+        yield DONE_FRAME
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
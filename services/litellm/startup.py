@@ -0,0 +1,65 @@
+"""
+Perfil de inicialização do gateway
+Tempo de cada fase desde o início do processo até estar pronto para a primeira requisição
+"""
+
+import time
+from typing import Dict, Any, List, Tuple, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def process_start_time() -> Optional[float]:
+    """Início do processo (epoch), incluindo a inicialização do interpretador"""
+    try:
+        import psutil
+        return psutil.Process().create_time()
+    except Exception:
+        return None
+
+
+class StartupProfile:
+    """
+    Marcos sequenciais da inicialização.
+
+    Cada mark(fase) registra o tempo desde o marco anterior; a primeira fase
+    ("interpreter") vai do início do processo até a importação deste módulo.
+    """
+
+    def __init__(self):
+        self._wall = time.time()
+        self._last = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.total: Optional[float] = None
+
+        started = process_start_time()
+        self._origin = started if started is not None else self._wall
+        if started is not None:
+            self.phases.append(("interpreter", max(0.0, self._wall - started)))
+
+    def mark(self, phase: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.phases.append((phase, elapsed))
+        return elapsed
+
+    def ready(self) -> float:
+        """Fecha o perfil: tempo total até o serviço aceitar requisições"""
+        self.total = time.time() - self._origin
+        logger.info(
+            f"⏱️ Inicialização em {self.total:.2f}s: "
+            + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        )
+        return self.total
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "total_seconds": round(self.total, 4) if self.total is not None else None,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases},
+        }
+
+
+# Singleton (criado na primeira importação, antes dos imports pesados)
+startup_profile = StartupProfile()
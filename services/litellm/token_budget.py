@@ -0,0 +1,175 @@
+"""
+Contagem de tokens e orçamento de prompt por janela de contexto
+Tokenizers carregados sob demanda e cacheados por família de modelo
+Cópia canônica da contagem de tokens; a API repete o bloco (services/api/app/services/token_budget.py)
+"""
+
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- Contagem de tokens (início) ---
+# Cópia canônica em services/litellm/token_budget.py; services/api/app/services/token_budget.py
+# repete este bloco sem alteração (scripts/check_token_budget_sync.py confere).
+
+# Overhead de formatação por mensagem (role, separadores) e para o "priming" da resposta
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Encoding tiktoken usado por família (None = só heurística)
+FAMILY_ENCODINGS = {
+    "openai": "cl100k_base",
+    "openai-o200k": "o200k_base",
+    "anthropic": "cl100k_base",
+    "gemini": "cl100k_base",
+    "llama": "cl100k_base",
+    "default": "cl100k_base",
+}
+
+# Correção aproximada do cl100k para famílias sem tokenizer público
+FAMILY_RATIOS = {
+    "openai": 1.0,
+    "openai-o200k": 1.0,
+    "anthropic": 1.1,
+    "gemini": 0.95,
+    "llama": 1.05,
+    "default": 1.0,
+}
+
+# Heurística rápida (caracteres por token) quando tiktoken não está disponível
+CHARS_PER_TOKEN = 3.6
+
+
+def model_family(model: Optional[str]) -> str:
+    """Resolve a família de tokenizer a partir do nome do modelo/deployment"""
+    if not model:
+        return "default"
+
+    name = model.lower()
+
+    if "gpt-4o" in name or name.split("/")[-1].startswith("o1"):
+        return "openai-o200k"
+    if "gpt" in name or "text-embedding" in name:
+        return "openai"
+    if "claude" in name or "anthropic" in name:
+        return "anthropic"
+    if "gemini" in name:
+        return "gemini"
+    if "llama" in name:
+        return "llama"
+    return "default"
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(encoding_name: str):
+    """Carrega encoding tiktoken uma única vez por processo"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Tokenizer {encoding_name} indisponível, usando heurística: {e}")
+        return None
+
+
+@lru_cache(maxsize=8192)
+def _count_tokens(family: str, text: str, heuristic_only: bool) -> int:
+    # Histórico é recontado a cada turno; o cache evita re-tokenizar as mesmas mensagens
+    encoding = None if heuristic_only else _load_encoding(
+        FAMILY_ENCODINGS.get(family, FAMILY_ENCODINGS["default"])
+    )
+
+    if encoding is None:
+        return max(1, int(len(text) / CHARS_PER_TOKEN + 0.5))
+
+    tokens = len(encoding.encode(text, disallowed_special=()))
+    return int(tokens * FAMILY_RATIOS.get(family, 1.0) + 0.5)
+
+
+class TokenizerService:
+    """Contador de tokens com tokenizers lazy por família e fallback heurístico"""
+
+    def __init__(self, use_heuristic_only: bool = False):
+        self.use_heuristic_only = use_heuristic_only
+
+    def count_text(self, text: str, model: Optional[str] = None) -> int:
+        """Conta tokens de um texto para o modelo informado"""
+        if not text:
+            return 0
+        return _count_tokens(model_family(model), text, self.use_heuristic_only)
+
+    def count_message(self, message: Dict[str, Any], model: Optional[str] = None) -> int:
+        """Conta tokens de uma mensagem incluindo overhead de formatação"""
+        content = message.get("content") or ""
+
+        # Conteúdo multimodal / blocos (ex: cache_control da Anthropic)
+        if isinstance(content, list):
+            content = "".join(
+                part.get("text", "") for part in content if isinstance(part, dict)
+            )
+
+        return TOKENS_PER_MESSAGE + self.count_text(content, model)
+
+    def count_messages(self, messages: List[Dict[str, Any]], model: Optional[str] = None) -> int:
+        """Conta tokens de uma lista de mensagens no formato chat"""
+        if not messages:
+            return 0
+        return sum(self.count_message(m, model) for m in messages) + TOKENS_PER_REPLY
+
+# --- Contagem de tokens (fim) ---
+
+
+class PromptBudgeter:
+    """Ajusta mensagens para caber na janela de contexto do modelo escolhido"""
+
+    def __init__(self, tokenizer: Optional[TokenizerService] = None):
+        self.tokenizer = tokenizer or token_counter
+
+    def fit_messages(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        context_window: Optional[int],
+        reserve_output: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        Remove o histórico mais antigo até o prompt caber na janela.
+
+        Mensagens de sistema iniciais e a última mensagem nunca são removidas.
+        """
+        if not context_window or not messages:
+            return messages
+
+        budget = context_window - reserve_output - TOKENS_PER_REPLY
+        counts = [self.tokenizer.count_message(m, model) for m in messages]
+        total = sum(counts)
+
+        if total <= budget:
+            return messages
+
+        # Separar prefixo de sistema, histórico e mensagem atual
+        head = 0
+        while head < len(messages) - 1 and messages[head].get("role") == "system":
+            head += 1
+
+        keep = [True] * len(messages)
+
+        for i in range(head, len(messages) - 1):
+            if total <= budget:
+                break
+            keep[i] = False
+            total -= counts[i]
+
+        if total > budget:
+            logger.warning(
+                f"Prompt excede janela de {model} mesmo sem histórico "
+                f"({total} > {budget} tokens)"
+            )
+
+        return [m for m, k in zip(messages, keep) if k]
+
+
+# Singletons
+token_counter = TokenizerService()
+prompt_budgeter = PromptBudgeter(token_counter)
@@ -0,0 +1,306 @@
+"""
+Contabilização de uso: custo por chamada, streams SSE e gravação de analytics em lote
+Cada chamada (com ou sem streaming) gera exatamente um registro de uso
+"""
+
+import asyncio
+import inspect
+import json
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+import logging
+
+from prometheus_client import Counter, Histogram
+
+from metrics import llm_requests, llm_tokens, llm_latency, llm_cost, active_llm_requests
+from model_health import health_tracker
+from fair_queue import fair_scheduler
+from prompt_cache import prompt_cache
+from routing_engine import RoutingTable
+from spend_guard import spend_guard, Reservation
+from token_budget import token_counter
+
+logger = logging.getLogger(__name__)
+
+llm_analytics_batch = Histogram(
+    'llm_analytics_batch_size',
+    'Usage records written per Redis pipeline',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+llm_analytics_dropped = Counter(
+    'llm_analytics_dropped_total',
+    'Usage records dropped because the write buffer was full'
+)
+
+llm_streams = Counter(
+    'llm_streams_total',
+    'Streamed completions by outcome',
+    ['model', 'status']  # status: completed/client_disconnected/error
+)
+
+ANALYTICS_TTL = 30 * 24 * 3600
+
+
+def usage_dict(usage: Any) -> Dict[str, Any]:
+    """Usage do LiteLLM (objeto ou dict) como dict serializável"""
+    if not usage:
+        return {}
+    if isinstance(usage, dict):
+        return usage
+    for attr in ("model_dump", "dict"):
+        to_dict = getattr(usage, attr, None)
+        if to_dict:
+            return to_dict()
+    return {k: getattr(usage, k, 0) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+
+def usage_cost(table: RoutingTable, model: str, usage: Dict[str, Any]) -> Tuple[float, int, int, float]:
+    """(custo descontado o cache de prompt, tokens, tokens do cache, economia) de uma chamada"""
+    if not usage:
+        return 0.0, 0, 0, 0.0
+    tokens = usage.get("total_tokens") or usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    cached_tokens, cache_savings = prompt_cache.savings(model, usage, table.model_info(model))
+    cost = max(0.0, tokens * table.cost_per_token(model) - cache_savings)
+    return cost, tokens, cached_tokens, cache_savings
+
+
+def chunk_text(chunk: Any) -> Optional[str]:
+    """Texto gerado em um chunk de streaming"""
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return None
+    return getattr(choices[0].delta, "content", None)
+
+
+def build_usage_record(
+    model: str,
+    metadata: Dict[str, Any],
+    usage: Dict[str, Any],
+    duration: float,
+    cost: float,
+    cached_tokens: int = 0,
+    cache_savings: float = 0.0,
+    **extra
+) -> Dict[str, Any]:
+    """Registro de analytics (formato lido por calculate_usage)"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "model": model,
+        "organization_id": metadata.get("organization_id"),
+        "user_id": metadata.get("user_id"),
+        "conversation_id": metadata.get("conversation_id"),
+        "duration": duration,
+        "cost": cost,
+        "tokens": usage,
+        "cached_tokens": cached_tokens,
+        "cache_savings": cache_savings,
+        "intent": metadata.get("intent"),
+        "tier": model.split("/")[0] if "/" in model else "unknown",
+        **extra
+    }
+
+
+class AnalyticsWriter:
+    """
+    Grava registros de uso no Redis em lote.
+
+    record() só enfileira em memória; um pipeline por flush_interval_ms (ou
+    quando o buffer atinge max_batch) grava todos com SETEX. Se o Redis falhar,
+    os registros voltam para o buffer até max_buffer.
+    """
+
+    def __init__(self, redis_client, flush_interval_ms: float = 200, max_batch: int = 500, max_buffer: int = 50000):
+        self.redis = redis_client
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self._buffer: List[Tuple[str, str]] = []
+        self._wake = asyncio.Event()
+
+    def configure(self, settings: Dict[str, Any]):
+        self.flush_interval = settings.get("flush_interval_ms", 200) / 1000
+        self.max_batch = settings.get("max_batch", 500)
+        self.max_buffer = settings.get("max_buffer", 50000)
+
+    def record(self, data: Dict[str, Any], record_id: Optional[str] = None):
+        if len(self._buffer) >= self.max_buffer:
+            llm_analytics_dropped.inc()
+            return
+
+        key = f"llm_analytics:{data['organization_id']}:{datetime.utcnow().strftime('%Y%m%d')}:{record_id}"
+        self._buffer.append((key, json.dumps(data)))
+        if len(self._buffer) >= self.max_batch:
+            self._wake.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, value in batch:
+                        pipe.setex(key, ANALYTICS_TTL, value)
+                    await pipe.execute()
+                llm_analytics_batch.observe(len(batch))
+            except Exception as e:
+                logger.warning(f"Error writing usage records, retrying later: {e}")
+                self._buffer = batch + self._buffer[:max(0, self.max_buffer - len(batch))]
+                return
+
+
+class StreamAccounting:
+    """
+    Contabiliza um stream SSE do início ao fim.
+
+    Conta tokens de completion incrementalmente e prefere o chunk de usage do
+    provider quando existe. Se o cliente desconecta, fecha a requisição ao
+    provider e contabiliza o que foi gerado. finish() é idempotente e roda no
+    fim do stream e na background task da resposta, então cada stream gera um
+    único evento de uso (métricas, orçamento, fila e analytics).
+    """
+
+    def __init__(
+        self,
+        table: RoutingTable,
+        writer: Optional[AnalyticsWriter],
+        model: str,
+        metadata: Dict[str, Any],
+        prompt_tokens: int,
+        reservation: Optional[Reservation],
+        started: float,
+        upstream: Any,
+        first_chunks: Optional[List[Any]] = None
+    ):
+        self.table = table
+        self.writer = writer
+        self.model = model
+        self.metadata = metadata
+        self.prompt_tokens = prompt_tokens
+        self.reservation = reservation
+        self.started = started
+        self.upstream = upstream
+        self.first_chunks = first_chunks or []
+        self.completion_tokens = 0
+        self.usage: Optional[Dict[str, Any]] = None
+        self.response_id: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.status = "client_disconnected"
+        self.finished = False
+        self.upstream_closed = False
+        active_llm_requests.labels(model=model).inc()
+
+    async def stream(self) -> AsyncIterator[Any]:
+        """Repassa os chunks do provider contando o uso"""
+        try:
+            for chunk in self.first_chunks:
+                self._observe(chunk)
+                yield chunk
+            async for chunk in self.upstream:
+                self._observe(chunk)
+                yield chunk
+            self.status = "completed"
+        except Exception:
+            self.status = "error"
+            raise
+        finally:
+            # Sem await aqui: com o cliente desconectado o escopo já está cancelado;
+            # o fechamento do provider fica com close() (background task da resposta)
+            self.finish()
+
+    def _observe(self, chunk: Any):
+        if self.response_id is None:
+            self.response_id = getattr(chunk, "id", None)
+
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            self.usage = usage_dict(usage)
+            return
+
+        text = chunk_text(chunk)
+        if text:
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self.started
+            self.completion_tokens += token_counter.count_text(text, self.model)
+
+    async def close(self):
+        """Background task da resposta: garante a contabilização após desconexão"""
+        self.finish()
+        if self.status != "completed":
+            await self.close_upstream()
+
+    async def close_upstream(self):
+        """Cancela a geração no provider (melhor esforço)"""
+        if self.upstream_closed:
+            return
+        self.upstream_closed = True
+
+        for target in (self.upstream, getattr(self.upstream, "completion_stream", None)):
+            closer = getattr(target, "aclose", None) or getattr(target, "close", None)
+            if closer is None:
+                continue
+            try:
+                result = closer()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.debug(f"Error closing upstream stream: {e}")
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+
+        model = self.model
+        tier = model.split("/")[0] if "/" in model else "unknown"
+        duration = time.perf_counter() - self.started
+        organization_id = self.metadata.get("organization_id", "unknown")
+
+        # Usage do provider quando enviado; senão a contagem incremental
+        usage = self.usage or {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+        }
+        cost, tokens, cached_tokens, cache_savings = usage_cost(self.table, model, usage)
+
+        active_llm_requests.labels(model=model).dec()
+        llm_streams.labels(model=model, status=self.status).inc()
+        llm_requests.labels(
+            model=model, tier=tier, status="success" if self.status == "completed" else self.status
+        ).inc()
+        llm_tokens.labels(model=model, type="prompt").inc(usage.get("prompt_tokens", 0))
+        llm_tokens.labels(model=model, type="completion").inc(usage.get("completion_tokens", 0))
+        llm_latency.labels(model=model, tier=tier).observe(duration)
+        if cost > 0:
+            llm_cost.labels(model=model, organization=organization_id).inc(cost)
+        prompt_cache.record(model, organization_id, cached_tokens, cache_savings)
+
+        if self.status == "completed":
+            health_tracker.record_success(model, duration, self.ttft)
+        elif self.status == "error":
+            health_tracker.record_failure(model)
+
+        fair_scheduler.record_tokens(organization_id, usage.get("completion_tokens", 0))
+        spend_guard.commit(self.reservation, cost, tokens)
+
+        if self.writer is not None:
+            self.writer.record(
+                build_usage_record(
+                    model, self.metadata, usage, duration, cost, cached_tokens, cache_savings,
+                    stream=True,
+                    status=self.status,
+                    usage_source="provider" if self.usage else "counted",
+                    ttft=self.ttft
+                ),
+                record_id=self.response_id
+            )